@@ -0,0 +1,55 @@
+"""Micro-benchmark for the cipclient packet encoder and decoder.
+
+Run from the repository root:
+
+    python benchmarks/codec.py [--number N] [--repeat R]
+
+Reports the best time per call in nanoseconds, so results can be compared
+between releases.
+"""
+
+# Standard Imports
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import cipclient  # noqa: E402
+
+CASES = [
+    ("encode d", "encode('d', 1234, 1)"),
+    ("encode db", "encode('db', 1234, 0)"),
+    ("encode a", "encode('a', 1234, 32456)"),
+    ("encode s (16 chars)", "encode('s', 1234, 'Hello Crestron!!')"),
+    ("decode d", "decode(digital)"),
+    ("decode a", "decode(analog)"),
+    ("decode s (16 chars)", "decode(serial)"),
+]
+
+
+def main():
+    """Time each case and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    namespace = {
+        "encode": cipclient.encode,
+        "decode": cipclient.decode,
+        "digital": cipclient.encode("d", 1234, 1),
+        "analog": cipclient.encode("a", 1234, 32456),
+        "serial": cipclient.encode("s", 1234, "Hello Crestron!!"),
+    }
+
+    print(f"{'case':<24}{'ns/call':>10}")
+    for name, statement in CASES:
+        timer = timeit.Timer(statement, globals=namespace)
+        best = min(timer.repeat(repeat=args.repeat, number=args.number))
+        print(f"{name:<24}{best / args.number * 1e9:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""End-to-end benchmark of a cipclient client against the fake processor.
+
+Run from the repository root:
+
+    python benchmarks/endtoend.py [--client socket|pool] [--joins N]
+                                  [--samples N] [--write-size N] [--no-reconnect]
+
+Reports joins per second in each direction, p50/p99 round-trip latency of a
+join echoed by the processor, and the time taken to reconnect after the
+processor drops the connection.
+"""
+
+# Standard Imports
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import cipclient  # noqa: E402
+import cipfake  # noqa: E402
+
+IPID = 0x03
+JOINS = range(1, 1001)
+LATENCY_JOIN = 2000
+
+
+def wait_until(predicate, timeout):
+    """Poll `predicate` until it is true.  Returns False on timeout."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def percentile(samples, fraction):
+    """Return the given percentile of a sorted list of samples."""
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def outgoing(cip, processor, count):
+    """Return the rate at which joins set on the client reach the processor."""
+    expected = processor.counters["joins"] + count
+    start = time.perf_counter()
+    for index in range(count):
+        cip.set("a", JOINS[index % len(JOINS)], index // len(JOINS))
+    if not processor.wait_received(expected, timeout=60):
+        raise RuntimeError("timed out waiting for the processor")
+    return count / (time.perf_counter() - start)
+
+
+def incoming(cip, processor, count):
+    """Return the rate at which joins set on the processor reach callbacks."""
+    received = 0
+    done = threading.Event()
+
+    def callback(sigtype, join, value):
+        nonlocal received
+        received += 1
+        if received == count:
+            done.set()
+
+    handle = cip.subscribe_range("a", JOINS[0], JOINS[-1], callback)
+    start = time.perf_counter()
+    for first in range(0, count, len(JOINS)):
+        processor.set_many(
+            ("a", JOINS[index % len(JOINS)], index // len(JOINS) + 1)
+            for index in range(first, min(first + len(JOINS), count))
+        )
+    if not done.wait(timeout=60):
+        raise RuntimeError("timed out waiting for callbacks")
+    elapsed = time.perf_counter() - start
+    cip.unsubscribe(handle)
+    return count / elapsed
+
+
+def latency(cip, processor, samples):
+    """Return the sorted round-trip times of joins echoed by the processor."""
+    echoed = threading.Event()
+    expected = None
+
+    def callback(sigtype, join, value):
+        if value == expected:
+            echoed.set()
+
+    handle = cip.subscribe("a", LATENCY_JOIN, callback)
+    processor.echo = True
+    times = []
+    for index in range(samples):
+        expected = index
+        echoed.clear()
+        start = time.perf_counter()
+        cip.set("a", LATENCY_JOIN, index)
+        if not echoed.wait(timeout=10):
+            raise RuntimeError("timed out waiting for an echo")
+        times.append(time.perf_counter() - start)
+    processor.echo = False
+    cip.unsubscribe(handle)
+    return sorted(times)
+
+
+def reconnect(cip, processor):
+    """Return the seconds taken to resynchronize after a processor disconnect."""
+    start = time.perf_counter()
+    processor.disconnect()
+    if not wait_until(lambda: not cip.connected, 10):
+        raise RuntimeError("the client did not notice the disconnect")
+    if not cip.wait_connected(120):
+        raise RuntimeError("the client did not reconnect")
+    return time.perf_counter() - start
+
+
+def main():
+    """Run each benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--client", choices=("socket", "pool"), default="socket")
+    parser.add_argument("--joins", type=int, default=100000)
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--write-size", type=int, default=None)
+    parser.add_argument("--no-reconnect", action="store_true")
+    args = parser.parse_args()
+
+    processor = cipfake.FakeProcessor(write_size=args.write_size)
+    processor.start()
+    pool = None
+    if args.client == "pool":
+        pool = cipclient.CIPClientPool()
+        pool.start()
+        cip = pool.add_client("127.0.0.1", IPID, port=processor.port)
+    else:
+        cip = cipclient.CIPSocketClient("127.0.0.1", IPID, port=processor.port)
+    cip.start()
+    if not cip.wait_connected(10):
+        raise RuntimeError("the client did not connect")
+
+    try:
+        print(f"{'outgoing joins/s':<24}{outgoing(cip, processor, args.joins):>12.0f}")
+        print(f"{'incoming joins/s':<24}{incoming(cip, processor, args.joins):>12.0f}")
+        times = latency(cip, processor, args.samples)
+        print(f"{'round trip p50 (us)':<24}{percentile(times, 0.50) * 1e6:>12.0f}")
+        print(f"{'round trip p99 (us)':<24}{percentile(times, 0.99) * 1e6:>12.0f}")
+        if not args.no_reconnect:
+            print(f"{'reconnect (s)':<24}{reconnect(cip, processor):>12.2f}")
+    finally:
+        cip.stop()
+        if pool is not None:
+            pool.stop()
+        processor.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Replay a recorded CIP session into a client as fast as it can be processed.
+
+Run from the repository root:
+
+    python benchmarks/replay.py [SESSION] [--client direct|socket]
+                                [--speed X] [--subscribers N] [--joins N]
+
+SESSION is a file written by cipclient.SessionRecorder.  Without one, a
+session of --joins analog joins is recorded from the fake processor first.
+"direct" feeds the packets straight into a client's packet processing;
+"socket" serves them to a CIPSocketClient from a local ReplayProcessor.
+Reports packets, joins and subscriber callbacks per second, with
+--subscribers wildcard subscriptions (at least one) per signal type.
+"""
+
+# Standard Imports
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import cipclient  # noqa: E402
+import cipfake  # noqa: E402
+
+IPID = 0x03
+
+
+def record(path, joins):
+    """Record a session in which the processor sends `joins` analog joins."""
+    processor = cipfake.FakeProcessor()
+    processor.start()
+    recorder = cipclient.SessionRecorder(path)
+    cip = cipclient.CIPSocketClient("127.0.0.1", IPID, port=processor.port)
+    cip.set_tracer(recorder)
+    cip.start()
+    try:
+        if not cip.wait_connected(10):
+            raise RuntimeError("the client did not connect")
+        for first in range(0, joins, 1000):
+            processor.set_many(
+                ("a", index % 1000 + 1, index // 1000 + 1)
+                for index in range(first, min(first + 1000, joins))
+            )
+        last = joins - 1
+        if cip.wait_for("a", last % 1000 + 1, last // 1000 + 1, timeout=60) is None:
+            raise RuntimeError("timed out waiting for the recorded joins")
+    finally:
+        cip.stop()
+        processor.stop()
+        recorder.close()
+
+
+def count_joins(path):
+    """Return the number of packets and incoming joins in a session file."""
+    replay = cipclient.SessionReplay(path)
+    frames = [
+        ciptype == 0x12
+        or (ciptype == 0x05 and len(payload) > 3 and payload[3] in (0x00, 0x14))
+        for timestamp, direction, ciptype, payload in replay.frames("rx")
+    ]
+    replay.close()
+    return len(frames), sum(frames)
+
+
+def subscribe(cip, subscribers, done, expected):
+    """Add wildcard subscriptions and return a list holding the callback count."""
+    count = [0]
+    lock = threading.Lock()
+
+    def callback(sigtype, join, value):
+        with lock:
+            count[0] += 1
+            if count[0] == expected:
+                done.set()
+
+    for sigtype in ("d", "a", "s"):
+        for index in range(subscribers):
+            cip.subscribe_all(sigtype, callback)
+    return count
+
+
+def direct(path, speed, subscribers, joins):
+    """Replay into an unconnected pooled client, which applies joins inline.
+
+    Returns the elapsed seconds and the number of callbacks made.
+    """
+    pool = cipclient.CIPClientPool()
+    cip = pool.add_client("127.0.0.1", IPID)
+    count = subscribe(cip, subscribers, threading.Event(), joins * subscribers)
+    replay = cipclient.SessionReplay(path)
+    start = time.perf_counter()
+    replay.replay(cip, speed)
+    elapsed = time.perf_counter() - start
+    replay.close()
+    return elapsed, count[0]
+
+
+def served(path, speed, subscribers, joins):
+    """Replay over a local socket into a CIPSocketClient.
+
+    Returns the seconds until the last callback and the number of callbacks.
+    """
+    processor = cipfake.ReplayProcessor(path, speed=speed)
+    processor.start()
+    cip = cipclient.CIPSocketClient("127.0.0.1", IPID, port=processor.port)
+    done = threading.Event()
+    count = subscribe(cip, subscribers, done, joins * subscribers)
+    start = time.perf_counter()
+    cip.start()
+    try:
+        if not done.wait(timeout=600):
+            raise RuntimeError("timed out waiting for callbacks")
+        elapsed = time.perf_counter() - start
+    finally:
+        cip.stop()
+        processor.stop()
+    return elapsed, count[0]
+
+
+def main():
+    """Run the replay and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("session", nargs="?")
+    parser.add_argument("--client", choices=("direct", "socket"), default="direct")
+    parser.add_argument("--speed", type=float, default=None)
+    parser.add_argument("--subscribers", type=int, default=1)
+    parser.add_argument("--joins", type=int, default=100000)
+    args = parser.parse_args()
+    if args.subscribers < 1:
+        parser.error("--subscribers must be at least 1")
+
+    path = args.session
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "session.cipr")
+        record(path, args.joins)
+    packets, joins = count_joins(path)
+
+    run = direct if args.client == "direct" else served
+    elapsed, callbacks = run(path, args.speed, args.subscribers, joins)
+    print(f"{'packets replayed':<24}{packets:>12}")
+    print(f"{'packets/s':<24}{packets / elapsed:>12.0f}")
+    print(f"{'joins/s':<24}{joins / elapsed:>12.0f}")
+    print(f"{'callbacks/s':<24}{callbacks / elapsed:>12.0f}")
+    if args.session is None:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    main()
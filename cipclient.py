@@ -1,15 +1,420 @@
 """A Python module for communicating with a Crestron control processor via CIP."""
 
 # Standard Imports
+import array
+import asyncio
 import binascii
+import bisect
+import collections
+import contextlib
+import contextvars
+import errno
+import heapq
+import itertools
 import logging
+import mmap
+import os
 import queue
+import random
+import selectors
 import socket
+import struct
 import threading
 import time
 
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python 3.7
+    shared_memory = None
+
 _logger = logging.getLogger(__name__)
 
+_HEARTBEAT_INTERVAL = 15  # seconds of TX silence before a heartbeat is sent
+_BUTTON_REPEAT_INTERVAL = 0.5  # seconds between button-style join repeats
+_CIP_MAX_FRAME_SIZE = 3 + 0xFFFF  # type byte, 16-bit length, payload
+_MIN_RECONNECT_DELAY = 0.25  # seconds to wait before the first reconnect
+_MAX_RECONNECT_DELAY = 10  # longest wait between reconnect attempts
+_MAX_JOIN = {"d": 0x8000, "a": 0x10000, "s": 0x10000}  # highest join by sigtype
+_MAX_SERIAL_CHUNK = 0xFFFF - 8  # largest serial value that fits in one packet
+_MAX_SERIAL_SIZE = 0x1000000  # largest chunked serial value that is reassembled
+_SERIAL_START = 0x01  # serial packet flag: first chunk of a value
+_SERIAL_END = 0x02  # serial packet flag: last chunk of a value
+_MIN_DATA_LENGTH = {0x00: 6, 0x03: 5, 0x14: 8}  # shortest data payload by datatype
+_MIN_SERIAL_LENGTH = 8  # shortest serial join payload
+_TX_BATCH_SIZE = 65536  # most bytes taken from the transmit queue per send
+_TX_LEVELS = ("control", "joins", "bulk")  # transmit priorities, highest first
+_TX_LIMITS = {"bulk": 0x100000}  # default bytes queued per priority before waiting
+
+# transmit priority levels, indexes into _TX_LEVELS
+_PRIORITY_CONTROL = 0  # heartbeats, registration and update request traffic
+_PRIORITY_JOINS = 1  # join changes and button repeats
+_PRIORITY_BULK = 2  # serial values that span several packets
+
+_STATE_MAGIC = b"CIPS"  # identifies a shared join state segment
+_STATE_LAYOUT = 1  # version of the shared join state layout
+_STATE_CONNECTED = 0x01  # shared state flag: the publishing client is connected
+_STATE_BYTES = 0x02  # shared state flag: serial values are bytes, not str
+_SESSION_MAGIC = b"CIPR"  # identifies a recorded session file
+_SESSION_VERSION = 1  # version of the recorded session file format
+_REPLAY_BATCH = 1024  # most frames replayed before incoming joins are applied
+
+# joins collected by CIP client batch() blocks, keyed by client
+_batches = contextvars.ContextVar("cipclient_batches", default=None)
+
+# names of the shared memory segments exported by this process
+_exported = set()
+
+
+_DIGITAL_HEADER = b"\x05\x00\x06\x00\x00\x03\x00"  # standard digital join
+_BUTTON_HEADER = b"\x05\x00\x06\x00\x00\x03\x27"  # button/pulse digital join
+_ANALOG_HEADER = b"\x05\x00\x08\x00\x00\x05\x14"  # analog join
+
+_DIGITAL_FRAME = struct.Struct("<7sH")  # header, little-endian join | release bit
+_ANALOG_FRAME = struct.Struct(">7sHH")  # header, join, value
+_SERIAL_HEADER = struct.Struct(">BHHHBHB")  # type, length, 0, length, 0x34, join, flags
+_UINT16_LE = struct.Struct("<H")
+_UINT16_NATIVE = struct.Struct("=H")
+_UINT32 = struct.Struct("=I")
+_UINT64 = struct.Struct("=Q")
+# magic, layout, flags, serial joins, serial slot size, serial encoding,
+# sequence number (odd while the state is being written)
+_STATE_HEADER = struct.Struct("=4sHHII16sQ")
+_STATE_FLAGS = 6  # offset of the flags in the header
+_SESSION_HEADER = struct.Struct(">4sH")  # magic, version
+_SESSION_RECORD = struct.Struct(">dBBH")  # time, 1 if tx, CIP type, length
+_STATE_SEQUENCE = _STATE_HEADER.size - 8  # offset of the sequence number
+_UINT16_PAIR = struct.Struct(">HH")
+_UINT16 = struct.Struct(">H")
+
+# digital packets only depend on (button-style, join, state), so they are
+# built once and reused
+_digital_frames = {}
+
+
+def encode(sigtype, join, value, encoding="latin-1"):
+    """Return the CIP packet that sets an outgoing join.
+
+    `sigtype` is "d", "a" or "s", or "db"/"dp" for button and pulse-style
+    digital joins.  Serial values may be bytes-like or str, which is encoded
+    with `encoding`; values too long for one packet are returned as several
+    chunk packets.  Values are not validated.
+    """
+    if sigtype[0] == "d":
+        key = (sigtype, join, value)
+        try:
+            return _digital_frames[key]
+        except KeyError:
+            cip_join = join - 1
+            if value == 0:
+                cip_join |= 0x8000
+            if sigtype == "d":
+                tx = _DIGITAL_FRAME.pack(_DIGITAL_HEADER, cip_join)
+            else:
+                tx = _DIGITAL_FRAME.pack(_BUTTON_HEADER, cip_join)
+            _digital_frames[key] = tx
+            return tx
+    elif sigtype == "a":
+        return _ANALOG_FRAME.pack(_ANALOG_HEADER, join - 1, value)
+    elif sigtype == "s":
+        if isinstance(value, str):
+            value = value.encode(encoding)
+        if len(value) <= _MAX_SERIAL_CHUNK:
+            return _serial_packet(join, value, _SERIAL_START | _SERIAL_END)
+        return b"".join(_serial_packets(join, (value,), encoding))
+    raise ValueError(f"encode(): '{sigtype}' is not a valid signal type")
+
+
+def _serial_packet(join, data, flags):
+    """Return one serial join packet carrying `data`."""
+    length = len(data)
+    return (
+        _SERIAL_HEADER.pack(0x12, 8 + length, 0, 4 + length, 0x34, join - 1, flags)
+        + data
+    )
+
+
+def _serial_packets(join, chunks, encoding="latin-1"):
+    """Yield the serial join packets for a value given as a sequence of chunks.
+
+    Chunks may be bytes-like or str and are split or combined as needed.
+    Each chunk is held back until the next one arrives, so that the end flag
+    can be set on the last packet.
+    """
+    flags = _SERIAL_START
+    pending = None
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode(encoding)
+        view = memoryview(chunk).cast("B")
+        for start in range(0, len(view), _MAX_SERIAL_CHUNK):
+            if pending is not None:
+                yield _serial_packet(join, pending, flags)
+                flags = 0
+            pending = view[start : start + _MAX_SERIAL_CHUNK]
+    yield _serial_packet(join, b"" if pending is None else pending, flags | _SERIAL_END)
+
+
+def decode(packet, encoding="latin-1"):
+    """Return (sigtype, join, value) for a CIP join packet, or None.
+
+    `packet` is a complete packet including the type and length header.
+    None is returned for packets that do not carry a join value.  Serial
+    values are decoded with `encoding`, or returned as bytes if it is None;
+    a chunk of a longer serial value is returned on its own.
+    """
+    ciptype = packet[0]
+    if ciptype == 0x05 and len(packet) >= 7:
+        datatype = packet[6]
+        if datatype == 0x00 or datatype == 0x27:
+            join, value = _decode_digital(packet, 3)
+            return "d", join, value
+        elif datatype == 0x14:
+            join, value = _decode_analog(packet, 3)
+            return "a", join, value
+    elif ciptype == 0x12:
+        join, value = _decode_serial(packet, 3, encoding)
+        return "s", join, value
+    return None
+
+
+def _decode_digital(payload, offset=0):
+    """Return (join, state) from a digital join payload."""
+    cip_join = _UINT16_LE.unpack_from(payload, offset + 4)[0]
+    return (cip_join & 0x7FFF) + 1, (cip_join >> 15) ^ 0x01
+
+
+def _decode_analog(payload, offset=0):
+    """Return (join, value) from an analog join payload."""
+    cip_join, value = _UINT16_PAIR.unpack_from(payload, offset + 4)
+    return cip_join + 1, value
+
+
+def _decode_serial(payload, offset=0, encoding="latin-1"):
+    """Return (join, value) from a serial join payload."""
+    join = _UINT16.unpack_from(payload, offset + 5)[0] + 1
+    return join, _serial_value(payload[offset + 8 :], encoding)
+
+
+def _serial_value(data, encoding):
+    """Return received serial data as str, or as bytes if `encoding` is None."""
+    if encoding is None:
+        return bytes(data)
+    return str(data, encoding, "replace")
+
+
+class _FrameDecoder:
+    """Reassemble CIP packets from a stream of socket reads."""
+
+    def __init__(self, handler, recv_size, max_frame_size):
+        """Set up the reassembly buffer."""
+        self.handler = handler
+        self.recv_size = recv_size
+        self.max_frame_size = max_frame_size
+        # the buffer starts small and only grows when a packet needs it
+        self.buffer = bytearray(2 * recv_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def reset(self):
+        """Discard any partially received packet."""
+        self.start = 0
+        self.end = 0
+
+    def writable(self):
+        """Return the free region of the buffer to read the next chunk into."""
+        return self.view[self.end :]
+
+    def feed(self, received):
+        """Process `received` bytes that were written into `writable()`.
+
+        Complete packets are passed to the handler as (type, payload) where
+        payload is a memoryview into the buffer.  Returns False if the stream
+        can no longer be framed.
+        """
+        rx = self.buffer
+        view = self.view
+        start = self.start
+        end = self.end
+
+        if _logger.isEnabledFor(logging.DEBUG):
+            rx_hex = binascii.hexlify(view[end : end + received])
+            _logger.debug(f'RX: <{str(rx_hex, "ascii")}>')
+        end += received
+        packet_length = 3
+
+        while (end - start) >= 3:
+            payload_length = (rx[start + 1] << 8) + rx[start + 2]
+            packet_length = payload_length + 3
+
+            if packet_length > self.max_frame_size:
+                _logger.warning(
+                    f"Packet length {packet_length} exceeds maximum "
+                    f"frame size {self.max_frame_size}"
+                )
+                self.reset()
+                return False
+
+            if (end - start) < packet_length:
+                # wait for the rest of the packet to arrive
+                break
+
+            self.handler(rx[start], view[start + 3 : start + packet_length])
+            start += packet_length
+            packet_length = 3
+
+        if start == end:
+            start = end = 0
+        elif len(rx) - end < self.recv_size:
+            # move the partial packet to the front, growing the buffer if the
+            # packet and the next read would not otherwise fit
+            pending = end - start
+            size = max(pending, packet_length) + self.recv_size
+            if size > len(rx):
+                # copy rather than resize, since payload views may still exist
+                self.buffer = bytearray(size)
+                self.buffer[:pending] = rx[start:end]
+                self.view = memoryview(self.buffer)
+            else:
+                rx[:pending] = rx[start:end]
+            end = pending
+            start = 0
+
+        self.start = start
+        self.end = end
+        return True
+
+
+class _TxQueue:
+    """Outgoing CIP packets waiting to be sent, in priority levels.
+
+    Items are taken from the highest priority level first and in FIFO order
+    within a level.  Items that share a key are never reordered: an item is
+    queued at a lower priority than asked for while an earlier item with the
+    same key is still waiting there.  Each level counts its queued bytes
+    against an optional limit, which producers can wait on with wait_room().
+    """
+
+    def __init__(self, limits=None):
+        """Set up the queue.  `limits` maps level names to byte limits."""
+        limits = _TX_LIMITS if limits is None else limits
+        for name in limits:
+            if name not in _TX_LEVELS[1:]:
+                raise ValueError(f"'{name}' is not a transmit priority with a limit")
+        self.limits = [limits.get(name) for name in _TX_LEVELS]
+        self.levels = [collections.deque() for name in _TX_LEVELS]
+        self.sizes = [0] * len(_TX_LEVELS)
+        self.count = 0
+        # [priority, count] of the queued items with each key
+        self.keys = {}
+        self.waiting = 0
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+    def __len__(self):
+        """Return the number of queued items."""
+        return self.count
+
+    def put(self, item, priority=_PRIORITY_JOINS, key=None):
+        """Queue a (tx, posted) item, or None to wake a blocked get().
+
+        Returns True if the queue was empty beforehand.
+        """
+        with self.lock:
+            if key is not None:
+                pending = self.keys.get(key)
+                if pending is None:
+                    self.keys[key] = [priority, 1]
+                else:
+                    if pending[0] > priority:
+                        priority = pending[0]
+                    else:
+                        pending[0] = priority
+                    pending[1] += 1
+            self.levels[priority].append((item, key))
+            if item is not None:
+                self.sizes[priority] += len(item[0])
+            self.count += 1
+            self.not_empty.notify()
+            return self.count == 1
+
+    def get(self, block=True, timeout=None):
+        """Remove and return the next item.  Raises queue.Empty like Queue.get."""
+        with self.lock:
+            if not self.count:
+                if not block or not self.not_empty.wait_for(
+                    lambda: self.count, timeout
+                ):
+                    raise queue.Empty
+            return self._pop()
+
+    def get_nowait(self):
+        """Remove and return the next item without blocking."""
+        return self.get(False)
+
+    def get_batch(self, size=None):
+        """Remove and return items in priority order without blocking.
+
+        Items are taken until at least `size` bytes have been taken, or until
+        the queue is empty if `size` is None.
+        """
+        batch = []
+        taken = 0
+        with self.lock:
+            while self.count and (size is None or taken < size):
+                item = self._pop()
+                if item is not None:
+                    batch.append(item)
+                    taken += len(item[0])
+        return batch
+
+    def full(self, priority):
+        """Return True if a level is at or over its limit."""
+        limit = self.limits[priority]
+        return limit is not None and self.sizes[priority] >= limit
+
+    def wait_room(self, priority, timeout=None):
+        """Wait until a level is below its limit.  Returns False on timeout."""
+        with self.lock:
+            self.waiting += 1
+            try:
+                return self.not_full.wait_for(lambda: not self.full(priority), timeout)
+            finally:
+                self.waiting -= 1
+
+    def clear(self):
+        """Discard every queued item."""
+        with self.lock:
+            for level in self.levels:
+                level.clear()
+            self.sizes = [0] * len(_TX_LEVELS)
+            self.count = 0
+            self.keys.clear()
+            self.not_full.notify_all()
+
+    def depths(self):
+        """Return the bytes queued at each level, keyed by gauge name."""
+        return {f"tx_{name}": size for name, size in zip(_TX_LEVELS, self.sizes)}
+
+    def _pop(self):
+        """Remove and return the next item (lock held, queue not empty)."""
+        for priority, level in enumerate(self.levels):
+            if level:
+                break
+        item, key = level.popleft()
+        self.count -= 1
+        if key is not None:
+            pending = self.keys[key]
+            pending[1] -= 1
+            if not pending[1]:
+                del self.keys[key]
+        if item is not None:
+            self.sizes[priority] -= len(item[0])
+            if self.waiting and not self.full(priority):
+                self.not_full.notify_all()
+        return item
+
 
 class SendThread(threading.Thread):
     """Process outgoing CIP packets and generates heartbeat packets."""
@@ -24,47 +429,90 @@ class SendThread(threading.Thread):
         """Start the CIP outgoing packet processing thread."""
         _logger.debug("started")
 
-        time_asleep_heartbeat = 0
-        time_asleep_buttons = 0
+        heartbeat_deadline = time.monotonic() + _HEARTBEAT_INTERVAL
+        buttons_deadline = None
+        # a packet that did not fit in the last batch starts the next one
+        carried = None
 
         while not self._stop_event.is_set():
-            while not self.cip.tx_queue.empty():
-                tx = self.cip.tx_queue.get()
-                if self.cip.restart_connection is False:
-                    _logger.debug(f"TX: <{str(binascii.hexlify(tx), 'ascii')}>")
+            deadline = heartbeat_deadline
+            if buttons_deadline is not None and buttons_deadline < deadline:
+                deadline = buttons_deadline
+
+            if carried is not None:
+                item, carried = carried, None
+            else:
+                try:
+                    timeout = max(0, deadline - time.monotonic())
+                    item = self.cip.tx_queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+            if item is not None and self.cip.restart_connection is False:
+                # coalesce queued packets, highest priority first, into a
+                # single send of up to the batch size limit, optionally
+                # waiting briefly for more packets
+                tx, posted = item
+                batch = [tx]
+                batch_posted = [posted]
+                size = len(tx)
+                flush_deadline = time.monotonic() + self.cip.max_flush_delay
+                while size < self.cip.max_batch_size:
                     try:
-                        self.cip.socket.sendall(tx)
-                    except socket.error:
-                        with self.cip.restart_lock:
-                            self.cip.restart_connection = True
-                    time_asleep_heartbeat = 0
+                        delay = flush_deadline - time.monotonic()
+                        if delay > 0:
+                            item = self.cip.tx_queue.get(timeout=delay)
+                        else:
+                            item = self.cip.tx_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        break
+                    tx, posted = item
+                    if size + len(tx) > self.cip.max_batch_size:
+                        carried = item
+                        break
+                    batch.append(tx)
+                    batch_posted.append(posted)
+                    size += len(tx)
+                if len(batch) > 1:
+                    tx = b"".join(batch)
+                else:
+                    tx = batch[0]
 
-            time.sleep(0.01)
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug(f"TX: <{str(binascii.hexlify(tx), 'ascii')}>")
+                try:
+                    self.cip.socket.sendall(tx)
+                except socket.error:
+                    self.cip._request_restart()
+                else:
+                    self.cip.metrics.sent(batch_posted)
+                    self.cip._trace_written(batch)
+                heartbeat_deadline = time.monotonic() + _HEARTBEAT_INTERVAL
+            elif item is not None:
+                self.cip.metrics.count("dropped_frames")
+
+            now = time.monotonic()
 
             if self.cip.connected is True and self.cip.restart_connection is False:
-                time_asleep_heartbeat += 0.01
-                if time_asleep_heartbeat >= 15:
-                    self.cip.tx_queue.put(b"\x0D\x00\x02\x00\x00")
-                    time_asleep_heartbeat = 0
-
-                time_asleep_buttons += 0.01
-                if time_asleep_buttons >= 0.50 and len(self.cip.buttons_pressed):
-                    with self.cip.buttons_lock:
-                        for join in self.cip.buttons_pressed:
-                            try:
-                                if self.cip.join["out"]["d"][join][0] == 1:
-                                    self.cip.tx_queue.put(
-                                        self.cip.buttons_pressed[join]
-                                    )
-                            except KeyError:
-                                pass
-                    time_asleep_buttons = 0
+                if now >= heartbeat_deadline:
+                    self.cip._send(b"\x0D\x00\x02\x00\x00", None, _PRIORITY_CONTROL)
+                    heartbeat_deadline = now + _HEARTBEAT_INTERVAL
+
+                buttons_deadline = self.cip._repeat_buttons_due(now)
+            else:
+                # nothing is due while disconnected, so just re-arm the timers
+                if now >= heartbeat_deadline:
+                    heartbeat_deadline = now + _HEARTBEAT_INTERVAL
+                buttons_deadline = None
 
         _logger.debug("stopped")
 
     def join(self, timeout=None):
         """Stop the CIP outgoing packet processing thread."""
         self._stop_event.set()
+        self.cip.tx_queue.put(None, _PRIORITY_CONTROL)
         threading.Thread.join(self, timeout)
 
 
@@ -81,45 +529,39 @@ class ReceiveThread(threading.Thread):
         """Start the CIP incoming packet processing thread."""
         _logger.debug("started")
 
+        decoder = _FrameDecoder(
+            self.cip._processPayload, self.cip.recv_size, self.cip.max_frame_size
+        )
+        sock = None
+
         while not self._stop_event.is_set():
             try:
                 if self.cip.restart_connection is False:
-                    rx = self.cip.socket.recv(4096)
-                    _logger.debug(f'RX: <{str(binascii.hexlify(rx), "ascii")}>')
-
-                    position = 0
-                    length = len(rx)
-
-                    while position < length:
-                        if (length - position) < 4:
-                            _logger.warning("Packet is too short")
-                            break
-
-                        payload_length = (rx[position + 1] << 8) + rx[position + 2]
-                        packet_length = payload_length + 3
-
-                        if (length - position) < packet_length:
-                            _logger.warning("Packet length mismatch")
-                            break
-
-                        packet_type = rx[position]
-                        payload = rx[position + 3 : position + 3 + payload_length]
-
-                        self.cip._processPayload(packet_type, payload)
-                        position += packet_length
+                    if sock is not self.cip.socket:
+                        # never stitch a partial packet onto a new connection
+                        sock = self.cip.socket
+                        decoder.reset()
+
+                    received = sock.recv_into(decoder.writable())
+                    if received == 0:
+                        _logger.debug("connection closed by control processor")
+                        self.cip._request_restart()
+                    else:
+                        self.cip._feed(decoder, received)
                 else:
-                    time.sleep(0.1)
+                    # wait for the connection thread to open a new socket
+                    self.cip._socket_event.wait()
 
             except (socket.error, socket.timeout) as e:
                 if e.args[0] != "timed out":
-                    with self.cip.restart_lock:
-                        self.cip.restart_connection = True
+                    self.cip._request_restart()
 
         _logger.debug("stopped")
 
     def join(self, timeout=None):
         """Stop the CIP incoming packet processing thread."""
         self._stop_event.set()
+        self.cip._socket_event.set()
         threading.Thread.join(self, timeout)
 
 
@@ -137,56 +579,27 @@ class EventThread(threading.Thread):
         _logger.debug("started")
 
         while not self._stop_event.is_set():
-            if not self.cip.event_queue.empty():
-                direction, sigtype, join, value = self.cip.event_queue.get()
-
-                with self.cip.join_lock:
-                    try:
-                        self.cip.join[direction][sigtype[0]][join][0] = value
-                        for callback in self.cip.join[direction][sigtype[0]][join][1:]:
-                            callback(sigtype[0], join, value)
-                    except KeyError:
-                        self.cip.join[direction][sigtype[0]][join] = [
-                            value,
-                        ]
-                _logger.debug(f"  : {sigtype} {direction} {join} = {value}")
-
-                if direction == "out":
-                    tx = bytearray(self.cip._cip_packet[sigtype])
-                    cip_join = join - 1
-                    if sigtype[0] == "d":
-                        packed_join = (cip_join // 256) + ((cip_join % 256) * 256)
-                        if value == 0:
-                            packed_join |= 0x80
-                        tx += packed_join.to_bytes(2, "big")
-                        if sigtype == "db":
-                            with self.cip.buttons_lock:
-                                if value == 1:
-                                    self.cip.buttons_pressed[join] = tx
-                                elif join in self.cip.buttons_pressed:
-                                    self.cip.buttons_pressed.pop(join)
-                    elif sigtype == "a":
-                        tx += cip_join.to_bytes(2, "big")
-                        tx += value.to_bytes(2, "big")
-                    elif sigtype == "s":
-                        tx[2] = 8 + len(value)
-                        tx[6] = 4 + len(value)
-                        tx += cip_join.to_bytes(2, "big")
-                        tx += b"\x03"
-                        tx += bytearray(value, "ascii")
-                    if (
-                        self.cip.connected is True
-                        and self.cip.restart_connection is False
-                    ):
-                        self.cip.tx_queue.put(tx)
-
-            time.sleep(0.001)
+            # wake up in time to send the latest value of throttled joins
+            deadline = self.cip._throttle_deadline
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    self.cip._flush_throttled()
+                    continue
+            try:
+                event = self.cip.event_queue.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            if event is not None:
+                self.cip._processEvents(*event)
 
         _logger.debug("stopped")
 
     def join(self, timeout=None):
         """Stop the join event processing thread."""
         self._stop_event.set()
+        self.cip.event_queue.put(None)
         threading.Thread.join(self, timeout)
 
 
@@ -213,37 +626,47 @@ class ConnectionThread(threading.Thread):
                 self.cip.socket.connect((self.cip.host, self.cip.port))
             except socket.error:
                 self.cip.socket.close()
+                self.cip.metrics.count("connect_failures")
                 if warning_posted is False:
                     _logger.debug(
                         f"attempting to connect to {self.cip.host}:{self.cip.port}, "
                         "no success yet"
                     )
                     warning_posted = True
-                if not self._stop_event.is_set():
-                    time.sleep(10)
+                self._stop_event.wait(self.cip._reconnect_delay())
             else:
                 warning_posted = False
                 _logger.debug(f"connected to {self.cip.host}:{self.cip.port}")
+                self.cip.metrics.count("connects")
                 if not self.cip.restart_connection:
                     self.cip.event_thread.start()
                     self.cip.send_thread.start()
                     self.cip.receive_thread.start()
-                self.cip.restart_connection = False
-                while (
-                    not self._stop_event.is_set()
-                    and self.cip.restart_connection is False
-                ):
-                    time.sleep(1)
+                # clear the event before the flag, so that a restart requested
+                # in between still wakes the wait below, and check the stop
+                # event in case clearing discarded the wakeup from join()
+                self.cip._restart_event.clear()
+                with self.cip.restart_lock:
+                    self.cip.restart_connection = False
+                    self.cip._socket_event.set()
+                if not self._stop_event.is_set():
+                    self.cip._restart_event.wait()
+                self.cip._set_connected(False)
                 if not self._stop_event.is_set():
-                    self.cip.connected = False
                     self.cip.socket.close()
                     _logger.debug(f"lost connection to {self.cip.host}:{self.cip.port}")
-                    time.sleep(10)
-                else:
-                    self.cip.send_thread.join()
-                    self.cip.event_thread.join()
-                    self.cip.receive_thread.join()
-
+                    self.cip.metrics.count("disconnects")
+                    self._stop_event.wait(self.cip._reconnect_delay())
+
+        # the worker threads may have been left running by an earlier
+        # connection if stop() was called while waiting to reconnect
+        for thread in (
+            self.cip.send_thread,
+            self.cip.event_thread,
+            self.cip.receive_thread,
+        ):
+            if thread.is_alive():
+                thread.join()
         self.cip.socket.close()
 
         _logger.debug("stopped")
@@ -251,93 +674,1149 @@ class ConnectionThread(threading.Thread):
     def join(self, timeout=None):
         """Stop the socket management thread."""
         self._stop_event.set()
+        self.cip._restart_event.set()
         threading.Thread.join(self, timeout)
 
 
-class CIPSocketClient:
-    """Facilitate communications with a Crestron control processor via CIP."""
+class _DispatchQueue:
+    """A bounded FIFO of callback invocations with an overflow policy."""
+
+    def __init__(self, maxsize, overflow):
+        """Set up the queue."""
+        if overflow not in ("block", "drop_oldest", "drop_newest"):
+            raise ValueError(f"'{overflow}' is not a valid overflow policy")
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.closed = False
+        self.items = collections.deque()
+        self.condition = threading.Condition()
+
+    def put(self, item, block=True):
+        """Add an item, applying the overflow policy if the queue is full.
+
+        If `block` is False, a full queue with the "block" policy grows
+        instead, so that the consumer can queue items for itself.  Returns
+        True if the queue was empty beforehand.  Items put after close() are
+        discarded.
+        """
+        with self.condition:
+            if self.maxsize and len(self.items) >= self.maxsize:
+                if self.overflow == "block":
+                    while block and len(self.items) >= self.maxsize and not self.closed:
+                        self.condition.wait()
+                elif self.overflow == "drop_oldest":
+                    self.items.popleft()
+                    self.dropped += 1
+                else:
+                    self.dropped += 1
+                    return False
+            if self.closed:
+                self.dropped += 1
+                return False
+            self.items.append(item)
+            self.condition.notify_all()
+            return len(self.items) == 1
+
+    def get(self, block=True):
+        """Remove and return the oldest item, or None if empty and not blocking."""
+        with self.condition:
+            while not self.items:
+                if not block:
+                    return None
+                self.condition.wait()
+            item = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        """Refuse further items and queue a None to stop the consumer."""
+        with self.condition:
+            self.closed = True
+            self.items.append(None)
+            self.condition.notify_all()
+
+
+class InlineExecutor:
+    """Run subscriber callbacks immediately in the thread that commits a change."""
+
+    dropped = 0
+
+    def submit(self, key, fn, *args):
+        """Run `fn(*args)` now."""
+        fn(*args)
+
+    def shutdown(self):
+        """Nothing to release."""
+
+
+class CallbackThread(threading.Thread):
+    """Run subscriber callbacks queued by a ThreadedExecutor."""
+
+    def __init__(self, queue, number):
+        """Set up the callback thread."""
+        self.queue = queue
+        threading.Thread.__init__(self, name=f"Callback-{number}", daemon=True)
+
+    def run(self):
+        """Start the callback thread."""
+        _logger.debug("started")
+
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            fn, args = item
+            try:
+                fn(*args)
+            except Exception:
+                _logger.exception("callback failed")
 
-    _cip_packet = {
-        "d": b"\x05\x00\x06\x00\x00\x03\x00",  # standard digital join
-        "db": b"\x05\x00\x06\x00\x00\x03\x27",  # button-style digital join
-        "dp": b"\x05\x00\x06\x00\x00\x03\x27",  # pulse-style digital join
-        "a": b"\x05\x00\x08\x00\x00\x05\x14",  # analog join
-        "s": b"\x12\x00\x00\x00\x00\x00\x00\x34",  # serial join
+        _logger.debug("stopped")
+
+    def join(self, timeout=None):
+        """Stop the callback thread once the queued callbacks have run."""
+        self.queue.close()
+        threading.Thread.join(self, timeout)
+
+
+class ThreadedExecutor:
+    """Run subscriber callbacks on a pool of worker threads.
+
+    Changes to the same join always go to the same worker, so callbacks for
+    a join run in order.  Each worker queues at most `maxsize` callbacks;
+    when full, `overflow` selects whether to "block" the committing thread,
+    "drop_oldest" or "drop_newest".  A callback that triggers another
+    change on its own worker queues it behind the callbacks already waiting,
+    without blocking on itself.
+    Callbacks submitted after shutdown() are discarded.
+    """
+
+    def __init__(self, workers=4, maxsize=10000, overflow="block"):
+        """Set up and start the worker threads."""
+        self._queues = [_DispatchQueue(maxsize, overflow) for _ in range(workers)]
+        self._threads = [
+            CallbackThread(queue, number) for number, queue in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def dropped(self):
+        """Number of callbacks discarded by the overflow policy."""
+        return sum(queue.dropped for queue in self._queues)
+
+    def submit(self, key, fn, *args):
+        """Queue `fn(*args)` on the worker responsible for `key`."""
+        number = hash(key) % len(self._threads)
+        block = threading.current_thread() is not self._threads[number]
+        self._queues[number].put((fn, args), block)
+
+    def shutdown(self):
+        """Run the queued callbacks and stop the worker threads."""
+        for thread in self._threads:
+            thread.join()
+
+
+class AsyncioExecutor:
+    """Run subscriber callbacks on an asyncio event loop.
+
+    Callbacks run in the order they were submitted.  At most `maxsize`
+    callbacks wait for the loop; `overflow` behaves as in ThreadedExecutor,
+    except that submitting from the loop itself never blocks.
+    """
+
+    def __init__(self, loop, maxsize=10000, overflow="block"):
+        """Set up the executor for `loop`."""
+        self.loop = loop
+        self._queue = _DispatchQueue(maxsize, overflow)
+
+    @property
+    def dropped(self):
+        """Number of callbacks discarded by the overflow policy."""
+        return self._queue.dropped
+
+    def submit(self, key, fn, *args):
+        """Schedule `fn(*args)` on the event loop."""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self.loop:
+            if self._queue.items:
+                # a drain is already scheduled and will preserve order
+                self._queue.put((fn, args), block=False)
+                return
+            fn(*args)
+        elif self._queue.put((fn, args)):
+            self.loop.call_soon_threadsafe(self._drain)
+
+    def _drain(self):
+        """Run every queued callback (event loop)."""
+        while True:
+            item = self._queue.get(block=False)
+            if item is None:
+                break
+            fn, args = item
+            try:
+                fn(*args)
+            except Exception:
+                _logger.exception("callback failed")
+
+    def shutdown(self):
+        """Nothing to release; the event loop is owned by the caller."""
+
+
+def _notify(metrics, handles, direction, sigtype, join, value, posted):
+    """Call each subscriber callback, isolating them from each other's errors."""
+    for handle in handles:
+        start = time.perf_counter()
+        try:
+            handle.callback(sigtype, join, value)
+        except Exception:
+            _logger.exception(f"callback for {sigtype} join {join} failed")
+        metrics.callback(handle.histogram, start)
+    if posted is not None and direction == "in":
+        metrics.delivered(posted)
+
+
+def _matches(predicate, value):
+    """Return True if a wait_for() predicate accepts `value`."""
+    try:
+        return bool(predicate(value))
+    except Exception:
+        _logger.exception("wait_for() predicate failed")
+        return False
+
+
+def _notify_sync(callbacks, changes):
+    """Call each sync subscriber callback with the changes from an update."""
+    for callback in callbacks:
+        try:
+            callback(changes)
+        except Exception:
+            _logger.exception("sync callback failed")
+
+
+class Histogram:
+    """Count durations in exponentially sized buckets from 1 us to ~17 s."""
+
+    bounds = tuple(1e-6 * 2**i for i in range(25))
+
+    def __init__(self):
+        """Set up empty buckets."""
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def observe(self, seconds):
+        """Record a duration."""
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def percentile(self, fraction):
+        """Return the upper bound of the bucket holding the given fraction."""
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                if index < len(self.bounds):
+                    return min(self.bounds[index], self.maximum)
+                return self.maximum
+        return 0.0
+
+    def summary(self):
+        """Return the count, sum, mean, p50, p99 and max in seconds."""
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.50),
+            "p99": self.percentile(0.99),
+            "max": self.maximum,
+        }
+
+
+class Metrics:
+    """Counters and latency histograms for a CIP client."""
+
+    def __init__(self):
+        """Set up empty metrics."""
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.rx_frames = collections.Counter()
+        self.rx_bytes = collections.Counter()
+        self.tx_frames = collections.Counter()
+        self.tx_bytes = collections.Counter()
+        self.set_to_send = Histogram()
+        self.receive_to_callback = Histogram()
+        self.callbacks = {}
+
+    def count(self, name, amount=1):
+        """Increment a named counter."""
+        with self.lock:
+            self.counters[name] += amount
+
+    def received(self, ciptype, size):
+        """Count a received packet."""
+        with self.lock:
+            self.rx_frames[ciptype] += 1
+            self.rx_bytes[ciptype] += size
+
+    def transmitted(self, ciptype, size):
+        """Count a packet handed to the transmit path."""
+        with self.lock:
+            self.tx_frames[ciptype] += 1
+            self.tx_bytes[ciptype] += size
+
+    def sent(self, posted):
+        """Record set()-to-socket latency for packets just written."""
+        now = time.perf_counter()
+        with self.lock:
+            for start in posted:
+                if start is not None:
+                    self.set_to_send.observe(now - start)
+
+    def delivered(self, posted):
+        """Record receipt-to-callback-completion latency for an incoming join."""
+        elapsed = time.perf_counter() - posted
+        with self.lock:
+            self.receive_to_callback.observe(elapsed)
+
+    def subscribed(self, handle):
+        """Give a new subscription its callback histogram under a unique name."""
+        callback = handle.callback
+        name = getattr(callback, "__qualname__", None) or repr(callback)
+        joins = handle.start
+        if handle.end != handle.start:
+            joins = f"{handle.start}-{handle.end}"
+        key = f"{handle.direction} {handle.sigtype}{joins} {name}"
+        with self.lock:
+            handle.name = key
+            number = 1
+            while handle.name in self.callbacks:
+                number += 1
+                handle.name = f"{key} #{number}"
+            self.callbacks[handle.name] = handle.histogram
+
+    def unsubscribed(self, handle):
+        """Forget the callback histogram of a removed subscription."""
+        with self.lock:
+            if self.callbacks.get(handle.name) is handle.histogram:
+                del self.callbacks[handle.name]
+
+    def callback(self, histogram, start):
+        """Record how long a subscriber callback took."""
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            histogram.observe(elapsed)
+
+    def snapshot(self):
+        """Return the counters and histogram summaries as plain dictionaries."""
+        with self.lock:
+            counters = dict(self.counters)
+            counters["rx_frames"] = dict(self.rx_frames)
+            counters["rx_bytes"] = dict(self.rx_bytes)
+            counters["tx_frames"] = dict(self.tx_frames)
+            counters["tx_bytes"] = dict(self.tx_bytes)
+            counters["heartbeats_sent"] = self.tx_frames[0x0D]
+            counters["heartbeats_received"] = (
+                self.rx_frames[0x0D] + self.rx_frames[0x0E]
+            )
+            counters["reconnects"] = max(self.counters["connects"] - 1, 0)
+            histograms = {
+                "set_to_send": self.set_to_send.summary(),
+                "receive_to_callback": self.receive_to_callback.summary(),
+                "callbacks": {
+                    key: histogram.summary()
+                    for key, histogram in self.callbacks.items()
+                },
+            }
+        return {"counters": counters, "histograms": histograms}
+
+
+class MetricsExporter(threading.Thread):
+    """Periodically pass the stats() of one or more clients to an exporter.
+
+    `export(name, stats)` is called every `interval` seconds for each client
+    in `clients`, a dictionary of name to client.
+    """
+
+    def __init__(self, clients, export, interval=10):
+        """Set up the exporter thread."""
+        self._stop_event = threading.Event()
+        self.clients = clients
+        self.export = export
+        self.interval = interval
+        threading.Thread.__init__(self, name="MetricsExporter", daemon=True)
+
+    def run(self):
+        """Start the exporter thread."""
+        _logger.debug("started")
+
+        while not self._stop_event.wait(self.interval):
+            for name, client in list(self.clients.items()):
+                try:
+                    self.export(name, client.stats())
+                except Exception:
+                    _logger.exception(f"exporting metrics for {name} failed")
+
+        _logger.debug("stopped")
+
+    def join(self, timeout=None):
+        """Stop the exporter thread."""
+        self._stop_event.set()
+        threading.Thread.join(self, timeout)
+
+
+class TraceBuffer:
+    """A tracer that keeps the most recent CIP packets in a ring buffer.
+
+    Pass an instance to set_tracer(); dump() formats the buffered packets.
+    """
+
+    def __init__(self, maxlen=1000):
+        """Set up the ring buffer."""
+        self.frames = collections.deque(maxlen=maxlen)
+
+    def __call__(self, direction, ciptype, payload):
+        """Record a packet."""
+        self.frames.append((time.time(), direction, ciptype, bytes(payload)))
+
+    def dump(self):
+        """Return the buffered packets as text, oldest first."""
+        return "\n".join(
+            f"{timestamp:.6f} {direction} 0x{ciptype:02x} "
+            f"<{str(binascii.hexlify(payload), 'ascii')}>"
+            for timestamp, direction, ciptype, payload in list(self.frames)
+        )
+
+    def clear(self):
+        """Discard the buffered packets."""
+        self.frames.clear()
+
+
+class SessionRecorder:
+    """A tracer that appends every CIP packet to a binary session file.
+
+    Pass an instance to set_tracer().  Each record holds the time.time() at
+    which the packet was received or written to the socket, its direction
+    and the packet itself.  SessionReplay reads the file back.
+    """
+
+    def __init__(self, path, buffering=65536):
+        """Create the session file, replacing any existing file."""
+        self.path = path
+        self.records = 0
+        self.lock = threading.Lock()
+        self.file = open(path, "wb", buffering=buffering)
+        self.file.write(_SESSION_HEADER.pack(_SESSION_MAGIC, _SESSION_VERSION))
+
+    def __call__(self, direction, ciptype, payload):
+        """Record a packet."""
+        record = _SESSION_RECORD.pack(
+            time.time(), direction == "tx", ciptype, len(payload)
+        )
+        with self.lock:
+            if self.file is not None:
+                self.file.write(record)
+                self.file.write(payload)
+                self.records += 1
+
+    def flush(self):
+        """Write buffered records to the file."""
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        """Flush and close the file.  Later packets are ignored."""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class SessionReplay:
+    """Read back a session file written by a SessionRecorder.
+
+    The file is memory mapped, so packets are read without copying and files
+    larger than memory can be replayed.
+    """
+
+    def __init__(self, path):
+        """Open and map a session file."""
+        self.path = path
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = (_SESSION_MAGIC, _SESSION_VERSION)
+        if (
+            len(self.map) < _SESSION_HEADER.size
+            or _SESSION_HEADER.unpack_from(self.map) != header
+        ):
+            self.map.close()
+            raise ValueError(f"'{path}' is not a CIP session file")
+
+    def frames(self, direction=None):
+        """Yield (timestamp, direction, ciptype, payload) for each packet.
+
+        Only packets in `direction` ("rx" or "tx") are yielded, unless it is
+        None.  `payload` is a memoryview into the file.  A record cut short
+        at the end of the file, as left by a recorder that was not closed,
+        is ignored.
+        """
+        view = memoryview(self.map)
+        try:
+            position = _SESSION_HEADER.size
+            end = len(view)
+            unpack = _SESSION_RECORD.unpack_from
+            while position + _SESSION_RECORD.size <= end:
+                timestamp, tx, ciptype, length = unpack(view, position)
+                position += _SESSION_RECORD.size + length
+                if position > end:
+                    break
+                name = "tx" if tx else "rx"
+                if direction is None or direction == name:
+                    yield timestamp, name, ciptype, view[position - length : position]
+        finally:
+            view.release()
+
+    def batches(self, direction="rx", speed=None, size=_REPLAY_BATCH, sleep=None):
+        """Yield lists of up to `size` frames as they fall due.
+
+        With a `speed` the original timing is kept, scaled by `speed` (1 is
+        real time), calling `sleep(seconds)` (time.sleep by default) until
+        each frame is due.  With None, frames are yielded as fast as they are
+        consumed.
+        """
+        sleep = time.sleep if sleep is None else sleep
+        batch = []
+        start = origin = None
+        for frame in self.frames(direction):
+            if speed is not None:
+                if origin is None:
+                    start = time.monotonic()
+                    origin = frame[0]
+                delay = start + (frame[0] - origin) / speed - time.monotonic()
+                if delay > 0:
+                    if batch:
+                        yield batch
+                        batch = []
+                    sleep(delay)
+            batch.append(frame)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def replay(self, cip, speed=None):
+        """Feed the received packets to a client as if they came from its socket.
+
+        Returns the number of packets replayed.  Packets the client sends in
+        response are handled as usual, so the client does not need to be
+        connected.  Incoming joins are applied as they are for a real socket;
+        for a CIPSocketClient that means by its event thread.
+        """
+        count = 0
+        for batch in self.batches("rx", speed):
+            for timestamp, direction, ciptype, payload in batch:
+                cip._processPayload(ciptype, payload)
+            cip._flush_incoming()
+            count += len(batch)
+        return count
+
+    def close(self):
+        """Unmap the file."""
+        self.map.close()
+
+
+class JoinStore:
+    """Current values of one direction's joins, kept in compact arrays.
+
+    Digital joins are stored in a bit array, analog joins in an array of
+    unsigned shorts and serial joins in a list.  Each is indexed by join
+    number and grows to the highest join in use.
+    """
+
+    def __init__(self):
+        """Set up empty join arrays."""
+        self.digital = bytearray()
+        self.analog = array.array("H")
+        self.serial = []
+
+    def get(self, sigtype, join):
+        """Return the value of a join, or the default if it was never set."""
+        if sigtype == "d":
+            index = join >> 3
+            if 0 <= index < len(self.digital):
+                return (self.digital[index] >> (join & 7)) & 1
+            return 0
+        elif sigtype == "a":
+            if 0 <= join < len(self.analog):
+                return self.analog[join]
+            return 0
+        else:
+            if 0 <= join < len(self.serial):
+                return self.serial[join]
+            return ""
+
+    def set(self, sigtype, join, value):
+        """Store the value of a join, growing the arrays as needed."""
+        if sigtype == "d":
+            index = join >> 3
+            if index >= len(self.digital):
+                self.digital.extend(bytes(index + 1 - len(self.digital)))
+            if value:
+                self.digital[index] |= 1 << (join & 7)
+            else:
+                self.digital[index] &= ~(1 << (join & 7)) & 0xFF
+        elif sigtype == "a":
+            if join >= len(self.analog):
+                self.analog.frombytes(bytes(2 * (join + 1 - len(self.analog))))
+            self.analog[join] = value
+        else:
+            if join >= len(self.serial):
+                self.serial.extend([""] * (join + 1 - len(self.serial)))
+            self.serial[join] = value
+
+    def get_range(self, sigtype, start, end):
+        """Return the values of joins `start` through `end` inclusive.
+
+        Digital and serial values are returned as a list and analog values as
+        an array('H').
+        """
+        if sigtype == "d":
+            digital = self.digital
+            size = len(digital)
+            return [
+                (digital[join >> 3] >> (join & 7)) & 1 if (join >> 3) < size else 0
+                for join in range(start, end + 1)
+            ]
+        elif sigtype == "a":
+            values = self.analog[start : end + 1]
+            values.frombytes(bytes(2 * (end + 1 - start - len(values))))
+            return values
+        else:
+            values = self.serial[start : end + 1]
+            values.extend([""] * (end + 1 - start - len(values)))
+            return values
+
+    def snapshot(self):
+        """Return {sigtype: {join: value}} for every join not at its default."""
+        digital = {}
+        for index, bits in enumerate(self.digital):
+            if bits:
+                for bit in range(8):
+                    if bits & (1 << bit):
+                        digital[(index << 3) + bit] = 1
+        analog = {join: value for join, value in enumerate(self.analog) if value}
+        serial = {join: value for join, value in enumerate(self.serial) if value}
+        return {"d": digital, "a": analog, "s": serial}
+
+
+def _state_layout(serial_joins, serial_size):
+    """Return the size of a shared join state segment and its section offsets.
+
+    The header is followed by a digital bit array, an analog array and
+    `serial_joins` serial slots of `serial_size` bytes for each direction.
+    Offsets are keyed by (direction, sigtype).  Values use the native byte
+    order, since readers run on the same host.
+    """
+    sizes = {
+        "d": ((_MAX_JOIN["d"] >> 3) + 8) & ~7,
+        "a": 2 * (_MAX_JOIN["a"] + 1),
+        "s": serial_joins * serial_size,
     }
+    offsets = {}
+    position = _STATE_HEADER.size
+    for direction in ("in", "out"):
+        for sigtype in ("d", "a", "s"):
+            offsets[(direction, sigtype)] = position
+            position += sizes[sigtype]
+    return position, offsets
+
+
+def _attach_shared_memory(name):
+    """Attach to an existing shared memory segment without owning it.
+
+    Before Python 3.13 the resource tracker would otherwise remove the
+    segment when the attaching process exits.  Segments exported by this
+    process are left registered, since they share the exporter's entry.
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        memory = shared_memory.SharedMemory(name)
+        if os.name == "posix" and memory.name not in _exported:
+            resource_tracker.unregister(memory._name, "shared_memory")
+        return memory
+
+
+class _StateExport:
+    """Publish a client's join state into a shared memory segment.
+
+    Only one thread writes at a time, under the client's join lock.  Each
+    write is bracketed by begin() and end(), which make the sequence number
+    in the header odd and then even again, so lock-free readers can detect
+    and retry reads that overlap a write (a seqlock).
+    """
+
+    def __init__(self, name, serial_joins, serial_size, encoding):
+        """Create the segment and write its header."""
+        if serial_joins < 0 or serial_size <= _UINT32.size:
+            raise ValueError(
+                f"export_state(): {serial_joins} serial joins of {serial_size} "
+                "bytes is not a valid layout"
+            )
+        size, self.offsets = _state_layout(serial_joins, serial_size)
+        self.memory = shared_memory.SharedMemory(name, create=True, size=size)
+        self.name = self.memory.name
+        _exported.add(self.name)
+        self.buffer = self.memory.buf
+        self.analog = {
+            direction: self.buffer[
+                self.offsets[(direction, "a")] : self.offsets[(direction, "s")]
+            ].cast("H")
+            for direction in ("in", "out")
+        }
+        self.serial_joins = serial_joins
+        self.serial_size = serial_size
+        self.encoding = encoding
+        self.flags = _STATE_BYTES if encoding is None else 0
+        self.sequence = 0
+        _STATE_HEADER.pack_into(
+            self.buffer,
+            0,
+            _STATE_MAGIC,
+            _STATE_LAYOUT,
+            self.flags,
+            serial_joins,
+            serial_size,
+            (encoding or "").encode("ascii"),
+            self.sequence,
+        )
 
-    def __init__(self, host, ipid, port=41794, timeout=2):
-        """Set up CIP client instance."""
-        self.host = host
+    def begin(self):
+        """Mark the start of a write."""
+        self.sequence += 1
+        _UINT64.pack_into(self.buffer, _STATE_SEQUENCE, self.sequence)
+
+    def end(self):
+        """Mark the end of a write, publishing a new version."""
+        self.sequence += 1
+        _UINT64.pack_into(self.buffer, _STATE_SEQUENCE, self.sequence)
+
+    def set(self, direction, sigtype, join, value):
+        """Store the value of a join (inside begin() and end())."""
+        if sigtype == "d":
+            index = self.offsets[(direction, "d")] + (join >> 3)
+            if value:
+                self.buffer[index] |= 1 << (join & 7)
+            else:
+                self.buffer[index] &= ~(1 << (join & 7)) & 0xFF
+        elif sigtype == "a":
+            self.analog[direction][join] = value
+        elif 0 < join <= self.serial_joins:
+            if type(value) is str:
+                value = value.encode(self.encoding, "replace")
+            slot = self.offsets[(direction, "s")] + (join - 1) * self.serial_size
+            data = value[: self.serial_size - _UINT32.size]
+            # the full length is kept so that readers can tell it was truncated
+            _UINT32.pack_into(self.buffer, slot, len(value))
+            start = slot + _UINT32.size
+            self.buffer[start : start + len(data)] = data
+
+    def set_connected(self, connected):
+        """Store whether the client is connected (inside begin() and end())."""
+        if connected:
+            self.flags |= _STATE_CONNECTED
+        else:
+            self.flags &= ~_STATE_CONNECTED
+        _UINT16_NATIVE.pack_into(self.buffer, _STATE_FLAGS, self.flags)
+
+    def close(self):
+        """Remove the segment.  Attached readers keep their mapping."""
+        for analog in self.analog.values():
+            analog.release()
+        self.analog = {}
+        self.buffer = None
+        self.memory.close()
+        self.memory.unlink()
+        _exported.discard(self.name)
+
+
+class CIPStateReader:
+    """Read-only access to join state published by a client's export_state().
+
+    Attaches to the shared memory segment by name, so any process on the same
+    host can read the state without its own connection to the processor.
+    Reads never take a lock; a read that overlaps an update by the publishing
+    client is retried.
+    """
+
+    def __init__(self, name):
+        """Attach to the shared memory segment called `name`."""
+        if shared_memory is None:
+            raise RuntimeError("CIPStateReader requires Python 3.8 or later")
+        self.memory = _attach_shared_memory(name)
+        self.buffer = self.memory.buf
+        self.analog = {}
+        (
+            magic,
+            layout,
+            flags,
+            self.serial_joins,
+            self.serial_size,
+            encoding,
+            sequence,
+        ) = _STATE_HEADER.unpack_from(self.buffer)
+        if magic != _STATE_MAGIC or layout != _STATE_LAYOUT:
+            self.close()
+            raise ValueError(f"'{name}' is not a CIP join state segment")
+        if flags & _STATE_BYTES:
+            self.encoding = None
+        else:
+            self.encoding = str(encoding.rstrip(b"\x00"), "ascii")
+        size, self.offsets = _state_layout(self.serial_joins, self.serial_size)
+        self.analog = {
+            direction: self.buffer[
+                self.offsets[(direction, "a")] : self.offsets[(direction, "s")]
+            ].cast("H")
+            for direction in ("in", "out")
+        }
+
+    @property
+    def version(self):
+        """A number that increases each time the published state changes."""
+        return _UINT64.unpack_from(self.buffer, _STATE_SEQUENCE)[0] >> 1
+
+    @property
+    def connected(self):
+        """True if the publishing client is connected to the processor."""
+        flags = self._read(
+            lambda: _UINT16_NATIVE.unpack_from(self.buffer, _STATE_FLAGS)[0]
+        )
+        return flags & _STATE_CONNECTED != 0
+
+    def get(self, sigtype, join, direction="in"):
+        """Get the current value of a join."""
+        self._check("get", sigtype, direction)
+        return self._read(lambda: self._get(direction, sigtype, join))
+
+    def get_range(self, sigtype, start, end, direction="in"):
+        """Get the current values of joins `start` through `end` inclusive."""
+        self._check("get_range", sigtype, direction)
+        if not 1 <= start <= end <= _MAX_JOIN[sigtype]:
+            raise ValueError(f"get_range(): {start} - {end} is not a valid join range")
+        return self._read(
+            lambda: [
+                self._get(direction, sigtype, join) for join in range(start, end + 1)
+            ]
+        )
+
+    def snapshot(self, direction="in"):
+        """Get {sigtype: {join: value}} for every join not at its default value."""
+        self._check("snapshot", "d", direction)
+        return self._read(lambda: self._copy(direction)).snapshot()
+
+    def wait_changed(self, version, timeout=None, interval=0.01):
+        """Poll every `interval` seconds until the version differs from `version`.
+
+        Returns the new version, or None if `timeout` seconds elapse first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self.version
+            if current != version:
+                return current
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(interval)
+
+    def close(self):
+        """Detach from the shared memory segment."""
+        for analog in self.analog.values():
+            analog.release()
+        self.analog = {}
+        self.buffer = None
+        self.memory.close()
+
+    def _check(self, method, sigtype, direction):
+        """Raise ValueError for an invalid direction or sigtype."""
+        if (direction != "in") and (direction != "out"):
+            raise ValueError(
+                f"{method}(): '{direction}' is not a valid signal direction"
+            )
+        if (sigtype != "d") and (sigtype != "a") and (sigtype != "s"):
+            raise ValueError(f"{method}(): '{sigtype}' is not a valid signal type")
+
+    def _read(self, read):
+        """Call `read` until it completes without overlapping a write."""
+        buffer = self.buffer
+        while True:
+            sequence = _UINT64.unpack_from(buffer, _STATE_SEQUENCE)[0]
+            if sequence & 1:
+                time.sleep(0)
+                continue
+            value = read()
+            if _UINT64.unpack_from(buffer, _STATE_SEQUENCE)[0] == sequence:
+                return value
+
+    def _get(self, direction, sigtype, join):
+        """Return the value of a join, or the default if it is not published."""
+        offset = self.offsets[(direction, sigtype)]
+        if sigtype == "d":
+            if 0 <= join <= _MAX_JOIN["d"]:
+                return (self.buffer[offset + (join >> 3)] >> (join & 7)) & 1
+            return 0
+        elif sigtype == "a":
+            if 0 <= join <= _MAX_JOIN["a"]:
+                return self.analog[direction][join]
+            return 0
+        elif 0 < join <= self.serial_joins:
+            slot = offset + (join - 1) * self.serial_size
+            length = min(
+                _UINT32.unpack_from(self.buffer, slot)[0],
+                self.serial_size - _UINT32.size,
+            )
+            start = slot + _UINT32.size
+            return _serial_value(self.buffer[start : start + length], self.encoding)
+        return ""
+
+    def _copy(self, direction):
+        """Return a JoinStore holding a copy of one direction's state."""
+        store = JoinStore()
+        digital = self.offsets[(direction, "d")]
+        analog = self.offsets[(direction, "a")]
+        serial = self.offsets[(direction, "s")]
+        store.digital = bytearray(self.buffer[digital:analog])
+        store.analog.frombytes(self.buffer[analog:serial])
+        store.serial = [""] + [
+            self._get(direction, "s", join) for join in range(1, self.serial_joins + 1)
+        ]
+        return store
+
+
+class SubscriptionHandle:
+    """Identifies a subscription so that it can be passed to unsubscribe()."""
+
+    def __init__(self, direction, sigtype, start, end, callback):
+        """Record what the subscription covers."""
+        self.direction = direction
+        self.sigtype = sigtype
+        self.start = start
+        self.end = end
+        self.callback = callback
+        self.name = None
+        self.histogram = Histogram()
+
+
+class _RangeIndex:
+    """Find the range subscriptions covering a join with a single bisect.
+
+    The subscribed ranges split the join numbers into elementary intervals.
+    `intervals` holds a list of the first join of each interval and a list
+    of the handles of every range covering it, in subscription order.  A
+    change only rebuilds the intervals inside the range concerned, into new
+    lists that replace `intervals` in one assignment, so lookup() needs no
+    lock and subscribing never holds up join processing.
+    """
+
+    def __init__(self):
+        """Set up an empty index."""
+        self.lock = threading.Lock()
+        self.handles = {}
+        self.intervals = ([], [])
+
+    def add(self, handle):
+        """Add a range subscription."""
+        with self.lock:
+            bounds, segments = (list(items) for items in self.intervals)
+            first = self._split(bounds, segments, handle.start)
+            last = self._split(bounds, segments, handle.end + 1)
+            for index in range(first, last):
+                segments[index] += (handle,)
+            self.handles[handle] = None
+            self.intervals = (bounds, segments)
+
+    def remove(self, handle):
+        """Remove a range subscription.  Returns False if it was not present."""
+        with self.lock:
+            if self.handles.pop(handle, False) is False:
+                return False
+            bounds, segments = (list(items) for items in self.intervals)
+            first = bisect.bisect_left(bounds, handle.start)
+            last = bisect.bisect_left(bounds, handle.end + 1)
+            for index in range(first, last):
+                segments[index] = tuple(
+                    other for other in segments[index] if other is not handle
+                )
+            # merge the intervals at each end into the one before, if they
+            # no longer differ from it
+            for index in (last, first):
+                previous = segments[index - 1] if index else ()
+                if index < len(bounds) and segments[index] == previous:
+                    del bounds[index]
+                    del segments[index]
+            self.intervals = (bounds, segments)
+            return True
+
+    def lookup(self, join):
+        """Return the handles of the ranges that include `join`."""
+        bounds, segments = self.intervals
+        index = bisect.bisect_right(bounds, join) - 1
+        if index < 0:
+            return ()
+        return segments[index]
+
+    @staticmethod
+    def _split(bounds, segments, join):
+        """Make `join` the first join of an interval and return its index."""
+        index = bisect.bisect_left(bounds, join)
+        if index == len(bounds) or bounds[index] != join:
+            bounds.insert(index, join)
+            segments.insert(index, segments[index - 1] if index else ())
+        return index
+
+
+class _CIPClientBase:
+    """Join state and CIP packet handling shared by the client implementations."""
+
+    def __init__(
+        self,
+        ipid,
+        executor=None,
+        min_reconnect_delay=_MIN_RECONNECT_DELAY,
+        max_reconnect_delay=_MAX_RECONNECT_DELAY,
+        notify_during_sync=True,
+        serial_encoding="latin-1",
+        tx_limits=None,
+    ):
+        """Set up the join state."""
         self.ipid = ipid.to_bytes(length=1, byteorder="big")
-        self.port = port
-        self.timeout = timeout
-        self.socket = None
+        self.executor = InlineExecutor() if executor is None else executor
+        self.min_reconnect_delay = min_reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.notify_during_sync = notify_during_sync
+        self.serial_encoding = serial_encoding
+        self._reconnect_attempts = 0
+        self._tracer = None
+        self.metrics = Metrics()
         self.connected = False
-        self.restart_lock = threading.Lock()
-        self.restart_connection = False
+        self._connected_event = threading.Event()
         self.buttons_pressed = {}
         self.buttons_lock = threading.Lock()
-
-        self.send_thread = SendThread(self)
-        self.receive_thread = ReceiveThread(self)
-        self.event_thread = EventThread(self)
-        self.connection_thread = ConnectionThread(self)
-
-        self.tx_queue = queue.Queue()
-        self.event_queue = queue.Queue()
+        # next repeat deadline of each held button, and a heap of
+        # (deadline, join) that may hold stale entries for released buttons
+        self._button_deadlines = {}
+        self._button_heap = []
+        self.tx_queue = _TxQueue(tx_limits)
 
         self.join_lock = threading.Lock()
-        self.join = {
+        self.join = {"in": JoinStore(), "out": JoinStore()}
+        self._subscribers = {
             "in": {"d": {}, "a": {}, "s": {}},
             "out": {"d": {}, "a": {}, "s": {}},
         }
-
-    def start(self):
-        """Start the CIP client instance."""
-        if self.connection_thread.is_alive():
-            _logger.error("start() called while already running")
-        else:
-            _logger.debug("start requested")
-            self.connection_thread.start()
-
-    def stop(self):
-        """Stop the CIP client instance."""
-        if not self.connection_thread.is_alive():
-            _logger.error("stop() called while already stopped")
-        else:
-            _logger.debug("stop requested")
-            self.connection_thread.join()
+        self._ranges = {
+            "in": {"d": _RangeIndex(), "a": _RangeIndex(), "s": _RangeIndex()},
+            "out": {"d": _RangeIndex(), "a": _RangeIndex(), "s": _RangeIndex()},
+        }
+        self._sync_subscribers = []
+        # pending wait_for() calls as [predicate, wake] lists, keyed by join
+        self._waiters = {
+            "in": {"d": {}, "a": {}, "s": {}},
+            "out": {"d": {}, "a": {}, "s": {}},
+        }
+        # incoming joins changed since the current update request was sent
+        self._syncing = False
+        self._sync_changes = {"d": {}, "a": {}, "s": {}}
+        # incoming joins decoded from the current receive buffer
+        self._incoming = []
+        # chunks of incoming serial values that span several packets
+        self._serial_chunks = {}
+        # outgoing rate limits in seconds between packets, keyed by sigtype or
+        # (sigtype, join), and the latest values held back by them
+        self._rate_limits = {}
+        self._throttled = {}
+        self._last_sent = {}
+        self._throttle_deadline = None
+        # shared memory segment the join state is published to, if any
+        self._export = None
+
+    def wait_connected(self, timeout=None):
+        """Wait until the client is registered and synchronized.
+
+        Returns False if `timeout` seconds elapse first.
+        """
+        return self._connected_event.wait(timeout)
 
     def set(self, sigtype, join, value):
         """Set an outgoing join."""
-        if sigtype == "d":
-            if (value != 0) and (value != 1):
-                _logger.error(f"set(): '{value}' is not a valid digital signal state")
-                return
-        elif sigtype == "a":
-            if (type(value) is not int) or (value > 65535):
-                _logger.error(f"set(): '{value}' is not a valid analog signal value")
-                return
-        elif sigtype == "s":
-            value = str(value)
-        else:
-            _logger.debug(f"set(): '{sigtype}' is not a valid signal type")
+        value = self._validate(sigtype, join, value)
+        if value is not None and not self._batched(sigtype, join, value):
+            if sigtype == "s" and len(value) > _MAX_SERIAL_CHUNK:
+                self._wait_tx_room(_PRIORITY_BULK)
+            else:
+                self._wait_tx_room(_PRIORITY_JOINS)
+            self._post_event("out", sigtype, join, value)
+
+    def set_many(self, joins):
+        """Set several outgoing joins at once.
+
+        `joins` is an iterable of (sigtype, join, value).  If a join appears
+        more than once only its last value is sent; otherwise joins are sent
+        in the order given.
+        """
+        batch = self._batch_pending()
+        pending = {} if batch is None else batch
+        for sigtype, join, value in joins:
+            value = self._validate(sigtype, join, value)
+            if value is not None:
+                pending[(sigtype, join)] = value
+        if batch is None:
+            self._wait_tx_room(_PRIORITY_JOINS)
+            self._post_batch(pending)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Collect set() calls made in the block and apply them together on exit.
+
+        The joins are coalesced as in set_many().  Nothing is sent if the block
+        raises an exception.  Batches are local to the calling thread or task.
+        """
+        batches = _batches.get()
+        if batches is not None and self in batches:
+            # nested batch, the outermost one applies the joins
+            yield
             return
 
-        self.event_queue.put(("out", sigtype, join, value))
+        pending = {}
+        token = _batches.set({**(batches or {}), self: pending})
+        try:
+            yield
+        finally:
+            _batches.reset(token)
+        self._post_batch(pending)
 
     def press(self, join):
         """Set a digital output join to the active state using CIP button logic."""
-        self.event_queue.put(("out", "db", join, 1))
+        self._post_event("out", "db", join, 1)
 
     def release(self, join):
         """Set a digital output join to the inactive state using CIP button logic."""
-        self.event_queue.put(("out", "db", join, 0))
+        self._post_event("out", "db", join, 0)
 
     def pulse(self, join):
         """Generate an active-inactive pulse on the specified digital output join."""
-        self.event_queue.put(("out", "dp", join, 1))
-        self.event_queue.put(("out", "dp", join, 0))
+        self._post_events("out", (("dp", join, 1), ("dp", join, 0)))
 
     def get(self, sigtype, join, direction="in"):
         """Get the current value of a join."""
@@ -347,47 +1826,643 @@ class CIPSocketClient:
             raise ValueError(f"get(): '{sigtype}' is not a valid signal type")
 
         with self.join_lock:
-            try:
-                value = self.join[direction][sigtype][join][0]
-            except KeyError:
-                if sigtype == "s":
-                    value = ""
-                else:
-                    value = 0
-        return value
+            return self.join[direction].get(sigtype, join)
+
+    def get_range(self, sigtype, start, end, direction="in"):
+        """Get the current values of joins `start` through `end` inclusive."""
+        if (direction != "in") and (direction != "out"):
+            raise ValueError(
+                f"get_range(): '{direction}' is not a valid signal direction"
+            )
+        if (sigtype != "d") and (sigtype != "a") and (sigtype != "s"):
+            raise ValueError(f"get_range(): '{sigtype}' is not a valid signal type")
+        if not 1 <= start <= end <= _MAX_JOIN[sigtype]:
+            raise ValueError(f"get_range(): {start} - {end} is not a valid join range")
+
+        with self.join_lock:
+            return self.join[direction].get_range(sigtype, start, end)
+
+    def snapshot(self, direction="in"):
+        """Get {sigtype: {join: value}} for every join not at its default value."""
+        if (direction != "in") and (direction != "out"):
+            raise ValueError(
+                f"snapshot(): '{direction}' is not a valid signal direction"
+            )
+
+        with self.join_lock:
+            return self.join[direction].snapshot()
 
     def update_request(self):
         """Send an update request to the control processor."""
         if self.connected is True:
-            self.tx_queue.put(b"\x05\x00\x05\x00\x00\x02\x03\x00")
+            self._begin_sync()
         else:
             _logger.debug("update_request(): not currently connected")
 
     def subscribe(self, sigtype, join, callback, direction="in"):
-        """Subscribe to join change events by specifying callback functions."""
+        """Subscribe to join change events by specifying callback functions.
+
+        Returns a SubscriptionHandle for unsubscribe().
+        """
+        self._check_subscription("subscribe", sigtype, direction)
+        handle = SubscriptionHandle(direction, sigtype, join, join, callback)
+        self.metrics.subscribed(handle)
+        with self.join_lock:
+            # handle lists are replaced rather than modified, so they can be
+            # dispatched outside the join lock
+            subscribers = self._subscribers[direction][sigtype]
+            subscribers[join] = subscribers.get(join, []) + [handle]
+        return handle
+
+    def subscribe_range(self, sigtype, start, end, callback, direction="in"):
+        """Subscribe to changes of joins `start` through `end` inclusive.
+
+        Returns a SubscriptionHandle for unsubscribe().
+        """
+        self._check_subscription("subscribe_range", sigtype, direction)
+        if not 1 <= start <= end <= _MAX_JOIN[sigtype]:
+            raise ValueError(
+                f"subscribe_range(): {start} - {end} is not a valid join range"
+            )
+        handle = SubscriptionHandle(direction, sigtype, start, end, callback)
+        self.metrics.subscribed(handle)
+        self._ranges[direction][sigtype].add(handle)
+        return handle
+
+    def subscribe_all(self, sigtype, callback, direction="in"):
+        """Subscribe to changes of every join of a signal type.
+
+        Returns a SubscriptionHandle for unsubscribe().
+        """
+        self._check_subscription("subscribe_all", sigtype, direction)
+        return self.subscribe_range(sigtype, 1, _MAX_JOIN[sigtype], callback, direction)
+
+    def unsubscribe(self, handle):
+        """Remove a subscription made by one of the subscribe methods.
+
+        Does nothing if the subscription was already removed.
+        """
+        direction = handle.direction
+        sigtype = handle.sigtype
+        removed = self._ranges[direction][sigtype].remove(handle)
+        if not removed:
+            with self.join_lock:
+                subscribers = self._subscribers[direction][sigtype]
+                handles = subscribers.get(handle.start, [])
+                if handle in handles:
+                    handles = handles[:]
+                    handles.remove(handle)
+                    if handles:
+                        subscribers[handle.start] = handles
+                    else:
+                        del subscribers[handle.start]
+                    removed = True
+        if removed:
+            self.metrics.unsubscribed(handle)
+
+    def set_rate_limit(self, sigtype, rate, join=None):
+        """Send at most `rate` packets per second for each outgoing join.
+
+        The limit applies to every join of `sigtype`, or only to `join` if it
+        is given, which takes precedence over a sigtype limit.  Values set
+        faster than this replace each other and the latest one is sent when
+        the interval ends.  Pass None as `rate` to remove the limit.
+        """
+        self._check_subscription("set_rate_limit", sigtype, "out")
+        if rate is not None and rate <= 0:
+            raise ValueError(f"set_rate_limit(): '{rate}' is not a valid rate")
+        key = sigtype if join is None else (sigtype, join)
+        with self.join_lock:
+            if rate is None:
+                self._rate_limits.pop(key, None)
+            else:
+                self._rate_limits[key] = 1 / rate
+
+    def send_serial(self, join, chunks):
+        """Stream a serial value to the control processor, chunk by chunk.
+
+        `chunks` is an iterable of bytes-like or str pieces of one value.
+        Each piece is sent as it is produced, so the whole value is never held
+        in memory.  Streamed values are not stored in the client's join state
+        or resent on reconnect.  Returns False if the client is not connected.
+        """
+        if (type(join) is not int) or (join < 1) or (join > _MAX_JOIN["s"]):
+            raise ValueError(f"send_serial(): '{join}' is not a valid join number")
+        if not self._online():
+            _logger.debug("send_serial(): not currently connected")
+            return False
+        for packet in _serial_packets(join, chunks, self.serial_encoding):
+            self._wait_tx_room(_PRIORITY_BULK)
+            if not self._online():
+                return False
+            self._send(packet, None, _PRIORITY_BULK, ("s", join))
+        return True
+
+    def wait_for(self, sigtype, join, predicate_or_value, timeout=None, direction="in"):
+        """Wait until a join has a matching value and return that value.
+
+        `predicate_or_value` is either a value to wait for or a function that
+        is passed each new value and returns True when it matches.  Returns
+        immediately if the join already matches, or None if `timeout` seconds
+        elapse first.  The predicate is called without any client lock held,
+        so it may read the client's state.
+        """
+        matched = threading.Event()
+        result = []
+
+        def wake(value):
+            result.append(value)
+            matched.set()
+
+        waiter = self._add_waiter(direction, sigtype, join, predicate_or_value, wake)
+        if waiter is not None and not matched.wait(timeout):
+            if not self._remove_waiter(direction, sigtype, join, waiter):
+                # matched just as the timeout expired, and is being woken
+                matched.wait()
+        return result[0] if result else None
+
+    def subscribe_sync(self, callback):
+        """Call `callback(changes)` each time an update request completes.
+
+        `changes` is {sigtype: {join: value}} for every incoming join whose
+        value changed while the processor was sending its join table.
+        """
+        with self.join_lock:
+            self._sync_subscribers = self._sync_subscribers + [callback]
+
+    def export_state(self, name=None, serial_joins=1024, serial_size=256):
+        """Publish the join state to a shared memory segment for CIPStateReader.
+
+        Returns the name of the segment, which is generated if `name` is None.
+        Serial joins above `serial_joins` are not published, and values longer
+        than `serial_size` - 4 bytes are truncated.  Call close_export() to
+        remove the segment.
+        """
+        if shared_memory is None:
+            raise RuntimeError("export_state() requires Python 3.8 or later")
+        export = _StateExport(name, serial_joins, serial_size, self.serial_encoding)
+        with self.join_lock:
+            if self._export is not None:
+                export.close()
+                raise RuntimeError("export_state() called while already exporting")
+            export.begin()
+            for direction, store in self.join.items():
+                for sigtype, joins in store.snapshot().items():
+                    for join, value in joins.items():
+                        export.set(direction, sigtype, join, value)
+            export.set_connected(self.connected)
+            export.end()
+            self._export = export
+        return export.name
+
+    def close_export(self):
+        """Stop publishing the join state and remove its shared memory segment."""
+        with self.join_lock:
+            export = self._export
+            self._export = None
+        if export is not None:
+            export.close()
+
+    def set_tracer(self, tracer):
+        """Call `tracer(direction, ciptype, payload)` for every CIP packet.
+
+        `direction` is "rx" or "tx" and `payload` is a memoryview that is only
+        valid for the duration of the call.  Outgoing packets are traced once
+        they are written, so packets discarded by a reconnect are not traced.
+        Pass None to stop tracing.
+        """
+        self._tracer = tracer
+
+    def dump_trace(self):
+        """Return the packets held by a TraceBuffer tracer as text."""
+        dump = getattr(self._tracer, "dump", None)
+        return "" if dump is None else dump()
+
+    def stats(self):
+        """Return counters, queue depths and latency histograms.
+
+        Durations are in seconds.
+        """
+        stats = self.metrics.snapshot()
+        stats["counters"]["dropped_callbacks"] = self.executor.dropped
+        stats["gauges"] = self._queue_depths()
+        return stats
+
+    def _add_waiter(self, direction, sigtype, join, predicate_or_value, wake):
+        """Register `wake(value)` to be called once when a join matches.
+
+        If the join already matches, `wake` is called immediately and None is
+        returned; otherwise the waiter is returned for _remove_waiter().  The
+        waiter is registered before the current value is tested, so no change
+        made in between is missed.
+        """
+        self._check_subscription("wait_for", sigtype, direction)
+        if callable(predicate_or_value):
+            predicate = predicate_or_value
+        else:
+
+            def predicate(value):
+                return value == predicate_or_value
+
+        waiter = [predicate, wake]
+        with self.join_lock:
+            value = self.join[direction].get(sigtype, join)
+            self._waiters[direction][sigtype].setdefault(join, []).append(waiter)
+        if _matches(predicate, value) and self._remove_waiter(
+            direction, sigtype, join, waiter
+        ):
+            wake(value)
+            return None
+        return waiter
+
+    def _remove_waiter(self, direction, sigtype, join, waiter):
+        """Discard a waiter.
+
+        Returns False if it was already removed, for example by a change that
+        matched it, so that only one caller wakes it.
+        """
+        with self.join_lock:
+            waiters = self._waiters[direction][sigtype].get(join)
+            if not waiters or waiter not in waiters:
+                return False
+            waiters.remove(waiter)
+            if not waiters:
+                del self._waiters[direction][sigtype][join]
+            return True
+
+    def _check_subscription(self, method, sigtype, direction):
+        """Raise ValueError for an invalid subscription direction or sigtype."""
         if (direction != "in") and (direction != "out"):
             raise ValueError(
-                f"subscribe(): '{direction}' is not a valid signal direction"
+                f"{method}(): '{direction}' is not a valid signal direction"
             )
         if (sigtype != "d") and (sigtype != "a") and (sigtype != "s"):
-            raise ValueError(f"subscribe(): '{sigtype}' is not a valid signal type")
+            raise ValueError(f"{method}(): '{sigtype}' is not a valid signal type")
+
+    def _validate(self, sigtype, join, value):
+        """Return the normalized value for an outgoing join, or None if invalid."""
+        if sigtype == "d":
+            if (value != 0) and (value != 1):
+                _logger.error(f"set(): '{value}' is not a valid digital signal state")
+                return None
+        elif sigtype == "a":
+            if (type(value) is not int) or (value < 0) or (value > 65535):
+                _logger.error(f"set(): '{value}' is not a valid analog signal value")
+                return None
+        elif sigtype == "s":
+            if isinstance(value, (bytes, bytearray, memoryview)):
+                # copied, since the caller may reuse the buffer
+                value = bytes(value)
+            else:
+                value = str(value)
+                if self.serial_encoding is None or not value.isascii():
+                    try:
+                        value.encode(self.serial_encoding)
+                    except (TypeError, UnicodeEncodeError):
+                        _logger.error(
+                            f"set(): '{value}' cannot be encoded as "
+                            f"{self.serial_encoding}"
+                        )
+                        return None
+        else:
+            _logger.debug(f"set(): '{sigtype}' is not a valid signal type")
+            return None
+        if (type(join) is not int) or (join < 1) or (join > _MAX_JOIN[sigtype]):
+            _logger.error(f"set(): '{join}' is not a valid join number")
+            return None
+        return value
 
+    def _batch_pending(self):
+        """Return the joins collected by this context's batch(), if any."""
+        batches = _batches.get()
+        if batches is None:
+            return None
+        return batches.get(self)
+
+    def _batched(self, sigtype, join, value):
+        """Add a join to the current batch() block, returning False if none."""
+        pending = self._batch_pending()
+        if pending is None:
+            return False
+        pending[(sigtype, join)] = value
+        return True
+
+    def _post_batch(self, pending):
+        """Post the coalesced joins collected by set_many() or batch()."""
+        if pending:
+            changes = [
+                (sigtype, join, value) for (sigtype, join), value in pending.items()
+            ]
+            self._post_events("out", changes)
+
+    def _processEvents(self, direction, changes, posted=None):
+        """Commit join changes, notify subscribers and send outgoing joins.
+
+        `changes` is a sequence of (sigtype, join, value).  The join table is
+        updated under a single acquisition of the join lock, subscribers are
+        notified through the executor once the lock is released, and
+        outgoing packets are handed to the transmit path as one buffer.
+        `posted` is the time.perf_counter() at which the changes were posted.
+        A "sync" direction marks the end of an update request.
+        """
+        if direction == "sync":
+            self._complete_sync()
+            return
+
+        debug = _logger.isEnabledFor(logging.DEBUG)
+        notify = []
+        waiting_joins = []
         with self.join_lock:
-            if join not in self.join[direction][sigtype]:
-                if sigtype == "s":
-                    value = ""
+            store = self.join[direction]
+            subscribers = self._subscribers[direction]
+            ranges = self._ranges[direction]
+            waiting = self._waiters[direction]
+            syncing = direction == "in" and self._syncing
+            quiet = syncing and not self.notify_during_sync
+            # values set while offline are sent by the resync on reconnect
+            throttle = direction == "out" and self._rate_limits and self._online()
+            if throttle:
+                now = time.monotonic()
+                unthrottled = []
+            export = self._export
+            if export is not None:
+                export.begin()
+            for sigtype, join, value in changes:
+                if syncing and store.get(sigtype[0], join) != value:
+                    self._sync_changes[sigtype[0]][join] = value
+                store.set(sigtype[0], join, value)
+                if export is not None:
+                    export.set(direction, sigtype[0], join, value)
+                handles = subscribers[sigtype[0]].get(join)
+                ranged = ranges[sigtype[0]].lookup(join)
+                if ranged:
+                    handles = handles + list(ranged) if handles else ranged
+                if handles and not quiet:
+                    notify.append((handles, sigtype[0], join, value))
+                waiters = waiting[sigtype[0]].get(join)
+                if waiters:
+                    # predicates are tested once the lock is released
+                    waiting_joins.append((sigtype[0], join, value, waiters[:]))
+                if throttle and not self._throttle(sigtype, join, value, now):
+                    unthrottled.append((sigtype, join, value))
+                if debug:
+                    _logger.debug(f"  : {sigtype} {direction} {join} = {value}")
+            if export is not None:
+                export.end()
+            if throttle:
+                changes = unthrottled
+            if direction == "out":
+                # queued under the join lock, so that when several threads set
+                # the same join the last value stored is also the last sent
+                self._send_changes(changes, posted)
+
+        woken = set()
+        for sigtype, join, value, waiters in waiting_joins:
+            for waiter in waiters:
+                if (
+                    id(waiter) not in woken
+                    and _matches(waiter[0], value)
+                    and self._remove_waiter(direction, sigtype, join, waiter)
+                ):
+                    woken.add(id(waiter))
+                    waiter[1](value)
+
+        for handles, sigtype, join, value in notify:
+            self.executor.submit(
+                (direction, sigtype, join),
+                _notify,
+                self.metrics,
+                handles,
+                direction,
+                sigtype,
+                join,
+                value,
+                posted,
+            )
+
+    def _send_changes(self, changes, posted=None):
+        """Encode outgoing join changes and hand them to the transmit path.
+
+        Consecutive digital and analog joins are sent as one buffer.  Serial
+        joins are queued separately, so a value is never sent ahead of a
+        chunked value of the same join that is still queued.  Each chunk
+        packet is queued on its own, so control traffic can be sent between
+        the chunks of a large value.
+        """
+        online = self._online()
+        packets = []
+        for sigtype, join, value in changes:
+            if sigtype == "s":
+                if online:
+                    if packets:
+                        self._send(b"".join(packets), posted)
+                        packets = []
+                    self._send_serial_value(join, value, posted)
+                continue
+            tx = encode(sigtype, join, value)
+            if sigtype == "db":
+                with self.buttons_lock:
+                    if value == 1:
+                        deadline = time.monotonic() + _BUTTON_REPEAT_INTERVAL
+                        self.buttons_pressed[join] = tx
+                        self._button_deadlines[join] = deadline
+                        heapq.heappush(self._button_heap, (deadline, join))
+                    elif join in self.buttons_pressed:
+                        self.buttons_pressed.pop(join)
+                        self._button_deadlines.pop(join)
+            packets.append(tx)
+        if packets and online:
+            if len(packets) > 1:
+                self._send(b"".join(packets), posted)
+            else:
+                self._send(packets[0], posted)
+
+    def _send_serial_value(self, join, value, posted=None):
+        """Hand an outgoing serial value to the transmit path.
+
+        A value that fits in one packet is sent with the other joins.  A
+        longer value is sent as bulk traffic, one item per chunk packet, and
+        only the last chunk records the set()-to-send latency.
+        """
+        if isinstance(value, str):
+            value = value.encode(self.serial_encoding)
+        key = ("s", join)
+        if len(value) <= _MAX_SERIAL_CHUNK:
+            tx = _serial_packet(join, value, _SERIAL_START | _SERIAL_END)
+            self._send(tx, posted, _PRIORITY_JOINS, key)
+            return
+        packets = _serial_packets(join, (value,))
+        tx = next(packets)
+        for following in packets:
+            self._send(tx, None, _PRIORITY_BULK, key)
+            tx = following
+        self._send(tx, posted, _PRIORITY_BULK, key)
+
+    def _repeat_buttons_due(self, now):
+        """Resend each held button whose repeat is due.
+
+        Returns the time.monotonic() deadline of the next repeat, or None if
+        no buttons are held.
+        """
+        heap = self._button_heap
+        deadlines = self._button_deadlines
+        with self.buttons_lock:
+            while heap:
+                deadline, join = heap[0]
+                if deadlines.get(join) != deadline:
+                    # released, or pressed again since this entry was pushed
+                    heapq.heappop(heap)
+                elif deadline <= now:
+                    if self.join["out"].get("d", join) == 1:
+                        self._send(self.buttons_pressed[join])
+                    deadlines[join] = now + _BUTTON_REPEAT_INTERVAL
+                    heapq.heapreplace(heap, (deadlines[join], join))
                 else:
-                    value = 0
-                self.join[direction][sigtype][join] = [
-                    value,
-                ]
-            self.join[direction][sigtype][join].append(callback)
+                    return deadline
+        return None
+
+    def _next_button_deadline(self):
+        """Return the deadline of the next button repeat, or None."""
+        return self._repeat_buttons_due(float("-inf"))
+
+    def _throttle(self, sigtype, join, value, now):
+        """Hold back an outgoing value if its join is over its rate limit.
+
+        Returns True if the value was held back (join lock held).  Button
+        presses, releases and pulses are edges rather than levels, so they
+        are never held back or merged.  They share the state of their digital
+        join instead: a held set() is discarded, so it can never be sent
+        after a later press(), and the edge counts towards the join's limit.
+        """
+        key = (sigtype[0], join)
+        interval = self._rate_limits.get(key)
+        if interval is None:
+            interval = self._rate_limits.get(sigtype[0])
+            if interval is None:
+                return False
+        if sigtype == "db" or sigtype == "dp":
+            self._throttled.pop(key, None)
+            self._last_sent[key] = now
+            return False
+        if key in self._throttled:
+            # a flush is already scheduled for this join
+            self._throttled[key] = (sigtype, value)
+            return True
+        last = self._last_sent.get(key)
+        if last is not None and now - last < interval:
+            self._throttled[key] = (sigtype, value)
+            self._arm_throttle(last + interval)
+            return True
+        self._last_sent[key] = now
+        return False
+
+    def _arm_throttle(self, deadline):
+        """Make sure throttled values are flushed by `deadline` (join lock held)."""
+        if self._throttle_deadline is None or deadline < self._throttle_deadline:
+            self._throttle_deadline = deadline
+            self._schedule_flush(deadline - time.monotonic())
+
+    def _schedule_flush(self, delay):
+        """Arrange for _flush_throttled() to be called after `delay` seconds."""
+        raise NotImplementedError
+
+    def _flush_throttled(self):
+        """Send the latest held-back value of each join whose interval is over."""
+        with self.join_lock:
+            now = time.monotonic()
+            self._throttle_deadline = None
+            changes = []
+            for key, (sigtype, value) in list(self._throttled.items()):
+                join = key[1]
+                interval = self._rate_limits.get(key)
+                if interval is None:
+                    interval = self._rate_limits.get(key[0], 0)
+                deadline = self._last_sent[key] + interval
+                if now >= deadline:
+                    del self._throttled[key]
+                    self._last_sent[key] = now
+                    changes.append((sigtype, join, value))
+                else:
+                    self._arm_throttle(deadline)
+            if changes:
+                self._send_changes(changes)
+
+    def _reassemble_serial(self, join, flags, data):
+        """Collect a serial value sent as several chunk packets.
+
+        Returns the value once its last chunk arrives, otherwise None.  A value
+        longer than _MAX_SERIAL_SIZE is discarded, including the chunks that
+        follow up to its last.
+        """
+        chunks = self._serial_chunks.get(join)
+        if flags & _SERIAL_START or join not in self._serial_chunks:
+            chunks = self._serial_chunks[join] = bytearray()
+        if chunks is not None:
+            chunks += data
+            if len(chunks) > _MAX_SERIAL_SIZE:
+                _logger.warning(
+                    f"Serial join {join} exceeds {_MAX_SERIAL_SIZE} bytes, discarded"
+                )
+                chunks = self._serial_chunks[join] = None
+        if flags & _SERIAL_END:
+            del self._serial_chunks[join]
+            if chunks is not None:
+                return _serial_value(chunks, self.serial_encoding)
+        return None
+
+    def _begin_sync(self):
+        """Send an update request and collect the changes it brings."""
+        with self.join_lock:
+            self._syncing = True
+        self._send(b"\x05\x00\x05\x00\x00\x02\x03\x00", None, _PRIORITY_CONTROL)
+
+    def _complete_sync(self):
+        """Pass the changes collected during an update request to subscribers.
+
+        The first update request after registering also marks the client
+        connected and resends its outgoing joins.  An update request cut short
+        by a disconnect was already abandoned by _set_connected().
+        """
+        with self.join_lock:
+            changes = self._sync_changes
+            self._sync_changes = {"d": {}, "a": {}, "s": {}}
+            connecting = self._syncing and not self.connected
+            self._syncing = False
+            callbacks = self._sync_subscribers
+        if connecting:
+            self._set_connected(True)
+            self._resync()
+        if callbacks:
+            self.executor.submit(("sync",), _notify_sync, callbacks, changes)
+
+    def _feed(self, decoder, received):
+        """Process received bytes, applying the joins they carry as one batch."""
+        framed = decoder.feed(received)
+        self._flush_incoming()
+        if not framed:
+            self._stream_error()
+
+    def _flush_incoming(self):
+        """Hand the incoming joins decoded so far to the event path."""
+        if self._incoming:
+            changes = self._incoming
+            self._incoming = []
+            self._post_events("in", changes)
 
     def _processPayload(self, ciptype, payload):
-        """Process CIP packets."""
-        _logger.debug(
-            f'> Type 0x{ciptype:02x} <{str(binascii.hexlify(payload), "ascii")}>'
-        )
+        """Process CIP packets.
+
+        `payload` may be a memoryview into the receive buffer, which is only
+        valid for the duration of this call.
+        """
+        self.metrics.received(ciptype, len(payload) + 3)
+        if self._tracer is not None:
+            self._tracer("rx", ciptype, payload)
+        debug = _logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            _logger.debug(
+                f'> Type 0x{ciptype:02x} <{str(binascii.hexlify(payload), "ascii")}>'
+            )
         length = len(payload)
         restartRequired = False
 
@@ -396,19 +2471,21 @@ class CIPSocketClient:
             _logger.debug("  Heartbeat")
         elif ciptype == 0x05:
             # data
-            datatype = payload[3]
+            datatype = payload[3] if length >= 4 else None
 
-            if datatype == 0x00:
+            if datatype is None or length < _MIN_DATA_LENGTH.get(datatype, 4):
+                self._malformed_payload(ciptype, length)
+            elif datatype == 0x00:
                 # digital join
-                join = (((payload[5] & 0x7F) << 8) | payload[4]) + 1
-                state = ((payload[5] & 0x80) >> 7) ^ 0x01
-                self.event_queue.put(("in", "d", join, state))
-                _logger.debug(f"  Incoming Digital Join {join:04} = {state}")
+                join, state = _decode_digital(payload)
+                self._incoming.append(("d", join, state))
+                if debug:
+                    _logger.debug(f"  Incoming Digital Join {join:04} = {state}")
             elif datatype == 0x14:
-                join = ((payload[4] << 8) | payload[5]) + 1
-                value = (payload[6] << 8) + payload[7]
-                self.event_queue.put(("in", "a", join, value))
-                _logger.debug(f"  Incoming Analog Join {join:04} = {value}")
+                join, value = _decode_analog(payload)
+                self._incoming.append(("a", join, value))
+                if debug:
+                    _logger.debug(f"  Incoming Analog Join {join:04} = {value}")
             elif datatype == 0x03:
                 # update request
                 update_request_type = payload[4]
@@ -421,13 +2498,14 @@ class CIPSocketClient:
                 elif update_request_type == 0x1C:
                     # end-of-query
                     _logger.debug("  End-of-query")
-                    self.tx_queue.put(b"\x05\x00\x05\x00\x00\x02\x03\x1d")
-                    self.tx_queue.put(b"\x0D\x00\x02\x00\x00")
-                    self.connected = True
-                    with self.join_lock:
-                        for sigtype, joins in self.join["out"].items():
-                            for j in joins:
-                                self.set(sigtype, j, joins[j][0])
+                    self._flush_incoming()
+                    self._send(
+                        b"\x05\x00\x05\x00\x00\x02\x03\x1d", None, _PRIORITY_CONTROL
+                    )
+                    self._send(b"\x0D\x00\x02\x00\x00", None, _PRIORITY_CONTROL)
+                    # the client is marked connected once the event path has
+                    # applied the joins that came before this
+                    self._post_events("sync", ())
                 elif update_request_type == 0x1D:
                     # end-of-query acknowledgement
                     _logger.debug("  End-of-query acknowledgement")
@@ -446,11 +2524,19 @@ class CIPSocketClient:
             else:
                 # unexpected data packet
                 _logger.debug("! We don't know what to do with this data")
+        elif ciptype == 0x12 and length < _MIN_SERIAL_LENGTH:
+            self._malformed_payload(ciptype, length)
         elif ciptype == 0x12:
-            join = ((payload[5] << 8) | payload[6]) + 1
-            value = str(payload[8:], "ascii")
-            self.event_queue.put(("in", "s", join, value))
-            _logger.debug(f"  Incoming Serial Join {join:04} = {value}")
+            join = _UINT16.unpack_from(payload, 5)[0] + 1
+            flags = payload[7]
+            if flags == _SERIAL_START | _SERIAL_END:
+                value = _serial_value(payload[8:], self.serial_encoding)
+            else:
+                value = self._reassemble_serial(join, flags, payload[8:])
+            if value is not None:
+                self._incoming.append(("s", join, value))
+                if debug:
+                    _logger.debug(f"  Incoming Serial Join {join:04} = {value}")
         elif ciptype == 0x0F:
             # registration request
             _logger.debug("  Client registration request")
@@ -459,19 +2545,21 @@ class CIPSocketClient:
                 + self.ipid
                 + b"\x40\xff\xff\xf1\x01"
             )
-            self.tx_queue.put(tx)
+            self._send(tx, None, _PRIORITY_CONTROL)
         elif ciptype == 0x02:
             # registration result
             ipid_string = str(binascii.hexlify(self.ipid), "ascii")
 
             if length == 3 and payload == b"\xff\xff\x02":
                 _logger.error(f"! The specified IPID (0x{ipid_string}) does not exist")
+                self._log_trace()
                 restartRequired = True
             elif length == 4 and payload == b"\x00\x00\x00\x1f":
                 _logger.debug(f"  Registered IPID 0x{ipid_string}")
-                self.tx_queue.put(b"\x05\x00\x05\x00\x00\x02\x03\x00")
+                self._begin_sync()
             else:
                 _logger.error(f"! Error registering IPID 0x{ipid_string}")
+                self._log_trace()
                 restartRequired = True
         elif ciptype == 0x03:
             # control system disconnect
@@ -480,7 +2568,1171 @@ class CIPSocketClient:
         else:
             # unexpected packet
             _logger.debug("! We don't know what to do with this packet")
+            self.metrics.count("unknown_frames")
 
         if restartRequired:
-            with self.restart_lock:
-                self.restart_connection = True
+            self._request_restart()
+
+    def _set_connected(self, connected):
+        """Record whether the client is registered and synchronized."""
+        self.connected = connected
+        if connected:
+            self._reconnect_attempts = 0
+        else:
+            self._serial_chunks.clear()
+        with self.join_lock:
+            if not connected:
+                # an update request cut short by the disconnect never completes
+                self._syncing = False
+                self._sync_changes = {"d": {}, "a": {}, "s": {}}
+            if self._export is not None:
+                self._export.begin()
+                self._export.set_connected(connected)
+                self._export.end()
+        if self._connected_event is not None:
+            if connected:
+                self._connected_event.set()
+            else:
+                self._connected_event.clear()
+
+    def _resync(self):
+        """Send every outgoing join that is not at its default value.
+
+        The joins are queued as they are by set(), so digital and analog
+        joins are sent as one buffer.  The join lock is held until they are
+        queued so a concurrent set() cannot be overtaken by a stale value.
+        """
+        with self.join_lock:
+            self._send_changes(
+                [
+                    (sigtype, join, value)
+                    for sigtype, joins in self.join["out"].snapshot().items()
+                    for join, value in joins.items()
+                ]
+            )
+
+    def _reconnect_delay(self):
+        """Return the time to wait before the next connection attempt.
+
+        The delay doubles with each attempt since the client was last
+        connected, up to max_reconnect_delay, and is randomly shortened by up
+        to half so clients dropped together do not reconnect in step.
+        """
+        delay = self.min_reconnect_delay * 2**self._reconnect_attempts
+        if delay < self.max_reconnect_delay:
+            self._reconnect_attempts += 1
+        else:
+            delay = self.max_reconnect_delay
+        return delay * random.uniform(0.5, 1.0)
+
+    def _account_tx(self, tx):
+        """Count each CIP packet in an outgoing buffer."""
+        transmitted = self.metrics.transmitted
+        view = memoryview(tx)
+        position = 0
+        while position + 3 <= len(view):
+            end = position + 3 + ((view[position + 1] << 8) | view[position + 2])
+            transmitted(view[position], end - position)
+            position = end
+
+    def _trace_written(self, buffers):
+        """Pass each CIP packet in outgoing buffers just written to the tracer."""
+        tracer = self._tracer
+        if tracer is None:
+            return
+        for tx in buffers:
+            view = memoryview(tx)
+            position = 0
+            while position + 3 <= len(view):
+                end = position + 3 + ((view[position + 1] << 8) | view[position + 2])
+                tracer("tx", view[position], view[position + 3 : end])
+                position = end
+
+    def _log_trace(self):
+        """Log the recent packets held by a TraceBuffer tracer, if any."""
+        trace = self.dump_trace()
+        if trace:
+            _logger.warning(f"recent CIP packets:\n{trace}")
+
+    def _malformed_payload(self, ciptype, length):
+        """Handle a received packet that is too short for its type."""
+        _logger.warning(f"Packet of type 0x{ciptype:02x} is too short ({length} bytes)")
+        self._stream_error()
+
+    def _stream_error(self):
+        """Handle a received stream that can no longer be split into packets."""
+        self.metrics.count("malformed_frames")
+        self._log_trace()
+        self._request_restart()
+
+    def _queue_depths(self):
+        """Return the current depth of the client's queues."""
+        return {}
+
+    def _wait_tx_room(self, priority):
+        """Wait while a transmit queue level is over its limit."""
+        if self.tx_queue.full(priority) and self._may_wait():
+            self.metrics.count("tx_limit_waits")
+            self.tx_queue.wait_room(priority)
+
+    def _may_wait(self):
+        """Return True if the calling thread may wait for the transmit queue."""
+        return True
+
+    def _post_event(self, direction, sigtype, join, value):
+        """Hand a single join change to the event processing path."""
+        self._post_events(direction, ((sigtype, join, value),))
+
+    def _post_events(self, direction, changes):
+        """Hand a sequence of (sigtype, join, value) changes to the event path."""
+        raise NotImplementedError
+
+    def _send(self, tx, posted=None, priority=_PRIORITY_JOINS, key=None):
+        """Hand a CIP packet to the transmit path at a priority level.
+
+        Packets with the same `key` are sent in the order they were handed
+        over, whatever their priority.
+        """
+        raise NotImplementedError
+
+    def _online(self):
+        """Return True if outgoing joins can currently be sent."""
+        raise NotImplementedError
+
+    def _request_restart(self):
+        """Drop the current connection so that it is re-established."""
+        raise NotImplementedError
+
+
+class CIPSocketClient(_CIPClientBase):
+    """Facilitate communications with a Crestron control processor via CIP."""
+
+    def __init__(
+        self,
+        host,
+        ipid,
+        port=41794,
+        timeout=2,
+        recv_size=16384,
+        max_frame_size=_CIP_MAX_FRAME_SIZE,
+        max_batch_size=65536,
+        max_flush_delay=0,
+        executor=None,
+        min_reconnect_delay=_MIN_RECONNECT_DELAY,
+        max_reconnect_delay=_MAX_RECONNECT_DELAY,
+        notify_during_sync=True,
+        serial_encoding="latin-1",
+        tx_limits=None,
+    ):
+        """Set up CIP client instance."""
+        _CIPClientBase.__init__(
+            self,
+            ipid,
+            executor,
+            min_reconnect_delay,
+            max_reconnect_delay,
+            notify_during_sync,
+            serial_encoding,
+            tx_limits,
+        )
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.recv_size = recv_size
+        self.max_frame_size = max_frame_size
+        self.max_batch_size = max_batch_size
+        self.max_flush_delay = max_flush_delay
+        self.socket = None
+        self.restart_lock = threading.Lock()
+        self.restart_connection = False
+        self._restart_event = threading.Event()
+        # set while the socket is connected and not being restarted
+        self._socket_event = threading.Event()
+
+        self.send_thread = SendThread(self)
+        self.receive_thread = ReceiveThread(self)
+        self.event_thread = EventThread(self)
+        self.connection_thread = ConnectionThread(self)
+
+        self.event_queue = queue.Queue()
+
+    def start(self):
+        """Start the CIP client instance."""
+        if self.connection_thread.is_alive():
+            _logger.error("start() called while already running")
+        else:
+            _logger.debug("start requested")
+            self.connection_thread.start()
+
+    def stop(self):
+        """Stop the CIP client instance."""
+        if not self.connection_thread.is_alive():
+            _logger.error("stop() called while already stopped")
+        else:
+            _logger.debug("stop requested")
+            self.connection_thread.join()
+
+    def _post_events(self, direction, changes):
+        """Queue join changes for the event thread."""
+        self.event_queue.put((direction, changes, time.perf_counter()))
+
+    def _send(self, tx, posted=None, priority=_PRIORITY_JOINS, key=None):
+        """Queue a CIP packet for the send thread."""
+        self._account_tx(tx)
+        self.tx_queue.put((tx, posted), priority, key)
+
+    def _queue_depths(self):
+        """Return the current depth of the client's queues."""
+        return {
+            "tx_queue": len(self.tx_queue),
+            "event_queue": self.event_queue.qsize(),
+            **self.tx_queue.depths(),
+        }
+
+    def _schedule_flush(self, delay):
+        """Nothing to do, since the event thread watches the throttle deadline."""
+
+    def _online(self):
+        """Return True if outgoing joins can currently be sent."""
+        return self.connected is True and self.restart_connection is False
+
+    def _request_restart(self):
+        """Flag the connection for a restart and wake the connection thread."""
+        with self.restart_lock:
+            self.restart_connection = True
+            self._socket_event.clear()
+        self._restart_event.set()
+
+
+class _CIPProtocol(asyncio.BufferedProtocol):
+    """Feed an asyncio transport into an AsyncCIPClient."""
+
+    def __init__(self, cip):
+        """Set up the protocol and its reassembly buffer."""
+        self.cip = cip
+        self.decoder = _FrameDecoder(
+            cip._processPayload, cip.recv_size, cip.max_frame_size
+        )
+
+    def connection_made(self, transport):
+        """Attach the new transport to the client."""
+        self.cip._connection_made(transport)
+
+    def get_buffer(self, sizehint):
+        """Return the free region of the reassembly buffer."""
+        return self.decoder.writable()
+
+    def buffer_updated(self, nbytes):
+        """Process newly received bytes."""
+        self.cip._feed(self.decoder, nbytes)
+
+    def eof_received(self):
+        """Close the transport when the control processor closes its end."""
+        _logger.debug("connection closed by control processor")
+        return False
+
+    def connection_lost(self, exc):
+        """Detach the transport from the client."""
+        self.cip._connection_lost()
+
+    def pause_writing(self):
+        """Hold back set() calls while the transport buffer is full."""
+        self.cip._writable.clear()
+
+    def resume_writing(self):
+        """Release set() calls once the transport buffer has drained."""
+        self.cip._writable.set()
+
+
+class AsyncSubscription:
+    """Asynchronous iterator over the changes of a single join."""
+
+    def __init__(self, cip, sigtype, join, direction="in", maxsize=0):
+        """Subscribe to the join and set up the change queue."""
+        self.cip = cip
+        self.sigtype = sigtype
+        self.join = join
+        self.direction = direction
+        self._closed = False
+        self._queue = asyncio.Queue(maxsize)
+        self._handle = cip.subscribe(sigtype, join, self._put, direction)
+
+    def _put(self, sigtype, join, value):
+        """Queue a change, discarding the oldest one if the queue is full."""
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait((sigtype, join, value))
+
+    def close(self):
+        """Unsubscribe and end the iteration."""
+        if not self._closed:
+            self._closed = True
+            self.cip.unsubscribe(self._handle)
+            if self._queue.full():
+                self._queue.get_nowait()
+            self._queue.put_nowait(None)
+
+    def __aiter__(self):
+        """Return the iterator itself."""
+        return self
+
+    async def __anext__(self):
+        """Wait for the next (sigtype, join, value) change."""
+        if self._closed and self._queue.empty():
+            raise StopAsyncIteration
+        change = await self._queue.get()
+        if change is None:
+            raise StopAsyncIteration
+        return change
+
+    async def __aenter__(self):
+        """Use the subscription as an asynchronous context manager."""
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        """Close the subscription when leaving the context."""
+        self.close()
+
+
+class AsyncCIPClient(_CIPClientBase):
+    """Facilitate communications with a Crestron control processor via CIP.
+
+    All I/O, heartbeats and button repeats run on the asyncio event loop that
+    calls start(), so no threads are created.  Methods must be called from
+    that event loop.  subscription() relies on callbacks running on the loop,
+    as they do with the default InlineExecutor.
+    """
+
+    def __init__(
+        self,
+        host,
+        ipid,
+        port=41794,
+        timeout=2,
+        recv_size=16384,
+        max_frame_size=_CIP_MAX_FRAME_SIZE,
+        executor=None,
+        min_reconnect_delay=_MIN_RECONNECT_DELAY,
+        max_reconnect_delay=_MAX_RECONNECT_DELAY,
+        notify_during_sync=True,
+        serial_encoding="latin-1",
+    ):
+        """Set up CIP client instance."""
+        _CIPClientBase.__init__(
+            self,
+            ipid,
+            executor,
+            min_reconnect_delay,
+            max_reconnect_delay,
+            notify_during_sync,
+            serial_encoding,
+            {},
+        )
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.recv_size = recv_size
+        self.max_frame_size = max_frame_size
+        self.transport = None
+        self._loop = None
+        self._task = None
+        self._closed = None
+        self._writable = None
+        self._connected_event = None
+        self._heartbeat_timer = None
+        self._buttons_timer = None
+        self._last_tx = 0
+
+    async def start(self):
+        """Start the CIP client instance."""
+        if self._task is not None:
+            _logger.error("start() called while already running")
+            return
+        _logger.debug("start requested")
+        self._loop = asyncio.get_event_loop()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._connected_event = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        """Stop the CIP client instance."""
+        if self._task is None:
+            _logger.error("stop() called while already stopped")
+            return
+        _logger.debug("stop requested")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def wait_connected(self, timeout=None):
+        """Wait until the client is registered and synchronized.
+
+        Returns False if `timeout` seconds elapse first.
+        """
+        if self._connected_event is None:
+            raise RuntimeError("wait_connected() called before start()")
+        try:
+            await asyncio.wait_for(self._connected_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def set(self, sigtype, join, value):
+        """Set an outgoing join."""
+        value = self._validate(sigtype, join, value)
+        if value is not None and not self._batched(sigtype, join, value):
+            await self._wait_writable()
+            self._post_event("out", sigtype, join, value)
+
+    async def set_many(self, joins):
+        """Set several outgoing joins at once (see CIPSocketClient.set_many)."""
+        await self._wait_writable()
+        _CIPClientBase.set_many(self, joins)
+
+    async def press(self, join):
+        """Set a digital output join to the active state using CIP button logic."""
+        await self._wait_writable()
+        self._post_event("out", "db", join, 1)
+        self._arm_buttons()
+
+    async def release(self, join):
+        """Set a digital output join to the inactive state using CIP button logic."""
+        await self._wait_writable()
+        self._post_event("out", "db", join, 0)
+
+    async def pulse(self, join):
+        """Generate an active-inactive pulse on the specified digital output join."""
+        await self._wait_writable()
+        self._post_events("out", (("dp", join, 1), ("dp", join, 0)))
+
+    async def wait_for(
+        self, sigtype, join, predicate_or_value, timeout=None, direction="in"
+    ):
+        """Wait until a join has a matching value and return that value.
+
+        `predicate_or_value` is either a value to wait for or a function that
+        is passed each new value and returns True when it matches.  Returns
+        immediately if the join already matches, or None if `timeout` seconds
+        elapse first.
+        """
+        future = asyncio.get_event_loop().create_future()
+
+        def wake(value):
+            if not future.done():
+                future.set_result(value)
+
+        waiter = self._add_waiter(direction, sigtype, join, predicate_or_value, wake)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if waiter is not None:
+                self._remove_waiter(direction, sigtype, join, waiter)
+
+    async def send_serial(self, join, chunks):
+        """Stream a serial value to the control processor, chunk by chunk.
+
+        Behaves like CIPSocketClient.send_serial(), waiting whenever the
+        socket's send buffer is full.
+        """
+        if (type(join) is not int) or (join < 1) or (join > _MAX_JOIN["s"]):
+            raise ValueError(f"send_serial(): '{join}' is not a valid join number")
+        if not self._online():
+            _logger.debug("send_serial(): not currently connected")
+            return False
+        for packet in _serial_packets(join, chunks, self.serial_encoding):
+            await self._wait_writable()
+            if not self._online():
+                return False
+            self._send(packet, None, _PRIORITY_BULK, ("s", join))
+            self._flush()
+        return True
+
+    def subscription(self, sigtype, join, direction="in", maxsize=0):
+        """Return an AsyncSubscription yielding (sigtype, join, value) changes.
+
+        If `maxsize` is set, the oldest unread change is discarded when the
+        subscriber falls that far behind.
+        """
+        return AsyncSubscription(self, sigtype, join, direction, maxsize)
+
+    async def _run(self):
+        """Keep the connection to the control processor open."""
+        warning_posted = False
+
+        try:
+            while True:
+                self._closed = asyncio.Event()
+                try:
+                    await asyncio.wait_for(
+                        self._loop.create_connection(
+                            lambda: _CIPProtocol(self), self.host, self.port
+                        ),
+                        self.timeout,
+                    )
+                except (OSError, asyncio.TimeoutError):
+                    self.metrics.count("connect_failures")
+                    if warning_posted is False:
+                        _logger.debug(
+                            f"attempting to connect to {self.host}:{self.port}, "
+                            "no success yet"
+                        )
+                        warning_posted = True
+                    await asyncio.sleep(self._reconnect_delay())
+                    continue
+
+                warning_posted = False
+                _logger.debug(f"connected to {self.host}:{self.port}")
+                self.metrics.count("connects")
+                await self._closed.wait()
+                _logger.debug(f"lost connection to {self.host}:{self.port}")
+                self.metrics.count("disconnects")
+                await asyncio.sleep(self._reconnect_delay())
+        finally:
+            if self.transport is not None:
+                self.transport.close()
+                self._connection_lost()
+
+    async def _wait_writable(self):
+        """Wait while the transport is applying backpressure."""
+        if self._writable is not None:
+            await self._writable.wait()
+
+    def _connection_made(self, transport):
+        """Start using a newly connected transport."""
+        self.transport = transport
+        self._last_tx = self._loop.time()
+        self._heartbeat_timer = self._loop.call_at(
+            self._last_tx + _HEARTBEAT_INTERVAL, self._heartbeat
+        )
+        self._arm_buttons()
+
+    def _connection_lost(self):
+        """Stop using the transport and wake the connection task."""
+        if self.transport is None:
+            return
+        self.transport = None
+        self._set_connected(False)
+        for timer in (self._heartbeat_timer, self._buttons_timer):
+            if timer is not None:
+                timer.cancel()
+        self._heartbeat_timer = None
+        self._buttons_timer = None
+        self.tx_queue.clear()
+        self._writable.set()
+        self._closed.set()
+
+    def _heartbeat(self):
+        """Send a heartbeat once the connection has been idle long enough."""
+        now = self._loop.time()
+        if now - self._last_tx >= _HEARTBEAT_INTERVAL:
+            if self._online():
+                self._send(b"\x0D\x00\x02\x00\x00", None, _PRIORITY_CONTROL)
+            deadline = now + _HEARTBEAT_INTERVAL
+        else:
+            deadline = self._last_tx + _HEARTBEAT_INTERVAL
+        self._heartbeat_timer = self._loop.call_at(deadline, self._heartbeat)
+
+    def _arm_buttons(self, deadline=None):
+        """Schedule the next button repeat if any buttons are held."""
+        if self._buttons_timer is None and self.transport is not None:
+            if deadline is None:
+                deadline = self._next_button_deadline()
+            if deadline is not None:
+                if not self._online():
+                    # repeats are held back until the client is online, so
+                    # don't spin on a deadline that has already passed
+                    deadline = max(deadline, time.monotonic() + _BUTTON_REPEAT_INTERVAL)
+                self._buttons_timer = self._loop.call_later(
+                    deadline - time.monotonic(), self._repeat_buttons
+                )
+
+    def _repeat_buttons(self):
+        """Resend the active state of each held button that is due."""
+        self._buttons_timer = None
+        if self._online():
+            self._arm_buttons(self._repeat_buttons_due(time.monotonic()))
+        else:
+            self._arm_buttons()
+
+    def _post_events(self, direction, changes):
+        """Process join changes immediately on the event loop."""
+        self._processEvents(direction, changes, time.perf_counter())
+
+    def _send(self, tx, posted=None, priority=_PRIORITY_JOINS, key=None):
+        """Queue a CIP packet to be written at the end of this loop iteration."""
+        if self.transport is not None:
+            self._account_tx(tx)
+            if _logger.isEnabledFor(logging.DEBUG):
+                _logger.debug(f"TX: <{str(binascii.hexlify(tx), 'ascii')}>")
+            if self.tx_queue.put((tx, posted), priority, key):
+                self._loop.call_soon(self._flush)
+            self._last_tx = self._loop.time()
+
+    def _flush(self):
+        """Write all queued CIP packets, highest priority first, in one call."""
+        batch = self.tx_queue.get_batch()
+        if batch and self.transport is not None:
+            self.transport.write(b"".join(tx for tx, posted in batch))
+            self.metrics.sent(posted for tx, posted in batch)
+            self._trace_written(tx for tx, posted in batch)
+
+    def _schedule_flush(self, delay):
+        """Flush throttled values from the event loop after `delay` seconds."""
+        self._loop.call_later(delay, self._flush_throttled)
+
+    def _queue_depths(self):
+        """Return the current depth of the client's queues."""
+        buffered = 0
+        if self.transport is not None:
+            buffered = self.transport.get_write_buffer_size()
+        return {"tx_buffer": buffered, **self.tx_queue.depths()}
+
+    def _online(self):
+        """Return True if outgoing joins can currently be sent."""
+        return self.connected is True and self.transport is not None
+
+    def _request_restart(self):
+        """Close the transport so that the connection is re-established."""
+        if self.transport is not None:
+            self.transport.close()
+
+
+class _Timer:
+    """A callback scheduled on a PoolTimerThread."""
+
+    __slots__ = ("deadline", "callback", "cancelled")
+
+    def __init__(self, deadline, callback):
+        """Set up the timer."""
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        """Prevent the callback from running."""
+        self.cancelled = True
+
+
+class PoolTimerThread(threading.Thread):
+    """Run heartbeat, button repeat and reconnect timers for a CIPClientPool."""
+
+    def __init__(self, pool):
+        """Set up the timer thread."""
+        self._stop_event = threading.Event()
+        self.pool = pool
+        self._timers = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        threading.Thread.__init__(self, name="PoolTimer")
+
+    def call_later(self, delay, callback):
+        """Run `callback` on this thread after `delay` seconds."""
+        timer = _Timer(time.monotonic() + delay, callback)
+        with self._condition:
+            heapq.heappush(self._timers, (timer.deadline, next(self._counter), timer))
+            if self._timers[0][2] is timer:
+                self._condition.notify()
+        return timer
+
+    def run(self):
+        """Start the timer thread."""
+        _logger.debug("started")
+
+        while not self._stop_event.is_set():
+            with self._condition:
+                timer = None
+                while timer is None and not self._stop_event.is_set():
+                    if not self._timers:
+                        self._condition.wait()
+                        continue
+                    delay = self._timers[0][0] - time.monotonic()
+                    if delay > 0:
+                        self._condition.wait(delay)
+                        continue
+                    timer = heapq.heappop(self._timers)[2]
+
+            if timer is not None and not timer.cancelled:
+                try:
+                    timer.callback()
+                except Exception:
+                    _logger.exception("timer callback failed")
+
+        _logger.debug("stopped")
+
+    def join(self, timeout=None):
+        """Stop the timer thread."""
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify()
+        threading.Thread.join(self, timeout)
+
+
+class PoolIOThread(threading.Thread):
+    """Perform the socket I/O of every client in a CIPClientPool."""
+
+    def __init__(self, pool):
+        """Set up the I/O thread."""
+        self._stop_event = threading.Event()
+        self.pool = pool
+        threading.Thread.__init__(self, name="PoolIO")
+
+    def run(self):
+        """Start the I/O thread."""
+        _logger.debug("started")
+
+        selector = self.pool._selector
+
+        while not self._stop_event.is_set():
+            for key, mask in selector.select():
+                client = key.data
+                if client is None:
+                    self.pool._drain_wakeup()
+                    continue
+                try:
+                    if mask & selectors.EVENT_WRITE:
+                        client._handle_write()
+                    if mask & selectors.EVENT_READ and client.socket is key.fileobj:
+                        client._handle_read()
+                except Exception:
+                    # one misbehaving connection must not stop the others
+                    _logger.exception(f"I/O for {client.host}:{client.port} failed")
+                    client._disconnect(key.fileobj)
+            self.pool._run_pending()
+
+        _logger.debug("stopped")
+
+    def join(self, timeout=None):
+        """Stop the I/O thread."""
+        self._stop_event.set()
+        self.pool._wakeup()
+        threading.Thread.join(self, timeout)
+
+
+class PooledCIPClient(_CIPClientBase):
+    """A CIP client whose I/O and timers are driven by a CIPClientPool.
+
+    Create instances with CIPClientPool.add_client().  Subscriber callbacks for
+    incoming joins run on the pool's I/O thread and should return quickly.
+    """
+
+    def __init__(
+        self,
+        pool,
+        host,
+        ipid,
+        port=41794,
+        timeout=2,
+        recv_size=4096,
+        max_frame_size=_CIP_MAX_FRAME_SIZE,
+        executor=None,
+        min_reconnect_delay=_MIN_RECONNECT_DELAY,
+        max_reconnect_delay=_MAX_RECONNECT_DELAY,
+        notify_during_sync=True,
+        serial_encoding="latin-1",
+        tx_limits=None,
+    ):
+        """Set up CIP client instance."""
+        _CIPClientBase.__init__(
+            self,
+            ipid,
+            executor,
+            min_reconnect_delay,
+            max_reconnect_delay,
+            notify_during_sync,
+            serial_encoding,
+            tx_limits,
+        )
+        self.pool = pool
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.socket = None
+        self.decoder = _FrameDecoder(self._processPayload, recv_size, max_frame_size)
+        self._running = False
+        self._connecting = False
+        self._warning_posted = False
+        self._events = 0
+        # the part of a batch taken from tx_queue that is not yet written,
+        # and the items it was taken from
+        self._tx = bytearray()
+        self._tx_batch = []
+        self._last_tx = 0
+        # counts closed connections, so stale heartbeats can tell they are stale
+        self._generation = 0
+        self._connect_timer = None
+        self._reconnect_timer = None
+        self._heartbeat_timer = None
+        self._buttons_timer = None
+
+    def start(self):
+        """Start the CIP client instance."""
+        if self._running:
+            _logger.error("start() called while already running")
+        else:
+            _logger.debug("start requested")
+            self._running = True
+            self.pool._call_soon(self._connect)
+
+    def stop(self):
+        """Stop the CIP client instance."""
+        if not self._running:
+            _logger.error("stop() called while already stopped")
+        else:
+            _logger.debug("stop requested")
+            self._running = False
+            self.pool._call_soon(self._shutdown)
+
+    def press(self, join):
+        """Set a digital output join to the active state using CIP button logic."""
+        _CIPClientBase.press(self, join)
+        self._arm_buttons()
+
+    def _connect(self):
+        """Begin a non-blocking connection attempt (I/O thread)."""
+        self._reconnect_timer = None
+        if not self._running or self.socket is not None:
+            return
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            err = sock.connect_ex((self.host, self.port))
+        except OSError as e:
+            err = e.errno
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            self._connect_failed()
+            return
+
+        self.socket = sock
+        self._connecting = True
+        self._events = selectors.EVENT_WRITE
+        self.pool._selector.register(sock, self._events, self)
+        self._connect_timer = self.pool.timer_thread.call_later(
+            self.timeout,
+            lambda: self.pool._call_soon(lambda: self._connect_timeout(sock)),
+        )
+
+    def _connect_timeout(self, sock):
+        """Abandon a connection attempt that has taken too long (I/O thread)."""
+        if self._connecting and self.socket is sock:
+            self._close_socket()
+            self._connect_failed()
+
+    def _connect_failed(self):
+        """Schedule another connection attempt (I/O thread)."""
+        self.metrics.count("connect_failures")
+        if self._warning_posted is False:
+            _logger.debug(
+                f"attempting to connect to {self.host}:{self.port}, no success yet"
+            )
+            self._warning_posted = True
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        """Reconnect after the reconnect delay (I/O thread)."""
+        if self._running:
+            self._reconnect_timer = self.pool.timer_thread.call_later(
+                self._reconnect_delay(), lambda: self.pool._call_soon(self._connect)
+            )
+
+    def _connected(self):
+        """Finish a successful connection attempt (I/O thread)."""
+        self._connecting = False
+        self._warning_posted = False
+        self._connect_timer.cancel()
+        _logger.debug(f"connected to {self.host}:{self.port}")
+        self.metrics.count("connects")
+        self.decoder.reset()
+        self._last_tx = time.monotonic()
+        self._arm_heartbeat(_HEARTBEAT_INTERVAL)
+        self._update_events()
+        self._arm_buttons()
+
+    def _disconnect(self, sock):
+        """Drop the connection on `sock` and schedule a reconnect (I/O thread)."""
+        if self.socket is not sock or sock is None:
+            return
+        self._close_socket()
+        _logger.debug(f"lost connection to {self.host}:{self.port}")
+        self.metrics.count("disconnects")
+        self._schedule_reconnect()
+
+    def _shutdown(self):
+        """Close the connection and cancel all timers (I/O thread)."""
+        if self._reconnect_timer is not None:
+            self._reconnect_timer.cancel()
+            self._reconnect_timer = None
+        if self.socket is not None:
+            self._close_socket()
+
+    def _close_socket(self):
+        """Unregister and close the socket (I/O thread)."""
+        for timer in (self._connect_timer, self._heartbeat_timer, self._buttons_timer):
+            if timer is not None:
+                timer.cancel()
+        self._connect_timer = None
+        self._heartbeat_timer = None
+        self._buttons_timer = None
+        self._generation += 1
+        self.pool._selector.unregister(self.socket)
+        self.socket.close()
+        self.socket = None
+        self._connecting = False
+        self._set_connected(False)
+        self.tx_queue.clear()
+        self._tx = bytearray()
+        self._tx_batch = []
+
+    def _handle_read(self):
+        """Read from the socket and process complete packets (I/O thread)."""
+        sock = self.socket
+        try:
+            received = sock.recv_into(self.decoder.writable())
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._disconnect(sock)
+            return
+        if received == 0:
+            _logger.debug("connection closed by control processor")
+            self._disconnect(sock)
+        else:
+            self._feed(self.decoder, received)
+
+    def _handle_write(self):
+        """Complete a connection attempt or send pending data (I/O thread)."""
+        if self._connecting:
+            err = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                self._close_socket()
+                self._connect_failed()
+            else:
+                self._connected()
+        else:
+            self._flush()
+
+    def _flush(self):
+        """Send as much pending data as the socket accepts (I/O thread)."""
+        sock = self.socket
+        if sock is None or self._connecting:
+            return
+        while True:
+            if not self._tx:
+                # take the next batch, highest priority first, only once the
+                # last one is written so packets are never split
+                batch = self.tx_queue.get_batch(_TX_BATCH_SIZE)
+                if not batch:
+                    break
+                self._tx = bytearray(b"".join(tx for tx, posted in batch))
+                self._tx_batch = batch
+            try:
+                sent = sock.send(self._tx)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self._disconnect(sock)
+                return
+            del self._tx[:sent]
+            if self._tx:
+                break
+            self.metrics.sent(posted for tx, posted in self._tx_batch)
+            self._trace_written(tx for tx, posted in self._tx_batch)
+            self._tx_batch = []
+        self._update_events()
+
+    def _update_events(self):
+        """Only watch for writability while data is pending (I/O thread)."""
+        events = selectors.EVENT_READ
+        if self._tx or len(self.tx_queue):
+            events |= selectors.EVENT_WRITE
+        if events != self._events:
+            self._events = events
+            self.pool._selector.modify(self.socket, events, self)
+
+    def _arm_heartbeat(self, delay):
+        """Schedule a heartbeat check for the current connection (I/O thread)."""
+        generation = self._generation
+        self._heartbeat_timer = self.pool.timer_thread.call_later(
+            delay, lambda: self.pool._call_soon(lambda: self._heartbeat(generation))
+        )
+
+    def _heartbeat(self, generation):
+        """Send a heartbeat once the connection has been idle (I/O thread).
+
+        Does nothing if the connection the check was scheduled for has closed,
+        since _close_socket() cannot cancel a timer that has already fired.
+        """
+        if generation != self._generation or self.socket is None:
+            return
+        now = time.monotonic()
+        if now - self._last_tx >= _HEARTBEAT_INTERVAL:
+            if self._online():
+                self._send(b"\x0D\x00\x02\x00\x00", None, _PRIORITY_CONTROL)
+            delay = _HEARTBEAT_INTERVAL
+        else:
+            delay = self._last_tx + _HEARTBEAT_INTERVAL - now
+        self._arm_heartbeat(delay)
+
+    def _arm_buttons(self, deadline=None):
+        """Schedule the next button repeat if any buttons are held."""
+        if self._buttons_timer is None and self.socket is not None:
+            if deadline is None:
+                deadline = self._next_button_deadline()
+            if deadline is not None:
+                if not self._online():
+                    # repeats are held back until the client is online, so
+                    # don't spin on a deadline that has already passed
+                    deadline = max(deadline, time.monotonic() + _BUTTON_REPEAT_INTERVAL)
+                self._buttons_timer = self.pool.timer_thread.call_later(
+                    deadline - time.monotonic(), self._repeat_buttons
+                )
+
+    def _repeat_buttons(self):
+        """Resend each held button whose repeat is due (timer thread)."""
+        self._buttons_timer = None
+        if self._online():
+            self._arm_buttons(self._repeat_buttons_due(time.monotonic()))
+        else:
+            self._arm_buttons()
+
+    def _post_events(self, direction, changes):
+        """Process join changes immediately in the calling thread."""
+        self._processEvents(direction, changes, time.perf_counter())
+
+    def _send(self, tx, posted=None, priority=_PRIORITY_JOINS, key=None):
+        """Queue a CIP packet and have the I/O thread send it."""
+        self._account_tx(tx)
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug(f"TX: <{str(binascii.hexlify(tx), 'ascii')}>")
+        idle = self.tx_queue.put((tx, posted), priority, key)
+        self._last_tx = time.monotonic()
+        if idle:
+            self.pool._call_soon(self._flush)
+
+    def _queue_depths(self):
+        """Return the current depth of the client's queues."""
+        return {"tx_buffer": len(self._tx), **self.tx_queue.depths()}
+
+    def _may_wait(self):
+        """Never wait on the pool's threads, which drain the transmit queue."""
+        return threading.current_thread() not in (
+            self.pool.io_thread,
+            self.pool.timer_thread,
+        )
+
+    def _schedule_flush(self, delay):
+        """Flush throttled values from the I/O thread after `delay` seconds."""
+        self.pool.timer_thread.call_later(
+            delay, lambda: self.pool._call_soon(self._flush_throttled)
+        )
+
+    def _online(self):
+        """Return True if outgoing joins can currently be sent."""
+        return self.connected is True and self.socket is not None
+
+    def _request_restart(self):
+        """Have the I/O thread drop and re-establish the connection."""
+        sock = self.socket
+        self.pool._call_soon(lambda: self._disconnect(sock))
+
+
+class CIPClientPool:
+    """Drive any number of CIP clients from one I/O thread and one timer thread.
+
+    Host names are resolved on the I/O thread, so use IP addresses where
+    name resolution may be slow.
+    """
+
+    def __init__(self):
+        """Set up the pool."""
+        self.clients = []
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_rx, self._wakeup_tx = socket.socketpair()
+        self._wakeup_rx.setblocking(False)
+        self._wakeup_tx.setblocking(False)
+        self._selector.register(self._wakeup_rx, selectors.EVENT_READ, None)
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._wakeup_pending = False
+
+        self.io_thread = PoolIOThread(self)
+        self.timer_thread = PoolTimerThread(self)
+
+    def add_client(self, host, ipid, port=41794, timeout=2, **kwargs):
+        """Create a PooledCIPClient managed by this pool."""
+        client = PooledCIPClient(self, host, ipid, port, timeout, **kwargs)
+        self.clients.append(client)
+        return client
+
+    def start(self):
+        """Start the pool's worker threads."""
+        if self.io_thread.is_alive():
+            _logger.error("start() called while already running")
+        else:
+            _logger.debug("start requested")
+            self.timer_thread.start()
+            self.io_thread.start()
+
+    def stop(self):
+        """Stop every running client and the pool's worker threads."""
+        if not self.io_thread.is_alive():
+            _logger.error("stop() called while already stopped")
+        else:
+            _logger.debug("stop requested")
+            for client in self.clients:
+                if client._running:
+                    client.stop()
+            self.io_thread.join()
+            self.timer_thread.join()
+            self._selector.close()
+            self._wakeup_rx.close()
+            self._wakeup_tx.close()
+
+    def _call_soon(self, callback):
+        """Run `callback` on the I/O thread."""
+        with self._pending_lock:
+            self._pending.append(callback)
+        if threading.current_thread() is not self.io_thread:
+            self._wakeup()
+
+    def _run_pending(self):
+        """Run the callbacks queued by _call_soon() (I/O thread)."""
+        while self._pending:
+            with self._pending_lock:
+                pending = self._pending
+                self._pending = []
+            for callback in pending:
+                try:
+                    callback()
+                except Exception:
+                    _logger.exception("I/O callback failed")
+
+    def _wakeup(self):
+        """Interrupt the I/O thread's select() call."""
+        with self._pending_lock:
+            if self._wakeup_pending:
+                return
+            self._wakeup_pending = True
+        try:
+            self._wakeup_tx.send(b"\x00")
+        except OSError:
+            pass
+
+    def _drain_wakeup(self):
+        """Consume wakeup bytes (I/O thread)."""
+        try:
+            while self._wakeup_rx.recv(4096):
+                pass
+        except OSError:
+            pass
+        # only clear the flag once drained, so a wakeup sent after this point
+        # leaves its byte in the socket
+        with self._pending_lock:
+            self._wakeup_pending = False
@@ -0,0 +1,532 @@
+"""In-process fake Crestron control processors for tests and benchmarks."""
+
+# Standard Imports
+import logging
+import socket
+import threading
+import time
+
+import cipclient
+
+_logger = logging.getLogger(__name__)
+
+_REGISTRATION_REQUEST = b"\x0f\x00\x01\x02"
+_REGISTRATION_OK = b"\x02\x00\x04\x00\x00\x00\x1f"
+_REGISTRATION_FAILED = b"\x02\x00\x03\xff\xff\x02"
+_END_OF_QUERY = b"\x05\x00\x05\x00\x00\x02\x03\x1c"
+_HEARTBEAT_RESPONSE = b"\x0e\x00\x02\x00\x00"
+_DISCONNECT = b"\x03\x00\x00"
+
+
+class AcceptThread(threading.Thread):
+    """Accept client connections for a FakeProcessor or ReplayProcessor."""
+
+    def __init__(self, processor):
+        """Set up the accept thread."""
+        self.processor = processor
+        threading.Thread.__init__(self, name="FakeAccept", daemon=True)
+
+    def run(self):
+        """Start the accept thread."""
+        _logger.debug("started")
+
+        while True:
+            try:
+                sock, address = self.processor.server.accept()
+            except OSError:
+                break
+            _logger.debug(f"accepted connection from {address[0]}:{address[1]}")
+            self.processor._add_connection(sock)
+
+        _logger.debug("stopped")
+
+
+class FakeConnection(threading.Thread):
+    """Serve one client connection to a FakeProcessor."""
+
+    def __init__(self, processor, sock):
+        """Set up the connection thread."""
+        self.processor = processor
+        self.socket = sock
+        self.ipid = None
+        self.registered = False
+        self.serial_chunks = {}
+        self.write_lock = threading.Lock()
+        self.decoder = cipclient._FrameDecoder(
+            self._processPayload, 4096, cipclient._CIP_MAX_FRAME_SIZE
+        )
+        threading.Thread.__init__(self, name="FakeConnection", daemon=True)
+
+    def run(self):
+        """Start the connection thread."""
+        _logger.debug("started")
+
+        try:
+            self.write(_REGISTRATION_REQUEST)
+            while True:
+                received = self.socket.recv_into(self.decoder.writable())
+                if not received or not self.decoder.feed(received):
+                    break
+        except OSError:
+            pass
+        self.close()
+        self.processor._remove_connection(self)
+
+        _logger.debug("stopped")
+
+    def close(self):
+        """Close the connection."""
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+    def write(self, data):
+        """Send data to the client, split into partial writes if configured."""
+        size = self.processor.write_size
+        with self.write_lock:
+            if size is None:
+                self.socket.sendall(data)
+            else:
+                view = memoryview(data)
+                for start in range(0, len(view), size):
+                    self.socket.sendall(view[start : start + size])
+
+    def _processPayload(self, ciptype, payload):
+        """Respond to a CIP packet from the client."""
+        processor = self.processor
+        if ciptype == 0x01 and len(payload) >= 6:
+            # registration request
+            self.ipid = payload[5]
+            if processor.ipids is None or self.ipid in processor.ipids:
+                _logger.debug(f"registered IPID 0x{self.ipid:02x}")
+                self.write(_REGISTRATION_OK)
+                processor._registered(self)
+            else:
+                _logger.debug(f"rejected IPID 0x{self.ipid:02x}")
+                self.write(_REGISTRATION_FAILED)
+        elif ciptype == 0x0D or ciptype == 0x0E:
+            # heartbeat
+            processor._count("heartbeats")
+            self.write(_HEARTBEAT_RESPONSE)
+        elif ciptype == 0x05 and len(payload) >= 5 and payload[3] == 0x03:
+            if payload[4] == 0x00:
+                # update request: send the current state, then end-of-query
+                with processor.lock:
+                    state = processor._state(self.ipid)
+                    tx = b"".join(
+                        cipclient.encode(sigtype, join, value)
+                        for sigtype, joins in state.items()
+                        for join, value in joins.items()
+                    )
+                self.write(tx + _END_OF_QUERY)
+        elif ciptype == 0x12 and len(payload) >= 8 and payload[7] != 0x03:
+            # chunk of a serial value that spans several packets
+            join = ((payload[5] << 8) | payload[6]) + 1
+            if payload[7] & 0x01 or join not in self.serial_chunks:
+                self.serial_chunks[join] = bytearray()
+            self.serial_chunks[join] += payload[8:]
+            if payload[7] & 0x02:
+                value = str(self.serial_chunks.pop(join), "latin-1")
+                processor._received(self, "s", join, value)
+        elif ciptype == 0x05 or ciptype == 0x12:
+            packet = bytes((ciptype, len(payload) >> 8, len(payload) & 0xFF))
+            change = cipclient.decode(packet + payload)
+            if change is not None:
+                processor._received(self, *change)
+
+
+class TrafficThread(threading.Thread):
+    """Generate incoming join traffic for a FakeProcessor at a fixed rate."""
+
+    def __init__(self, processor, sigtype, joins, rate, duration, ipid):
+        """Set up the traffic thread."""
+        self._stop_event = threading.Event()
+        self.processor = processor
+        self.sigtype = sigtype
+        self.joins = list(joins)
+        self.rate = rate
+        self.duration = duration
+        self.ipid = ipid
+        self.sent = 0
+        threading.Thread.__init__(self, name="FakeTraffic", daemon=True)
+
+    def run(self):
+        """Start the traffic thread."""
+        _logger.debug("started")
+
+        start = time.monotonic()
+        while not self._stop_event.is_set():
+            elapsed = time.monotonic() - start
+            if self.duration is not None and elapsed >= self.duration:
+                break
+            # send everything that is due in one write, so high rates are not
+            # limited by the resolution of sleep
+            due = int(elapsed * self.rate) + 1 - self.sent
+            if due > 0:
+                changes = []
+                for count in range(self.sent, self.sent + due):
+                    join = self.joins[count % len(self.joins)]
+                    changes.append((self.sigtype, join, self._value(count)))
+                self.processor.set_many(changes, self.ipid)
+                self.sent += due
+            delay = self.sent / self.rate - (time.monotonic() - start)
+            self._stop_event.wait(max(0, delay))
+
+        _logger.debug("stopped")
+
+    def _value(self, count):
+        """Return the value to send for the `count`th change."""
+        cycle = count // len(self.joins)
+        if self.sigtype == "d":
+            return (cycle + 1) & 1
+        elif self.sigtype == "a":
+            return cycle & 0xFFFF
+        return str(cycle)
+
+    def join(self, timeout=None):
+        """Stop the traffic thread."""
+        self._stop_event.set()
+        threading.Thread.join(self, timeout)
+
+
+class FakeProcessor:
+    """A CIP server that behaves enough like a control processor for testing.
+
+    Clients are registered if their IP-ID is in `ipids` (any IP-ID if None),
+    are sent the processor's join state in response to an update request and
+    then exchange joins as they would with real hardware.  If `echo` is set,
+    joins received from a client are sent back to it as incoming joins.  If
+    `write_size` is set, every write is split into chunks of at most that
+    many bytes to exercise reassembly in the client.  `on_join(ipid, sigtype,
+    join, value)` is called for every join received from a client.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        ipids=None,
+        echo=False,
+        write_size=None,
+        on_join=None,
+    ):
+        """Set up the fake processor."""
+        self.host = host
+        self.port = port
+        self.ipids = ipids
+        self.echo = echo
+        self.write_size = write_size
+        self.on_join = on_join
+        self.server = None
+        self.connections = []
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.joins = {}
+        self.received = {}
+        self.counters = {"joins": 0, "heartbeats": 0, "connections": 0}
+        self._accept_thread = None
+
+    def start(self):
+        """Start listening for clients.  `port` is updated if it was 0."""
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.host, self.port))
+        self.server.listen(128)
+        self.port = self.server.getsockname()[1]
+        self._accept_thread = AcceptThread(self)
+        self._accept_thread.start()
+
+    def stop(self):
+        """Stop listening and close all client connections."""
+        try:
+            # wakes the accept thread, which close() alone does not
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server.close()
+        self._accept_thread.join()
+        for connection in self._connections():
+            connection.close()
+            connection.join()
+
+    def set(self, sigtype, join, value, ipid=None):
+        """Set a join on the processor and send it to connected clients.
+
+        The join is set for clients registered with `ipid`, or for all
+        registered clients if `ipid` is None.
+        """
+        self.set_many(((sigtype, join, value),), ipid)
+
+    def set_many(self, changes, ipid=None):
+        """Set several joins with a single write to each client."""
+        changes = list(changes)
+        tx = b"".join(cipclient.encode(*change) for change in changes)
+        with self.lock:
+            if ipid is None:
+                # the None entry is the state new IP-IDs start with
+                self._state(None)
+                states = list(self.joins.values())
+            else:
+                states = [self._state(ipid)]
+            for state in states:
+                for sigtype, join, value in changes:
+                    state[sigtype][join] = value
+        for connection in self._connections(ipid):
+            try:
+                connection.write(tx)
+            except OSError:
+                pass
+
+    def write(self, data, ipid=None):
+        """Send raw bytes, such as a malformed packet, to connected clients."""
+        for connection in self._connections(ipid):
+            try:
+                connection.write(data)
+            except OSError:
+                pass
+
+    def generate(self, sigtype, joins, rate, duration=None, ipid=None):
+        """Send `rate` incoming joins per second, cycling through `joins`.
+
+        Returns the started TrafficThread; call its join() to stop it early.
+        """
+        thread = TrafficThread(self, sigtype, joins, rate, duration, ipid)
+        thread.start()
+        return thread
+
+    def disconnect(self, ipid=None, notify=True):
+        """Drop client connections, sending a CIP disconnect first if `notify`."""
+        for connection in self._connections(ipid):
+            if notify:
+                try:
+                    connection.write(_DISCONNECT)
+                except OSError:
+                    pass
+            connection.close()
+
+    def wait_connections(self, count, timeout=None):
+        """Wait until `count` clients are registered.  Returns False on timeout."""
+        with self.changed:
+            return self.changed.wait_for(
+                lambda: len(self._connections(locked=True)) >= count, timeout
+            )
+
+    def wait_received(self, count, timeout=None):
+        """Wait until `count` joins have been received in total.
+
+        Returns False if the timeout expires first.
+        """
+        with self.changed:
+            return self.changed.wait_for(
+                lambda: self.counters["joins"] >= count, timeout
+            )
+
+    def _connections(self, ipid=None, locked=False):
+        """Return the registered connections for `ipid`, or all of them."""
+        if not locked:
+            with self.lock:
+                return self._connections(ipid, True)
+        return [
+            connection
+            for connection in self.connections
+            if connection.registered and (ipid is None or connection.ipid == ipid)
+        ]
+
+    def _state(self, ipid):
+        """Return the join state for an IP-ID (lock held)."""
+        state = self.joins.get(ipid)
+        if state is None:
+            default = self.joins.get(None)
+            if default is None:
+                state = {"d": {}, "a": {}, "s": {}}
+            else:
+                state = {sigtype: dict(joins) for sigtype, joins in default.items()}
+            self.joins[ipid] = state
+        return state
+
+    def _add_connection(self, sock):
+        """Start serving a newly accepted client."""
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = FakeConnection(self, sock)
+        with self.lock:
+            self.connections.append(connection)
+            self.counters["connections"] += 1
+        connection.start()
+
+    def _registered(self, connection):
+        """Mark a client as registered."""
+        with self.changed:
+            connection.registered = True
+            self.changed.notify_all()
+
+    def _remove_connection(self, connection):
+        """Forget a client that has disconnected."""
+        with self.changed:
+            if connection in self.connections:
+                self.connections.remove(connection)
+            self.changed.notify_all()
+
+    def _count(self, name):
+        """Increment a counter."""
+        with self.lock:
+            self.counters[name] += 1
+
+    def _received(self, connection, sigtype, join, value):
+        """Record a join received from a client."""
+        with self.changed:
+            received = self.received.get(connection.ipid)
+            if received is None:
+                received = self.received[connection.ipid] = {"d": {}, "a": {}, "s": {}}
+            received[sigtype][join] = value
+            self.counters["joins"] += 1
+            self.changed.notify_all()
+        if self.on_join is not None:
+            self.on_join(connection.ipid, sigtype, join, value)
+        if self.echo:
+            self.set(sigtype, join, value, connection.ipid)
+
+
+class ReplayConnection(threading.Thread):
+    """Send a recorded session to one client of a ReplayProcessor."""
+
+    def __init__(self, processor, sock):
+        """Set up the connection thread."""
+        self._stop_event = threading.Event()
+        self.processor = processor
+        self.socket = sock
+        self.sent = 0
+        threading.Thread.__init__(self, name="ReplayConnection", daemon=True)
+
+    def run(self):
+        """Start the connection thread."""
+        _logger.debug("started")
+
+        processor = self.processor
+        batches = processor.replay.batches(
+            "rx", processor.speed, sleep=self._stop_event.wait
+        )
+        try:
+            for batch in batches:
+                if self._stop_event.is_set():
+                    break
+                tx = []
+                for timestamp, direction, ciptype, payload in batch:
+                    tx.append(bytes((ciptype, len(payload) >> 8, len(payload) & 0xFF)))
+                    tx.append(payload)
+                self.socket.sendall(b"".join(tx))
+                self.sent += len(batch)
+                if not self._drain():
+                    break
+            else:
+                processor._finished(self)
+                # discard whatever the client sends until it disconnects
+                while self.socket.recv(65536):
+                    pass
+        except OSError:
+            pass
+        batches.close()
+        self.close()
+        processor._remove_connection(self)
+
+        _logger.debug("stopped")
+
+    def close(self):
+        """Stop replaying and close the connection."""
+        self._stop_event.set()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+    def _drain(self):
+        """Discard data sent by the client.  Returns False if it disconnected."""
+        while True:
+            try:
+                if not self.socket.recv(65536, socket.MSG_DONTWAIT):
+                    return False
+            except BlockingIOError:
+                return True
+
+
+class ReplayProcessor:
+    """A CIP server that plays a recorded session to every client.
+
+    Each client that connects is sent the packets received in the session
+    file at `path` (see cipclient.SessionRecorder), starting with the
+    processor's registration request.  With a `speed` the original timing
+    is kept, scaled by `speed` (1 is real time); with None, packets are sent
+    as fast as the client reads them.  Anything sent by clients is ignored.
+    """
+
+    def __init__(self, path, host="127.0.0.1", port=0, speed=None):
+        """Set up the replaying processor."""
+        self.replay = cipclient.SessionReplay(path)
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.server = None
+        self.connections = []
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.counters = {"connections": 0, "finished": 0}
+        self._accept_thread = None
+
+    def start(self):
+        """Start listening for clients.  `port` is updated if it was 0."""
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.host, self.port))
+        self.server.listen(128)
+        self.port = self.server.getsockname()[1]
+        self._accept_thread = AcceptThread(self)
+        self._accept_thread.start()
+
+    def stop(self):
+        """Stop listening, close all client connections and the session file."""
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server.close()
+        self._accept_thread.join()
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            connection.close()
+            connection.join()
+        self.replay.close()
+
+    def wait_finished(self, count, timeout=None):
+        """Wait until the whole session has been sent to `count` clients.
+
+        Returns False if the timeout expires first.
+        """
+        with self.changed:
+            return self.changed.wait_for(
+                lambda: self.counters["finished"] >= count, timeout
+            )
+
+    def _add_connection(self, sock):
+        """Start replaying to a newly accepted client."""
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = ReplayConnection(self, sock)
+        with self.lock:
+            self.connections.append(connection)
+            self.counters["connections"] += 1
+        connection.start()
+
+    def _finished(self, connection):
+        """Count a client that has been sent the whole session."""
+        with self.changed:
+            self.counters["finished"] += 1
+            self.changed.notify_all()
+
+    def _remove_connection(self, connection):
+        """Forget a client that has disconnected."""
+        with self.changed:
+            if connection in self.connections:
+                self.connections.remove(connection)
+            self.changed.notify_all()
@@ -35,11 +35,10 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Programming Language :: Python :: 3",
         "Operating System :: OS Independent",
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
     ],
     keywords="development cip home-automation",
-    python_requires=">=3.6",
-    py_modules=["cipclient"],
+    python_requires=">=3.7",
+    py_modules=["cipclient", "cipfake"],
 )
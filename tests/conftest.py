@@ -0,0 +1,37 @@
+"""Shared fixtures for the cipclient tests."""
+
+# Standard Imports
+import time
+
+import pytest
+
+import cipclient
+import cipfake
+
+
+def wait_until(predicate, timeout=5):
+    """Poll `predicate` until it is true.  Returns False on timeout."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+@pytest.fixture
+def processor():
+    """A started FakeProcessor, stopped after the test."""
+    processor = cipfake.FakeProcessor()
+    processor.start()
+    yield processor
+    processor.stop()
+
+
+@pytest.fixture
+def pool():
+    """A started CIPClientPool, stopped after the test."""
+    pool = cipclient.CIPClientPool()
+    pool.start()
+    yield pool
+    pool.stop()
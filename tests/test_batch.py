@@ -0,0 +1,106 @@
+"""Tests for set_many() and batch()."""
+
+# Standard Imports
+import asyncio
+import threading
+
+import pytest
+
+import cipclient
+
+
+@pytest.fixture
+def cip():
+    """An unstarted client, whose event queue holds what it would send."""
+    return cipclient.CIPSocketClient("127.0.0.1", 0x03)
+
+
+def posted(cip):
+    """Return the outgoing changes posted so far, one list per event."""
+    events = []
+    while not cip.event_queue.empty():
+        direction, changes, start = cip.event_queue.get_nowait()
+        assert direction == "out"
+        events.append(list(changes))
+    return events
+
+
+def test_set_many_keeps_the_last_value_in_the_first_position(cip):
+    cip.set_many([("a", 1, 1), ("d", 2, 1), ("a", 1, 5), ("a", 4, -1), ("s", 3, "x")])
+    # the invalid analog value is skipped
+    assert posted(cip) == [[("a", 1, 5), ("d", 2, 1), ("s", 3, "x")]]
+
+
+def test_batch(cip):
+    with cip.batch():
+        cip.set("a", 1, 1)
+        cip.set("d", 2, 1)
+        cip.set_many([("a", 1, 2), ("s", 3, "x")])
+        assert posted(cip) == []
+    assert posted(cip) == [[("a", 1, 2), ("d", 2, 1), ("s", 3, "x")]]
+
+
+def test_nested_batches(cip):
+    with cip.batch():
+        cip.set("a", 1, 1)
+        with cip.batch():
+            cip.set("a", 2, 2)
+        assert posted(cip) == []
+        cip.set("a", 1, 3)
+    assert posted(cip) == [[("a", 1, 3), ("a", 2, 2)]]
+
+
+def test_exception_aborts_the_batch(cip):
+    with pytest.raises(RuntimeError):
+        with cip.batch():
+            cip.set("a", 1, 1)
+            raise RuntimeError
+    assert posted(cip) == []
+    cip.set("a", 1, 2)
+    assert posted(cip) == [[("a", 1, 2)]]
+
+
+def test_batches_are_per_client(cip):
+    other = cipclient.CIPSocketClient("127.0.0.1", 0x04)
+    with cip.batch():
+        cip.set("a", 1, 1)
+        other.set("a", 1, 2)
+        assert posted(other) == [[("a", 1, 2)]]
+    assert posted(cip) == [[("a", 1, 1)]]
+
+
+def test_batches_are_per_thread(cip):
+    with cip.batch():
+        cip.set("a", 1, 1)
+        thread = threading.Thread(target=cip.set, args=("a", 2, 2))
+        thread.start()
+        thread.join()
+        assert posted(cip) == [[("a", 2, 2)]]
+    assert posted(cip) == [[("a", 1, 1)]]
+
+
+def test_batches_are_per_task(cip):
+    started = None
+    unbatched = None
+
+    async def batched():
+        with cip.batch():
+            cip.set("a", 1, 1)
+            started.set()
+            await unbatched.wait()
+            assert posted(cip) == [[("a", 2, 2)]]
+            cip.set("a", 3, 3)
+
+    async def other():
+        await started.wait()
+        cip.set("a", 2, 2)
+        unbatched.set()
+
+    async def main():
+        nonlocal started, unbatched
+        started = asyncio.Event()
+        unbatched = asyncio.Event()
+        await asyncio.gather(batched(), other())
+
+    asyncio.run(main())
+    assert posted(cip) == [[("a", 1, 1), ("a", 3, 3)]]
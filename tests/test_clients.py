@@ -0,0 +1,264 @@
+"""End-to-end tests of each client against the fake processor."""
+
+# Standard Imports
+import asyncio
+import time
+
+import pytest
+
+import cipclient
+from conftest import wait_until
+
+IPID = 0x03
+RECONNECT = {"min_reconnect_delay": 0.01, "max_reconnect_delay": 0.1}
+# long enough to be sent as several chunk packets in each direction
+LONG_SERIAL = "".join(chr(32 + index % 95) for index in range(200000))
+
+
+class Clients:
+    """Create connected clients of one kind and stop them afterwards."""
+
+    def __init__(self, kind, processor):
+        """Set up for clients of `kind`, "socket" or "pool"."""
+        self.kind = kind
+        self.processor = processor
+        self.clients = []
+        self.pool = None
+
+    def connect(self, **kwargs):
+        """Start a client, wait for it to connect and return it."""
+        kwargs = {**RECONNECT, **kwargs}
+        port = self.processor.port
+        if self.kind == "pool":
+            if self.pool is None:
+                self.pool = cipclient.CIPClientPool()
+                self.pool.start()
+            cip = self.pool.add_client("127.0.0.1", IPID, port=port, **kwargs)
+        else:
+            cip = cipclient.CIPSocketClient("127.0.0.1", IPID, port=port, **kwargs)
+        cip.start()
+        self.clients.append(cip)
+        assert cip.wait_connected(5)
+        return cip
+
+    def stop(self):
+        """Stop every client, and the pool once its clients have stopped."""
+        for cip in self.clients:
+            cip.stop()
+        self.clients = []
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+
+
+@pytest.fixture(params=["socket", "pool"])
+def clients(request, processor):
+    """Connect CIPSocketClients or PooledCIPClients to the fake processor."""
+    clients = Clients(request.param, processor)
+    yield clients
+    clients.stop()
+
+
+def received(processor, sigtype, join):
+    """Return the last value of a join the processor received, or None."""
+    return processor.received.get(IPID, {}).get(sigtype, {}).get(join)
+
+
+def connects(cip):
+    """Return the number of times a client has connected."""
+    return cip.stats()["counters"]["connects"]
+
+
+def test_handshake(processor, clients):
+    processor.set_many([("d", 1, 1), ("a", 2, 300), ("s", 3, "hello")])
+    synced = []
+    cip = clients.connect()
+    cip.subscribe_sync(synced.append)
+    assert processor.wait_connections(1, 5)
+    assert cip.get("d", 1) == 1
+    assert cip.get("a", 2) == 300
+    assert cip.get("s", 3) == "hello"
+
+    cip.update_request()
+    assert wait_until(lambda: synced)
+    assert synced[0] == {"d": {}, "a": {}, "s": {}}
+
+
+def test_connected_after_join_dump_is_applied(processor, clients):
+    processor.set_many(("a", join, join) for join in range(1, 3001))
+    cip = clients.connect()
+    assert cip.get("a", 3000) == 3000
+    assert list(cip.get_range("a", 1, 3000)) == list(range(1, 3001))
+
+
+def test_reconnect_and_resync(processor, clients):
+    cip = clients.connect()
+    cip.set("a", 10, 123)
+    assert processor.wait_received(1, 5)
+
+    processor.disconnect()
+    processor.set("a", 11, 7)
+    assert wait_until(lambda: connects(cip) == 2)
+    assert cip.wait_connected(5)
+    # the client resends its outgoing joins and picks up the new incoming one
+    assert processor.wait_received(2, 5)
+    assert received(processor, "a", 10) == 123
+    assert cip.wait_for("a", 11, 7, timeout=5) == 7
+    assert cip.stats()["counters"]["reconnects"] == 1
+
+
+def test_stop_while_waiting_to_reconnect(processor):
+    cip = cipclient.CIPSocketClient(
+        "127.0.0.1", IPID, port=processor.port, min_reconnect_delay=30
+    )
+    cip.start()
+    assert cip.wait_connected(5)
+    processor.disconnect()
+    assert wait_until(lambda: not cip._socket_event.is_set())
+    # the receive thread is blocked until a new socket is opened
+    assert wait_until(lambda: connects(cip) == 1 and cip.connected is False)
+    start = time.monotonic()
+    cip.stop()
+    assert time.monotonic() - start < 5
+    assert not cip.receive_thread.is_alive()
+
+
+def test_chunked_serial_round_trip(processor, clients):
+    processor.echo = True
+    cip = clients.connect()
+    cip.set("s", 7, LONG_SERIAL)
+    assert cip.wait_for("s", 7, LONG_SERIAL, timeout=10) == LONG_SERIAL
+    assert received(processor, "s", 7) == LONG_SERIAL
+
+
+def test_shutdown_drains_callbacks(processor, clients):
+    executor = cipclient.ThreadedExecutor(workers=2)
+    cip = clients.connect(executor=executor)
+    calls = []
+
+    def callback(sigtype, join, value):
+        time.sleep(0.001)
+        calls.append(join)
+
+    cip.subscribe_range("a", 1, 500, callback)
+    processor.set_many(("a", join, 1) for join in range(1, 501))
+    assert cip.wait_for("a", 500, 1, timeout=5) == 1
+    clients.stop()
+    executor.shutdown()
+    assert sorted(calls) == list(range(1, 501))
+
+
+def run_async(processor, test):
+    """Run `test(cip)` with a connected AsyncCIPClient."""
+
+    async def main():
+        cip = cipclient.AsyncCIPClient(
+            "127.0.0.1", IPID, port=processor.port, **RECONNECT
+        )
+        await cip.start()
+        try:
+            assert await cip.wait_connected(5)
+            await test(cip)
+        finally:
+            await cip.stop()
+
+    asyncio.run(main())
+
+
+def test_async_handshake(processor):
+    processor.set_many([("d", 1, 1), ("a", 2, 300), ("s", 3, "hello")])
+
+    async def test(cip):
+        assert processor.wait_connections(1, 5)
+        assert cip.get("d", 1) == 1
+        assert cip.get("a", 2) == 300
+        assert cip.get("s", 3) == "hello"
+
+    run_async(processor, test)
+
+
+async def async_wait_until(predicate, timeout=5):
+    """Poll `predicate` from the event loop.  Returns False on timeout."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.005)
+    return True
+
+
+def test_async_reconnect_and_resync(processor):
+    async def test(cip):
+        await cip.set("a", 10, 123)
+        assert await async_wait_until(lambda: processor.counters["joins"] == 1)
+
+        processor.disconnect()
+        processor.set("a", 11, 7)
+        assert await async_wait_until(lambda: connects(cip) == 2)
+        assert await cip.wait_connected(5)
+        assert await cip.wait_for("a", 11, 7, timeout=5) == 7
+        assert await async_wait_until(lambda: processor.counters["joins"] == 2)
+        assert received(processor, "a", 10) == 123
+
+    run_async(processor, test)
+
+
+def test_async_chunked_serial_round_trip(processor):
+    processor.echo = True
+
+    async def test(cip):
+        await cip.set("s", 7, LONG_SERIAL)
+        assert await cip.wait_for("s", 7, LONG_SERIAL, timeout=10) == LONG_SERIAL
+        assert received(processor, "s", 7) == LONG_SERIAL
+
+    run_async(processor, test)
+
+
+def test_async_subscription(processor):
+    async def test(cip):
+        subscription = cip.subscription("a", 5)
+        for value in (1, 2, 3):
+            processor.set("a", 5, value)
+            assert await cip.wait_for("a", 5, value, timeout=5) == value
+        processor.set("a", 6, 1)
+        assert await cip.wait_for("a", 6, 1, timeout=5) == 1
+        subscription.close()
+        # changes already queued are still delivered, then iteration ends
+        changes = [change async for change in subscription]
+        assert changes == [("a", 5, 1), ("a", 5, 2), ("a", 5, 3)]
+        assert cip._subscribers["in"]["a"] == {}
+
+        async with cip.subscription("a", 5, maxsize=1) as latest:
+            for value in (4, 5):
+                processor.set("a", 5, value)
+                assert await cip.wait_for("a", 5, value, timeout=5) == value
+            # the oldest unread change was dropped
+            assert await latest.__anext__() == ("a", 5, 5)
+        assert cip._subscribers["in"]["a"] == {}
+        assert [change async for change in latest] == []
+
+    run_async(processor, test)
+
+
+def test_async_held_button_waits_while_offline():
+    cip = cipclient.AsyncCIPClient("127.0.0.1", IPID)
+    repeats = []
+    repeat_buttons = cip._repeat_buttons
+
+    def counting():
+        repeats.append(time.monotonic())
+        repeat_buttons()
+
+    async def test():
+        cip._loop = asyncio.get_running_loop()
+        cip._repeat_buttons = counting
+        # connected to the processor but not yet registered
+        cip.transport = object()
+        cip._processEvents("out", [("db", 1, 1)])
+        cip._arm_buttons()
+        await asyncio.sleep(1.3)
+        cip.transport = None
+        cip._buttons_timer.cancel()
+
+    asyncio.run(test())
+    assert 1 <= len(repeats) <= 3
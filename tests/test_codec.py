@@ -0,0 +1,100 @@
+"""Tests for encoding and decoding join packets."""
+
+import pytest
+
+import cipclient
+
+
+def split(packets):
+    """Return the individual packets in a buffer of several."""
+    result = []
+    position = 0
+    while position < len(packets):
+        end = position + 3 + ((packets[position + 1] << 8) | packets[position + 2])
+        result.append(packets[position:end])
+        position = end
+    return result
+
+
+@pytest.mark.parametrize(
+    "sigtype, join, value",
+    [
+        ("d", 1, 1),
+        ("d", 1, 0),
+        ("d", 0x8000, 1),
+        ("db", 5, 1),
+        ("db", 5, 0),
+        ("dp", 7, 1),
+        ("dp", 7, 0),
+        ("a", 1, 0),
+        ("a", 2, 300),
+        ("a", 0x10000, 0xFFFF),
+        ("s", 1, ""),
+        ("s", 3, "hello"),
+        ("s", 0x10000, "x" * 1000),
+    ],
+)
+def test_round_trip(sigtype, join, value):
+    packet = cipclient.encode(sigtype, join, value)
+    assert cipclient.decode(packet) == (sigtype[0], join, value)
+
+
+def test_button_joins_use_button_packets():
+    assert cipclient.encode("d", 5, 1) != cipclient.encode("db", 5, 1)
+    assert cipclient.encode("db", 5, 1) == cipclient.encode("dp", 5, 1)
+    # digital packets are cached, so repeated calls return the same packet
+    assert cipclient.encode("d", 5, 1) is cipclient.encode("d", 5, 1)
+
+
+def test_serial_encodings():
+    packet = cipclient.encode("s", 1, "café")
+    assert cipclient.decode(packet) == ("s", 1, "café")
+    assert cipclient.decode(packet, None) == ("s", 1, "café".encode("latin-1"))
+
+    packet = cipclient.encode("s", 1, "€ 10", "utf-8")
+    assert cipclient.decode(packet, "utf-8") == ("s", 1, "€ 10")
+    assert cipclient.decode(packet, None) == ("s", 1, "€ 10".encode("utf-8"))
+
+    packet = cipclient.encode("s", 1, b"\x00\xff\x80")
+    assert cipclient.decode(packet, None) == ("s", 1, b"\x00\xff\x80")
+    with pytest.raises(UnicodeEncodeError):
+        cipclient.encode("s", 1, "€")
+
+
+def test_chunked_serial():
+    value = bytes(range(256)) * 600
+    packets = split(cipclient.encode("s", 9, value))
+    assert len(packets) == 3
+    assert all(len(packet) <= cipclient._CIP_MAX_FRAME_SIZE for packet in packets)
+    # start flag on the first chunk only, end flag on the last chunk only
+    assert [packet[10] for packet in packets] == [0x01, 0x00, 0x02]
+    chunks = [cipclient.decode(packet, None) for packet in packets]
+    assert all(join == 9 for sigtype, join, chunk in chunks)
+    assert b"".join(chunk for sigtype, join, chunk in chunks) == value
+
+
+def test_chunked_serial_exact_multiple():
+    size = cipclient._MAX_SERIAL_CHUNK
+    packets = split(cipclient.encode("s", 1, "x" * (2 * size)))
+    assert [len(packet) - 11 for packet in packets] == [size, size]
+    assert [packet[10] for packet in packets] == [0x01, 0x02]
+
+
+@pytest.mark.parametrize(
+    "packet",
+    [
+        b"\x0D\x00\x02\x00\x00",
+        b"\x0f\x00\x01\x02",
+        b"\x02\x00\x04\x00\x00\x00\x1f",
+        b"\x05\x00\x05\x00\x00\x02\x03\x1c",
+        b"\x05\x00\x0a\x00\x00\x07\x08\x00\x12\x34\x56\x01\x02\x24",
+        b"\x05\x00\x01\x00",
+    ],
+)
+def test_decode_returns_none_for_other_packets(packet):
+    assert cipclient.decode(packet) is None
+
+
+def test_encode_rejects_unknown_sigtypes():
+    with pytest.raises(ValueError, match="not a valid signal type"):
+        cipclient.encode("x", 1, 1)
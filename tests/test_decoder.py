@@ -0,0 +1,82 @@
+"""Tests for reassembling CIP packets from socket reads."""
+
+import pytest
+
+import cipclient
+import cipfake
+
+PACKETS = [
+    b"\x0D\x00\x02\x00\x00",
+    cipclient.encode("a", 2, 300),
+    cipclient.encode("s", 3, "hello"),
+    cipclient.encode("d", 1, 1),
+    b"\x03\x00\x00",
+]
+
+
+class Decoder:
+    """A _FrameDecoder that collects the packets it reassembles."""
+
+    def __init__(self, recv_size=4096, max_frame_size=cipclient._CIP_MAX_FRAME_SIZE):
+        """Set up the decoder."""
+        self.packets = []
+        self.decoder = cipclient._FrameDecoder(self.handle, recv_size, max_frame_size)
+
+    def handle(self, ciptype, payload):
+        """Collect a packet, copying the payload out of the buffer."""
+        header = bytes((ciptype, len(payload) >> 8, len(payload) & 0xFF))
+        self.packets.append(header + bytes(payload))
+
+    def feed(self, data, step):
+        """Feed `data` as reads of at most `step` bytes.  Returns False on error."""
+        for start in range(0, len(data), step):
+            writable = self.decoder.writable()
+            chunk = data[start : start + min(step, len(writable))]
+            writable[: len(chunk)] = chunk
+            if not self.decoder.feed(len(chunk)):
+                return False
+        return True
+
+
+@pytest.mark.parametrize("step", [1, 2, 3])
+def test_split_reads(step):
+    decoder = Decoder()
+    assert decoder.feed(b"".join(PACKETS), step)
+    assert decoder.packets == PACKETS
+
+
+def test_frame_larger_than_recv_size():
+    decoder = Decoder(recv_size=16)
+    serial = cipclient.encode("s", 1, "x" * 1000)
+    assert decoder.feed(serial + PACKETS[0], 16)
+    assert decoder.packets == [serial, PACKETS[0]]
+    # the grown buffer keeps working for later packets
+    assert decoder.feed(b"".join(PACKETS), 7)
+    assert decoder.packets[2:] == PACKETS
+
+
+def test_oversize_length_header():
+    decoder = Decoder(max_frame_size=100)
+    assert not decoder.feed(b"\x12\x01\x00" + b"\x00" * 10, 13)
+    assert decoder.packets == []
+    # the decoder starts afresh after being reset
+    assert decoder.feed(PACKETS[1], 2)
+    assert decoder.packets == [PACKETS[1]]
+
+
+def test_client_reassembles_split_writes():
+    processor = cipfake.FakeProcessor(write_size=1)
+    processor.set_many([("d", 1, 1), ("a", 2, 300), ("s", 3, "hello" * 100)])
+    processor.start()
+    cip = cipclient.CIPSocketClient("127.0.0.1", 0x03, port=processor.port)
+    cip.start()
+    try:
+        assert cip.wait_connected(5)
+        assert cip.get("d", 1) == 1
+        assert cip.get("a", 2) == 300
+        assert cip.get("s", 3) == "hello" * 100
+        processor.set("a", 2, 301)
+        assert cip.wait_for("a", 2, 301, timeout=5) == 301
+    finally:
+        cip.stop()
+        processor.stop()
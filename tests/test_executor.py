@@ -0,0 +1,181 @@
+"""Tests for the subscriber callback executors."""
+
+# Standard Imports
+import asyncio
+import threading
+
+import pytest
+
+import cipclient
+from conftest import wait_until
+
+
+def test_shutdown_runs_queued_callbacks():
+    executor = cipclient.ThreadedExecutor(workers=1)
+    release = threading.Event()
+    ran = []
+    executor.submit("a", release.wait)
+    for index in range(10):
+        executor.submit("a", ran.append, index)
+    release.set()
+    executor.shutdown()
+    assert ran == list(range(10))
+
+
+def test_submit_after_shutdown_is_discarded():
+    executor = cipclient.ThreadedExecutor(workers=1)
+    executor.shutdown()
+    ran = []
+    executor.submit("a", ran.append, 1)
+    assert ran == []
+    assert executor.dropped == 1
+
+
+def test_shutdown_releases_blocked_producer():
+    executor = cipclient.ThreadedExecutor(workers=1, maxsize=1)
+    release = threading.Event()
+    started = threading.Event()
+
+    def hold():
+        started.set()
+        release.wait()
+
+    executor.submit("a", hold)
+    started.wait(5)
+    executor.submit("a", lambda: None)
+    producer = threading.Thread(target=executor.submit, args=("a", lambda: None))
+    producer.start()
+    stopper = threading.Thread(target=executor.shutdown)
+    stopper.start()
+    producer.join(5)
+    assert not producer.is_alive()
+    release.set()
+    stopper.join(5)
+    assert not stopper.is_alive()
+
+
+def held(executor, key="a"):
+    """Occupy the worker for `key` until the returned event is set."""
+    release = threading.Event()
+    started = threading.Event()
+
+    def hold():
+        started.set()
+        release.wait()
+
+    executor.submit(key, hold)
+    started.wait(5)
+    return release
+
+
+def test_callback_submitting_to_its_own_worker_keeps_order():
+    executor = cipclient.ThreadedExecutor(workers=1)
+    ran = []
+
+    def first():
+        ran.append(1)
+        executor.submit("a", ran.append, 3)
+
+    release = held(executor)
+    executor.submit("a", first)
+    executor.submit("a", ran.append, 2)
+    release.set()
+    assert wait_until(lambda: len(ran) == 3)
+    executor.shutdown()
+    assert ran == [1, 2, 3]
+
+
+def test_callback_submitting_to_its_own_full_worker_does_not_block():
+    executor = cipclient.ThreadedExecutor(workers=1, maxsize=1)
+    ran = []
+
+    def first():
+        ran.append(1)
+        executor.submit("a", ran.append, 3)
+
+    release = held(executor)
+    executor.submit("a", first)
+    release.set()
+    executor.submit("a", ran.append, 2)
+    assert wait_until(lambda: len(ran) == 3)
+    executor.shutdown()
+    assert sorted(ran) == [1, 2, 3]
+    assert executor.dropped == 0
+
+
+@pytest.mark.parametrize(
+    "overflow, expected", [("drop_oldest", [2, 3]), ("drop_newest", [0, 1])]
+)
+def test_threaded_overflow(overflow, expected):
+    executor = cipclient.ThreadedExecutor(workers=1, maxsize=2, overflow=overflow)
+    ran = []
+    release = held(executor)
+    for index in range(4):
+        executor.submit("a", ran.append, index)
+    assert executor.dropped == 2
+    release.set()
+    executor.shutdown()
+    assert ran == expected
+
+
+def test_asyncio_executor_runs_callbacks_in_order_on_the_loop():
+    ran = []
+
+    def record(index):
+        ran.append((index, threading.get_ident()))
+
+    async def test():
+        loop = asyncio.get_running_loop()
+        executor = cipclient.AsyncioExecutor(loop)
+
+        def submit():
+            for index in range(3):
+                executor.submit("a", record, index)
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        thread.join()
+        # nothing runs until the loop gets control
+        assert ran == []
+        # a callback submitted on the loop runs behind those already waiting
+        executor.submit("a", record, 3)
+        await asyncio.sleep(0)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(test())
+    assert ran == [(index, loop_thread) for index in range(4)]
+
+
+def test_asyncio_executor_runs_inline_on_the_loop_when_idle():
+    ran = []
+
+    async def test():
+        executor = cipclient.AsyncioExecutor(asyncio.get_running_loop())
+        executor.submit("a", ran.append, 1)
+        assert ran == [1]
+
+    asyncio.run(test())
+
+
+@pytest.mark.parametrize(
+    "overflow, expected", [("drop_oldest", [2, 3]), ("drop_newest", [0, 1])]
+)
+def test_asyncio_overflow(overflow, expected):
+    ran = []
+
+    async def test():
+        loop = asyncio.get_running_loop()
+        executor = cipclient.AsyncioExecutor(loop, maxsize=2, overflow=overflow)
+
+        def submit():
+            for index in range(4):
+                executor.submit("a", ran.append, index)
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        thread.join()
+        await asyncio.sleep(0)
+        assert executor.dropped == 2
+
+    asyncio.run(test())
+    assert ran == expected
@@ -0,0 +1,26 @@
+"""Tests for reading join state."""
+
+import pytest
+
+
+@pytest.fixture
+def cip(pool):
+    """An unconnected client with a few incoming joins set."""
+    cip = pool.add_client("127.0.0.1", 0x03)
+    cip._processEvents("in", [("d", 1, 1), ("a", 1, 100), ("s", 2, "x")], None)
+    return cip
+
+
+def test_get_range(cip):
+    assert cip.get_range("d", 1, 3) == [1, 0, 0]
+    assert list(cip.get_range("a", 1, 2)) == [100, 0]
+    assert cip.get_range("s", 1, 2) == ["", "x"]
+
+
+@pytest.mark.parametrize(
+    "sigtype, start, end",
+    [("a", -1, 1), ("d", 0, 2), ("a", 5, 2), ("d", 1, 0x8001), ("s", 1, 0x10001)],
+)
+def test_get_range_rejects_invalid_joins(cip, sigtype, start, end):
+    with pytest.raises(ValueError, match="not a valid join range"):
+        cip.get_range(sigtype, start, end)
@@ -0,0 +1,28 @@
+"""Tests for client metrics."""
+
+
+def analog(join, value):
+    """Return the payload of an incoming analog join packet."""
+    payload = b"\x00\x00\x04\x14" + (join - 1).to_bytes(2, "big")
+    return payload + value.to_bytes(2, "big")
+
+
+def test_one_callback_histogram_per_subscription(pool):
+    cip = pool.add_client("127.0.0.1", 0x03)
+    ranged = cip.subscribe_all("a", lambda sigtype, join, value: None)
+    first = cip.subscribe("a", 5, lambda sigtype, join, value: None)
+    second = cip.subscribe("a", 5, lambda sigtype, join, value: None)
+    for join in range(1, 1001):
+        cip._processPayload(0x05, analog(join, 7))
+    cip._flush_incoming()
+
+    callbacks = cip.stats()["histograms"]["callbacks"]
+    assert {name: summary["count"] for name, summary in callbacks.items()} == {
+        ranged.name: 1000,
+        first.name: 1,
+        second.name: 1,
+    }
+
+    cip.unsubscribe(ranged)
+    cip.unsubscribe(first)
+    assert list(cip.stats()["histograms"]["callbacks"]) == [second.name]
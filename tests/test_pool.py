@@ -0,0 +1,124 @@
+"""Tests for PooledCIPClient and CIPClientPool."""
+
+# Standard Imports
+import threading
+import time
+
+import cipfake
+from conftest import wait_until
+
+
+def test_last_value_set_is_last_sent(processor, pool):
+    cip = pool.add_client("127.0.0.1", 0x03, port=processor.port)
+    cip.start()
+    assert cip.wait_connected(5)
+    # widen the gap between storing a value and sending it
+    cip.subscribe("a", 5, lambda sigtype, join, value: time.sleep(0.001), "out")
+
+    def received():
+        return processor.received.get(0x03, {}).get("a", {}).get(5)
+
+    for index in range(1, 101):
+        barrier = threading.Barrier(2)
+
+        def setter(value):
+            barrier.wait()
+            cip.set("a", 5, value)
+
+        threads = [
+            threading.Thread(target=setter, args=(index * 2 + offset,))
+            for offset in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert wait_until(lambda: received() == cip.get("a", 5, "out"), 1)
+    cip.stop()
+
+
+def test_stale_heartbeat_does_not_rearm(processor, pool):
+    cip = pool.add_client(
+        "127.0.0.1", 0x03, port=processor.port, min_reconnect_delay=0.01
+    )
+    cip.start()
+    assert cip.wait_connected(5)
+    generation = cip._generation
+    processor.disconnect()
+    assert wait_until(lambda: cip._generation != generation and cip.connected)
+
+    timer = cip._heartbeat_timer
+    done = threading.Event()
+    pool._call_soon(lambda: (cip._heartbeat(generation), done.set()))
+    assert done.wait(5)
+    assert cip._heartbeat_timer is timer
+    cip.stop()
+
+
+def test_bad_connection_does_not_stop_other_clients(processor, pool):
+    bad = cipfake.FakeProcessor()
+    bad.start()
+    try:
+        good_cip = pool.add_client("127.0.0.1", 0x03, port=processor.port)
+        bad_cip = pool.add_client(
+            "127.0.0.1", 0x03, port=bad.port, min_reconnect_delay=0.01
+        )
+        good_cip.start()
+        bad_cip.start()
+        assert good_cip.wait_connected(5)
+        assert bad_cip.wait_connected(5)
+
+        # a serial packet too short to hold a join number
+        bad.write(b"\x12\x00\x03\x00\x00\x00")
+        assert wait_until(lambda: malformed(bad_cip) == 1)
+        assert wait_until(lambda: connects(bad_cip) == 2)
+        processor.set("a", 1, 5)
+        assert good_cip.wait_for("a", 1, 5, timeout=5) == 5
+
+        # an exception escaping a client's packet handling only drops its
+        # own connection
+        def tracer(direction, ciptype, payload):
+            raise RuntimeError
+
+        assert bad_cip.wait_connected(5)
+        bad_cip.set_tracer(tracer)
+        bad.set("a", 1, 1)
+        assert wait_until(lambda: connects(bad_cip) == 3)
+        bad_cip.set_tracer(None)
+        processor.set("a", 1, 6)
+        assert good_cip.wait_for("a", 1, 6, timeout=5) == 6
+        assert bad_cip.wait_connected(5)
+        bad.set("a", 2, 2)
+        assert bad_cip.wait_for("a", 2, 2, timeout=5) == 2
+    finally:
+        bad.stop()
+
+
+def malformed(cip):
+    """Return the number of malformed packets a client has received."""
+    return cip.stats()["counters"].get("malformed_frames", 0)
+
+
+def connects(cip):
+    """Return the number of times a client has connected."""
+    return cip.stats()["counters"]["connects"]
+
+
+def test_held_button_waits_while_offline(pool):
+    cip = pool.add_client("127.0.0.1", 0x03)
+    repeats = []
+    repeat_buttons = cip._repeat_buttons
+
+    def counting():
+        repeats.append(time.monotonic())
+        repeat_buttons()
+
+    cip._repeat_buttons = counting
+    # connected to the processor but not yet registered
+    cip.socket = object()
+    cip.press(1)
+    time.sleep(1.3)
+    cip.socket = None
+    # the repeat due after 0.5s is held back, and then checked for again
+    # only once per repeat interval rather than continuously
+    assert 1 <= len(repeats) <= 3
@@ -0,0 +1,110 @@
+"""Tests for the index of range subscriptions."""
+
+import cipclient
+
+
+def subscription(start, end):
+    """Return a handle for a range subscription of analog input joins."""
+    return cipclient.SubscriptionHandle("in", "a", start, end, None)
+
+
+def covering(index, joins):
+    """Return the handles covering each join."""
+    return [index.lookup(join) for join in joins]
+
+
+def test_empty():
+    index = cipclient._RangeIndex()
+    assert covering(index, [0, 1, 65535]) == [(), (), ()]
+
+
+def test_overlapping_ranges():
+    index = cipclient._RangeIndex()
+    outer = subscription(10, 30)
+    inner = subscription(15, 20)
+    overlap = subscription(18, 40)
+    for handle in (outer, inner, overlap):
+        index.add(handle)
+    assert covering(index, [9, 10, 14, 15, 17, 18, 20, 21, 30, 31, 40, 41]) == [
+        (),
+        (outer,),
+        (outer,),
+        (outer, inner),
+        (outer, inner),
+        (outer, inner, overlap),
+        (outer, inner, overlap),
+        (outer, overlap),
+        (outer, overlap),
+        (overlap,),
+        (overlap,),
+        (),
+    ]
+
+
+def test_adjacent_and_identical_ranges():
+    index = cipclient._RangeIndex()
+    first = subscription(1, 5)
+    second = subscription(6, 10)
+    same = subscription(6, 10)
+    single = subscription(11, 11)
+    for handle in (first, second, same, single):
+        index.add(handle)
+    assert covering(index, [1, 5, 6, 10, 11, 12]) == [
+        (first,),
+        (first,),
+        (second, same),
+        (second, same),
+        (single,),
+        (),
+    ]
+
+
+def test_removed_ranges():
+    index = cipclient._RangeIndex()
+    outer = subscription(10, 30)
+    inner = subscription(15, 20)
+    adjacent = subscription(31, 35)
+    for handle in (outer, inner, adjacent):
+        index.add(handle)
+    assert index.remove(inner)
+    assert not index.remove(inner)
+    assert covering(index, [9, 10, 15, 20, 21, 30, 31, 35, 36]) == [
+        (),
+        (outer,),
+        (outer,),
+        (outer,),
+        (outer,),
+        (outer,),
+        (adjacent,),
+        (adjacent,),
+        (),
+    ]
+    # the intervals the removed range split off are merged again
+    assert index.intervals[0] == [10, 31, 36]
+    assert index.remove(outer)
+    assert index.remove(adjacent)
+    assert index.intervals == ([], [])
+    assert covering(index, [10, 31]) == [(), ()]
+
+
+def test_removal_keeps_intervals_minimal():
+    index = cipclient._RangeIndex()
+    handles = [subscription(start, 100 - start) for start in range(1, 50, 7)]
+    for handle in handles:
+        index.add(handle)
+    for handle in handles[::2] + handles[1::2]:
+        index.remove(handle)
+    assert index.intervals == ([], [])
+
+
+def test_subscribe_range_dispatch():
+    cip = cipclient.CIPSocketClient("127.0.0.1", 0x03)
+    cip.executor = cipclient.InlineExecutor()
+    changes = []
+    ranged = cip.subscribe_range(
+        "a", 2, 3, lambda sigtype, join, value: changes.append((join, value))
+    )
+    cip._processEvents("in", [("a", 1, 1), ("a", 2, 2), ("a", 3, 3), ("a", 4, 4)])
+    cip.unsubscribe(ranged)
+    cip._processEvents("in", [("a", 2, 5)])
+    assert changes == [(2, 2), (3, 3)]
@@ -0,0 +1,66 @@
+"""Tests for outgoing rate limits."""
+
+# Standard Imports
+import time
+
+import pytest
+
+import cipclient
+from conftest import wait_until
+
+
+@pytest.fixture
+def cip(processor):
+    """A connected CIPSocketClient with a digital rate limit of 5 per second."""
+    cip = cipclient.CIPSocketClient("127.0.0.1", 0x03, port=processor.port)
+    cip.start()
+    assert cip.wait_connected(5)
+    cip.set_rate_limit("d", 5)
+    yield cip
+    cip.stop()
+
+
+def record(processor):
+    """Return a list that collects the (join, value) of each join received."""
+    joins = []
+    processor.on_join = lambda ipid, sigtype, join, value: joins.append((join, value))
+    return joins
+
+
+def test_press_discards_a_held_set(processor, cip):
+    joins = record(processor)
+    cip.set("d", 5, 1)
+    assert processor.wait_received(1, 5)
+    cip.set("d", 5, 0)
+    cip.press(5)
+    # the press is sent at once, and the held set() is never sent after it
+    assert processor.wait_received(2, 5)
+    # past the limit's interval, but before the press repeats
+    time.sleep(0.3)
+    cip.release(5)
+    assert wait_until(lambda: len(joins) == 3)
+    assert joins == [(5, 1), (5, 1), (5, 0)]
+
+
+def test_pulses_are_not_merged(processor, cip):
+    joins = record(processor)
+    cip.pulse(5)
+    cip.pulse(5)
+    cip.press(6)
+    cip.release(6)
+    assert processor.wait_received(6, 5)
+    time.sleep(0.3)
+    assert [value for join, value in joins if join == 5] == [1, 0, 1, 0]
+    assert [value for join, value in joins if join == 6] == [1, 0]
+
+
+def test_set_after_pulse_is_limited(processor, cip):
+    joins = record(processor)
+    cip.pulse(5)
+    cip.set("d", 5, 1)
+    assert processor.wait_received(2, 5)
+    time.sleep(0.1)
+    # the set() waits out the interval started by the pulse
+    assert len(joins) == 2
+    assert wait_until(lambda: len(joins) == 3)
+    assert joins == [(5, 1), (5, 0), (5, 1)]
@@ -0,0 +1,106 @@
+"""Tests for the batching of outgoing packets by SendThread."""
+
+# Standard Imports
+import time
+
+import pytest
+
+import cipclient
+from conftest import wait_until
+
+
+class RecordingSocket:
+    """Stand in for a socket, recording each sendall()."""
+
+    def __init__(self):
+        """Start with nothing sent."""
+        self.sent = []
+
+    def sendall(self, data):
+        """Record one write."""
+        self.sent.append(bytes(data))
+
+
+@pytest.fixture
+def cip():
+    """An unstarted client writing to a RecordingSocket."""
+    cip = cipclient.CIPSocketClient("127.0.0.1", 0x03)
+    cip.socket = RecordingSocket()
+    return cip
+
+
+def run_send_thread(cip):
+    """Start a SendThread for `cip`; stop it with join()."""
+    thread = cipclient.SendThread(cip)
+    thread.start()
+    return thread
+
+
+def packet(join):
+    """Return the packet setting an analog join."""
+    return cipclient.encode("a", join, join)
+
+
+def test_queued_packets_are_sent_together(cip):
+    packets = [packet(join) for join in range(1, 11)]
+    for tx in packets:
+        cip._send(tx)
+    thread = run_send_thread(cip)
+    try:
+        assert wait_until(lambda: cip.socket.sent)
+    finally:
+        thread.join()
+    assert cip.socket.sent == [b"".join(packets)]
+
+
+def test_batches_are_capped(cip):
+    packets = [packet(join) for join in range(1, 11)]
+    # room for two and a half packets
+    cip.max_batch_size = len(packets[0]) * 5 // 2
+    for tx in packets:
+        cip._send(tx)
+    thread = run_send_thread(cip)
+    try:
+        assert wait_until(lambda: len(cip.socket.sent) == 5)
+    finally:
+        thread.join()
+    assert cip.socket.sent == [
+        b"".join(packets[index : index + 2]) for index in range(0, 10, 2)
+    ]
+
+
+def test_oversized_packet_is_sent_alone(cip):
+    cip.max_batch_size = 4
+    cip._send(packet(1))
+    cip._send(packet(2))
+    thread = run_send_thread(cip)
+    try:
+        assert wait_until(lambda: len(cip.socket.sent) == 2)
+    finally:
+        thread.join()
+    assert cip.socket.sent == [packet(1), packet(2)]
+
+
+def test_flush_delay_waits_for_late_packets(cip):
+    cip.max_flush_delay = 0.5
+    thread = run_send_thread(cip)
+    try:
+        cip._send(packet(1))
+        time.sleep(0.1)
+        cip._send(packet(2))
+        assert wait_until(lambda: cip.socket.sent)
+    finally:
+        thread.join()
+    assert cip.socket.sent == [packet(1) + packet(2)]
+
+
+def test_without_flush_delay_packets_go_out_at_once(cip):
+    thread = run_send_thread(cip)
+    try:
+        cip._send(packet(1))
+        assert wait_until(lambda: cip.socket.sent)
+        cip._send(packet(2))
+        assert wait_until(lambda: len(cip.socket.sent) == 2)
+    finally:
+        thread.join()
+    assert cip.socket.sent == [packet(1), packet(2)]
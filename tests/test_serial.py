@@ -0,0 +1,116 @@
+"""Tests for streamed, binary and chunked serial joins."""
+
+# Standard Imports
+import asyncio
+
+import pytest
+
+import cipclient
+from conftest import wait_until
+
+IPID = 0x03
+# several chunk packets long, with every byte value
+BINARY = bytes(range(256)) * 1000
+
+
+def pieces():
+    """Yield the pieces of a value streamed with send_serial()."""
+    yield "start:"
+    yield b"\x00\xff" * 60000
+    yield bytearray(b"middle")
+    yield memoryview(b"x" * 100000)
+    yield ""
+    yield ":end"
+
+
+STREAMED = "start:" + "\x00\xff" * 60000 + "middle" + "x" * 100000 + ":end"
+
+
+@pytest.fixture
+def cip(processor):
+    """Start a CIPSocketClient and stop it afterwards."""
+    cip = cipclient.CIPSocketClient("127.0.0.1", IPID, port=processor.port)
+    cip.start()
+    yield cip
+    cip.stop()
+
+
+def received(processor, join):
+    """Return the last value of a serial join the processor received."""
+    return processor.received.get(IPID, {}).get("s", {}).get(join)
+
+
+def test_send_serial_streams_chunks(processor, cip):
+    assert cip.wait_connected(5)
+    assert cip.send_serial(7, pieces())
+    assert wait_until(lambda: received(processor, 7) == STREAMED, 10)
+    # streamed values are not kept in the client's join state
+    assert cip.get("s", 7, "out") == ""
+
+
+def test_send_serial_while_disconnected():
+    cip = cipclient.CIPSocketClient("127.0.0.1", IPID)
+    assert cip.send_serial(7, pieces()) is False
+    with pytest.raises(ValueError):
+        cip.send_serial(0, pieces())
+
+
+def test_async_send_serial_streams_chunks(processor):
+    async def main():
+        cip = cipclient.AsyncCIPClient("127.0.0.1", IPID, port=processor.port)
+        await cip.start()
+        try:
+            assert await cip.wait_connected(5)
+            assert await cip.send_serial(7, pieces())
+            assert await asyncio.to_thread(
+                wait_until, lambda: received(processor, 7) == STREAMED, 10
+            )
+            assert cip.get("s", 7, "out") == ""
+        finally:
+            await cip.stop()
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("value", [b"\x00\xffbinary\x80", BINARY])
+def test_bytes_values_without_encoding(processor, value):
+    cip = cipclient.CIPSocketClient(
+        "127.0.0.1", IPID, port=processor.port, serial_encoding=None
+    )
+    cip.start()
+    try:
+        assert cip.wait_connected(5)
+        processor.set("s", 3, value)
+        result = cip.wait_for("s", 3, value, timeout=10)
+        assert type(result) is bytes
+        assert result == value
+    finally:
+        cip.stop()
+
+
+def test_reassembly_limit():
+    cip = cipclient.CIPSocketClient("127.0.0.1", IPID)
+    start = cipclient._SERIAL_START
+    end = cipclient._SERIAL_END
+    reassemble = cip._reassemble_serial
+    assert reassemble(5, start, b"a" * cipclient._MAX_SERIAL_SIZE) is None
+    assert reassemble(5, 0, b"b") is None
+    assert cip._serial_chunks[5] is None
+    # the rest of the oversized value is discarded too
+    assert reassemble(5, 0, b"c") is None
+    assert reassemble(5, end, b"d") is None
+    assert 5 not in cip._serial_chunks
+    # and the next value is collected as usual
+    assert reassemble(5, start, b"next ") is None
+    assert reassemble(5, end, b"value") == "next value"
+    assert cip._serial_chunks == {}
+
+
+def test_reassembly_up_to_the_limit():
+    cip = cipclient.CIPSocketClient("127.0.0.1", IPID, serial_encoding=None)
+    size = cipclient._MAX_SERIAL_SIZE
+    assert cip._reassemble_serial(5, cipclient._SERIAL_START, b"a" * (size - 1)) is None
+    assert (
+        cip._reassemble_serial(5, cipclient._SERIAL_END, b"b")
+        == b"a" * (size - 1) + b"b"
+    )
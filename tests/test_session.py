@@ -0,0 +1,171 @@
+"""Tests for recording and replaying CIP sessions."""
+
+# Standard Imports
+import os
+
+import pytest
+
+import cipclient
+import cipfake
+
+IPID = 0x03
+HEARTBEAT = b"\x0D\x00\x02\x00\x00"
+
+
+def write_session(path, records):
+    """Write a session file of (timestamp, tx, ciptype, payload) records."""
+    with open(path, "wb") as file:
+        file.write(cipclient._SESSION_HEADER.pack(b"CIPR", 1))
+        for timestamp, tx, ciptype, payload in records:
+            file.write(
+                cipclient._SESSION_RECORD.pack(timestamp, tx, ciptype, len(payload))
+            )
+            file.write(payload)
+
+
+def analog(join, value):
+    """Return the payload of an incoming analog join packet."""
+    return cipclient.encode("a", join, value)[3:]
+
+
+@pytest.fixture
+def session(processor, tmp_path):
+    """Record a client's session with the fake processor and return its path."""
+    path = str(tmp_path / "session.cipr")
+    processor.set_many([("d", 1, 1), ("a", 2, 300), ("s", 3, "hello")])
+    recorder = cipclient.SessionRecorder(path)
+    cip = cipclient.CIPSocketClient("127.0.0.1", IPID, port=processor.port)
+    cip.set_tracer(recorder)
+    cip.start()
+    try:
+        assert cip.wait_connected(5)
+        cip.set("a", 5, 7)
+        assert processor.wait_received(1, 5)
+        processor.set("a", 2, 301)
+        assert cip.wait_for("a", 2, 301, timeout=5) == 301
+    finally:
+        cip.stop()
+        recorder.close()
+    return path
+
+
+def test_record_and_replay(session):
+    replay = cipclient.SessionReplay(session)
+    try:
+        received = [frame[2] for frame in replay.frames("rx")]
+        sent = [(frame[2], bytes(frame[3])) for frame in replay.frames("tx")]
+        timestamps = [frame[0] for frame in replay.frames()]
+        # registration request, result, the join dump and end-of-query
+        assert received[:2] == [0x0F, 0x02]
+        assert 0x01 in [ciptype for ciptype, payload in sent]
+        assert (0x05, analog(5, 7)) in sent
+        assert timestamps == sorted(timestamps)
+
+        # an unstarted AsyncCIPClient applies the joins without any I/O
+        cip = cipclient.AsyncCIPClient("127.0.0.1", IPID)
+        assert replay.replay(cip) == len(received)
+        assert cip.connected is True
+        assert cip.get("d", 1) == 1
+        assert cip.get("a", 2) == 301
+        assert cip.get("s", 3) == "hello"
+    finally:
+        replay.close()
+
+
+def test_replay_processor(session):
+    processor = cipfake.ReplayProcessor(session)
+    processor.start()
+    cip = cipclient.CIPSocketClient("127.0.0.1", IPID, port=processor.port)
+    cip.start()
+    try:
+        assert cip.wait_connected(5)
+        assert processor.wait_finished(1, 5)
+        assert cip.wait_for("a", 2, 301, timeout=5) == 301
+        assert cip.get("s", 3) == "hello"
+    finally:
+        cip.stop()
+        processor.stop()
+
+
+def test_truncated_tail_is_ignored(tmp_path):
+    path = str(tmp_path / "session.cipr")
+    records = [(1.0, 0, 0x05, analog(1, 1)), (2.0, 1, 0x0D, b"\x00\x00")]
+    write_session(path, records + [(3.0, 0, 0x05, analog(2, 2))])
+    size = os.path.getsize(path)
+    # cut into the last record's payload, and then into its header
+    for cut in (2, cipclient._SESSION_RECORD.size + 2):
+        os.truncate(path, size - cut)
+        replay = cipclient.SessionReplay(path)
+        try:
+            frames = [
+                (timestamp, direction, ciptype, bytes(payload))
+                for timestamp, direction, ciptype, payload in replay.frames()
+            ]
+        finally:
+            replay.close()
+        assert frames == [
+            (1.0, "rx", 0x05, analog(1, 1)),
+            (2.0, "tx", 0x0D, b"\x00\x00"),
+        ]
+
+
+def test_not_a_session_file(tmp_path):
+    path = tmp_path / "session.cipr"
+    path.write_bytes(b"CIPX\x00\x01")
+    with pytest.raises(ValueError, match="not a CIP session file"):
+        cipclient.SessionReplay(str(path))
+
+
+def test_speed_keeps_the_recorded_timing(tmp_path):
+    path = str(tmp_path / "session.cipr")
+    write_session(
+        path,
+        [
+            (100.0, 0, 0x05, analog(1, 1)),
+            (100.0, 0, 0x05, analog(2, 2)),
+            (100.5, 1, 0x0D, b"\x00\x00"),
+            (101.0, 0, 0x05, analog(3, 3)),
+            (103.0, 0, 0x05, analog(4, 4)),
+        ],
+    )
+    replay = cipclient.SessionReplay(path)
+    try:
+        sleeps = []
+        batches = [
+            [bytes(frame[3]) for frame in batch]
+            for batch in replay.batches(speed=2, sleep=sleeps.append)
+        ]
+        assert batches == [
+            [analog(1, 1), analog(2, 2)],
+            [analog(3, 3)],
+            [analog(4, 4)],
+        ]
+        # the injected sleep does not pass time, so each wait is measured
+        # from the start of the replay
+        assert sleeps == [pytest.approx(0.5, abs=0.05), pytest.approx(1.5, abs=0.05)]
+
+        sleeps = []
+        sizes = [
+            len(batch)
+            for batch in replay.batches(speed=None, size=3, sleep=sleeps.append)
+        ]
+        assert sleeps == []
+        assert sizes == [3, 1]
+    finally:
+        replay.close()
+
+
+def test_queued_packets_are_not_recorded(tmp_path):
+    path = str(tmp_path / "session.cipr")
+    recorder = cipclient.SessionRecorder(path)
+    cip = cipclient.CIPSocketClient("127.0.0.1", IPID)
+    cip.set_tracer(recorder)
+    # never written, since the client is not running
+    cip._send(HEARTBEAT)
+    recorder.close()
+    assert recorder.records == 0
+    replay = cipclient.SessionReplay(path)
+    try:
+        assert list(replay.frames()) == []
+    finally:
+        replay.close()
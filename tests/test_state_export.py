@@ -0,0 +1,160 @@
+"""Tests for publishing join state to shared memory."""
+
+# Standard Imports
+import ast
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import cipclient
+
+pytestmark = pytest.mark.skipif(
+    cipclient.shared_memory is None, reason="requires Python 3.8 or later"
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def cip():
+    """An unconnected client, whose export is closed after the test."""
+    cip = cipclient.CIPSocketClient("127.0.0.1", 0x03)
+    yield cip
+    cip.close_export()
+
+
+def read_in_child(name, expression):
+    """Evaluate `expression` with a CIPStateReader in another process."""
+    script = (
+        "import cipclient\n"
+        f"reader = cipclient.CIPStateReader({name!r})\n"
+        f"print(repr({expression}))\n"
+        "reader.close()\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        timeout=30,
+    )
+    assert result.returncode == 0, result.stderr
+    return ast.literal_eval(result.stdout)
+
+
+def test_read_from_another_process(cip):
+    cip._processEvents("in", [("d", 1, 1), ("a", 2, 300), ("s", 3, "hello")])
+    name = cip.export_state()
+    # changes made after the export started are published too
+    cip._processEvents("in", [("a", 3, 7)])
+    cip._processEvents("out", [("d", 9, 1)])
+
+    assert read_in_child(
+        name,
+        '[reader.get("d", 1), reader.get("a", 2), reader.get("s", 3), '
+        'reader.get("d", 9, "out"), reader.get("a", 3000)]',
+    ) == [1, 300, "hello", 1, 0]
+    assert read_in_child(name, 'reader.get_range("a", 1, 4)') == [0, 300, 7, 0]
+    assert read_in_child(name, "reader.snapshot()") == {
+        "d": {1: 1},
+        "a": {2: 300, 3: 7},
+        "s": {3: "hello"},
+    }
+    assert read_in_child(name, 'reader.snapshot("out")') == {
+        "d": {9: 1},
+        "a": {},
+        "s": {},
+    }
+
+
+def test_serial_slots(cip):
+    name = cip.export_state(serial_joins=4, serial_size=16)
+    cip._processEvents(
+        "in", [("s", 1, "abcdefghijklmnop"), ("s", 4, "x"), ("s", 5, "y")]
+    )
+    reader = cipclient.CIPStateReader(name)
+    try:
+        assert reader.serial_joins == 4
+        # values are cut to the slot size less the length prefix
+        assert reader.get("s", 1) == "abcdefghijkl"
+        assert reader.get("s", 4) == "x"
+        # joins above serial_joins are not published
+        assert reader.get("s", 5) == ""
+        assert reader.snapshot()["s"] == {1: "abcdefghijkl", 4: "x"}
+        cip._processEvents("in", [("s", 1, "ab")])
+        assert reader.get("s", 1) == "ab"
+    finally:
+        reader.close()
+
+
+def test_bytes_serials(cip):
+    cip.serial_encoding = None
+    name = cip.export_state()
+    cip._processEvents("in", [("s", 1, b"\x00\xff")])
+    reader = cipclient.CIPStateReader(name)
+    try:
+        assert reader.encoding is None
+        assert reader.get("s", 1) == b"\x00\xff"
+    finally:
+        reader.close()
+
+
+def test_version_and_wait_changed(cip):
+    reader = cipclient.CIPStateReader(cip.export_state())
+    try:
+        version = reader.version
+        assert reader.wait_changed(version, timeout=0.01) is None
+        timer = threading.Timer(0.05, cip._processEvents, ("in", [("a", 1, 1)]))
+        timer.start()
+        changed = reader.wait_changed(version, timeout=5)
+        timer.join()
+        assert changed == version + 1 == reader.version
+        assert reader.get("a", 1) == 1
+    finally:
+        reader.close()
+
+
+def test_connected_flag(cip):
+    reader = cipclient.CIPStateReader(cip.export_state())
+    try:
+        assert reader.connected is False
+        cip._set_connected(True)
+        assert reader.connected is True
+        cip._set_connected(False)
+        assert reader.connected is False
+    finally:
+        reader.close()
+
+
+def test_segment_survives_a_reader_exiting(cip):
+    cip._processEvents("in", [("a", 1, 42)])
+    name = cip.export_state()
+    assert read_in_child(name, 'reader.get("a", 1)') == 42
+    # give the child's resource tracker time to clean up after it
+    time.sleep(0.2)
+    assert read_in_child(name, 'reader.get("a", 1)') == 42
+    reader = cipclient.CIPStateReader(name)
+    assert reader.get("a", 1) == 42
+    reader.close()
+
+
+def test_close_export_unlinks_the_segment(cip):
+    cip._processEvents("in", [("a", 1, 42)])
+    name = cip.export_state()
+    with pytest.raises(RuntimeError, match="already exporting"):
+        cip.export_state()
+    reader = cipclient.CIPStateReader(name)
+    cip.close_export()
+    try:
+        # an attached reader keeps its mapping
+        assert reader.get("a", 1) == 42
+    finally:
+        reader.close()
+    with pytest.raises(FileNotFoundError):
+        cipclient.CIPStateReader(name)
+    # the client can export again
+    cip.export_state(name)
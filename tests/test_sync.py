@@ -0,0 +1,16 @@
+"""Tests for update request handling."""
+
+
+def test_disconnect_during_sync_unmutes_callbacks(pool):
+    cip = pool.add_client("127.0.0.1", 0x03, notify_during_sync=False)
+    changes = []
+    cip.subscribe("a", 1, lambda sigtype, join, value: changes.append(value))
+    cip._begin_sync()
+    cip._processEvents("in", [("a", 1, 5)], None)
+    assert changes == []
+
+    # the connection drops before end-of-query
+    cip._set_connected(False)
+    assert cip._sync_changes == {"d": {}, "a": {}, "s": {}}
+    cip._processEvents("in", [("a", 1, 6)], None)
+    assert changes == [6]
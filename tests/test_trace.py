@@ -0,0 +1,79 @@
+"""Tests for packet tracing."""
+
+# Standard Imports
+import logging
+
+import cipclient
+import cipfake
+from conftest import wait_until
+
+
+def traced(buffer):
+    """Return the (direction, ciptype) of each packet in a TraceBuffer."""
+    return [(direction, ciptype) for t, direction, ciptype, p in list(buffer.frames)]
+
+
+def test_packets_reach_the_tracer(processor):
+    buffer = cipclient.TraceBuffer()
+    cip = cipclient.CIPSocketClient("127.0.0.1", 0x03, port=processor.port)
+    cip.set_tracer(buffer)
+    cip.start()
+    try:
+        assert cip.wait_connected(5)
+        cip.set("a", 5, 7)
+        assert processor.wait_received(1, 5)
+    finally:
+        cip.stop()
+
+    packets = traced(buffer)
+    # a reply can be traced before the write it answers returns, so each
+    # direction is checked on its own
+    received = [ciptype for direction, ciptype in packets if direction == "rx"]
+    written = [ciptype for direction, ciptype in packets if direction == "tx"]
+    assert received[:2] == [0x0F, 0x02]
+    assert written[:2] == [0x01, 0x05]
+    assert 0x0D in written
+    sent = [(frame[2], frame[3]) for frame in buffer.frames if frame[1] == "tx"]
+    assert (0x05, cipclient.encode("a", 5, 7)[3:]) in sent
+
+    dump = cip.dump_trace().splitlines()
+    assert len(dump) == len(packets)
+    assert dump[0].endswith(" rx 0x0f <02>")
+    buffer.clear()
+    assert cip.dump_trace() == ""
+
+
+def test_custom_tracer_and_removal():
+    cip = cipclient.CIPSocketClient("127.0.0.1", 0x03)
+    calls = []
+    cip.set_tracer(lambda direction, ciptype, payload: calls.append(bytes(payload)))
+    cip._processPayload(0x0D, memoryview(b"\x00\x00"))
+    assert calls == [b"\x00\x00"]
+    # a plain function has no buffer to dump
+    assert cip.dump_trace() == ""
+    cip.set_tracer(None)
+    cip._processPayload(0x0D, memoryview(b"\x00\x00"))
+    assert calls == [b"\x00\x00"]
+
+
+def test_trace_is_logged_on_rejected_ipid(caplog):
+    processor = cipfake.FakeProcessor(ipids={0x04})
+    processor.start()
+    cip = cipclient.CIPSocketClient(
+        "127.0.0.1", 0x03, port=processor.port, min_reconnect_delay=1
+    )
+    cip.set_tracer(cipclient.TraceBuffer())
+    with caplog.at_level(logging.WARNING, logger="cipclient"):
+        cip.start()
+        try:
+            assert wait_until(
+                lambda: any("recent CIP packets" in r.message for r in caplog.records)
+            )
+        finally:
+            cip.stop()
+            processor.stop()
+
+    message = next(r.message for r in caplog.records if "recent CIP" in r.message)
+    lines = message.splitlines()[1:]
+    assert " rx 0x0f " in lines[0]
+    assert lines[-1].endswith(" rx 0x02 <ffff02>")
@@ -0,0 +1,95 @@
+"""Tests for the prioritized transmit queue."""
+
+import pytest
+
+import cipclient
+
+HEARTBEAT = b"\x0D\x00\x02\x00\x00"
+CONTROL = cipclient._PRIORITY_CONTROL
+JOINS = cipclient._PRIORITY_JOINS
+BULK = cipclient._PRIORITY_BULK
+
+
+def item(tx):
+    """Return a queue item carrying `tx`."""
+    return (tx, None)
+
+
+def packets(batch):
+    """Return the packets of the items taken from a queue."""
+    return [tx for tx, posted in batch]
+
+
+def test_higher_priorities_are_taken_first():
+    tx_queue = cipclient._TxQueue()
+    assert tx_queue.put(item(b"bulk1"), BULK)
+    assert not tx_queue.put(item(b"join1"), JOINS)
+    tx_queue.put(item(b"bulk2"), BULK)
+    tx_queue.put(item(b"control"), CONTROL)
+    tx_queue.put(item(b"join2"), JOINS)
+    assert len(tx_queue) == 5
+    assert tx_queue.get_nowait() == item(b"control")
+    assert packets(tx_queue.get_batch()) == [b"join1", b"join2", b"bulk1", b"bulk2"]
+    assert len(tx_queue) == 0
+
+
+def test_items_with_a_key_keep_their_order():
+    tx_queue = cipclient._TxQueue()
+    tx_queue.put(item(b"chunk1"), BULK, ("s", 1))
+    tx_queue.put(item(b"chunk2"), BULK, ("s", 1))
+    tx_queue.put(item(b"short1"), JOINS, ("s", 1))
+    tx_queue.put(item(b"short2"), JOINS, ("s", 2))
+    assert packets(tx_queue.get_batch(1)) == [b"short2"]
+    assert packets(tx_queue.get_batch()) == [b"chunk1", b"chunk2", b"short1"]
+    # once the key's items are sent, it may use its own priority again
+    tx_queue.put(item(b"bulk"), BULK)
+    tx_queue.put(item(b"short3"), JOINS, ("s", 1))
+    assert packets(tx_queue.get_batch()) == [b"short3", b"bulk"]
+
+
+def test_get_batch_takes_at_least_size_bytes():
+    tx_queue = cipclient._TxQueue()
+    for index in range(4):
+        tx_queue.put(item(b"x" * 10))
+    assert len(tx_queue.get_batch(15)) == 2
+    assert len(tx_queue.get_batch(15)) == 2
+    assert tx_queue.get_batch(15) == []
+
+
+def test_limits():
+    tx_queue = cipclient._TxQueue({"bulk": 20})
+    tx_queue.put(item(b"x" * 10), BULK)
+    assert not tx_queue.full(BULK)
+    tx_queue.put(item(b"x" * 10), BULK)
+    assert tx_queue.full(BULK)
+    assert not tx_queue.full(JOINS)
+    assert tx_queue.depths() == {"tx_control": 0, "tx_joins": 0, "tx_bulk": 20}
+    assert not tx_queue.wait_room(BULK, 0.01)
+    tx_queue.get_nowait()
+    assert tx_queue.wait_room(BULK, 0.01)
+    tx_queue.put(item(b"x" * 10), BULK)
+    tx_queue.clear()
+    assert len(tx_queue) == 0
+    assert not tx_queue.full(BULK)
+
+
+def test_control_traffic_has_no_limit():
+    with pytest.raises(ValueError, match="not a transmit priority with a limit"):
+        cipclient._TxQueue({"control": 100})
+
+
+def test_heartbeat_overtakes_a_queued_serial():
+    cip = cipclient.CIPSocketClient("127.0.0.1", 0x03)
+    cip.connected = True
+    value = "x" * 300000
+    cip._processEvents("out", [("s", 1, value)])
+    cip._processEvents("out", [("s", 1, "y")])
+    cip._send(HEARTBEAT, None, CONTROL)
+
+    assert cip.tx_queue.get_nowait()[0] == HEARTBEAT
+    chunks = packets(cip.tx_queue.get_batch())
+    # each chunk is queued on its own, behind which control traffic waits
+    assert len(chunks) == 6
+    assert all(len(tx) <= cipclient._CIP_MAX_FRAME_SIZE for tx in chunks)
+    assert b"".join(chunks[:-1]) == cipclient.encode("s", 1, value)
+    assert chunks[-1] == cipclient.encode("s", 1, "y")
@@ -0,0 +1,94 @@
+"""Tests for wait_for()."""
+
+# Standard Imports
+import asyncio
+import threading
+
+import pytest
+
+import cipclient
+
+
+@pytest.fixture
+def cip():
+    """An unstarted client, whose incoming joins are applied directly."""
+    return cipclient.CIPSocketClient("127.0.0.1", 0x03)
+
+
+def wait_in_thread(cip, *args, **kwargs):
+    """Call wait_for() in a thread and return the thread and its result."""
+    result = []
+    thread = threading.Thread(
+        target=lambda: result.append(cip.wait_for(*args, **kwargs)), daemon=True
+    )
+    thread.start()
+    return thread, result
+
+
+def test_already_matching(cip):
+    cip._processEvents("in", [("a", 1, 5)])
+    assert cip.wait_for("a", 1, 5, timeout=0) == 5
+    assert cip._waiters["in"]["a"] == {}
+
+
+def test_predicate_may_read_the_client(cip):
+    cip._processEvents("in", [("a", 2, 10)])
+    # the predicate takes the join lock through get(), so must run without it
+    thread, result = wait_in_thread(
+        cip, "a", 1, lambda value: value > cip.get("a", 2), timeout=5
+    )
+    cip._processEvents("in", [("a", 1, 3)])
+    cip._processEvents("in", [("a", 1, 11)])
+    thread.join(5)
+    assert not thread.is_alive()
+    assert result == [11]
+    assert cip._waiters["in"]["a"] == {}
+
+
+def test_each_waiter_is_woken_once(cip):
+    calls = []
+    thread, result = wait_in_thread(
+        cip, "d", 1, lambda value: calls.append(value) or value, timeout=5
+    )
+    while not calls:
+        pass
+    cip._processEvents("in", [("d", 1, 1), ("d", 1, 0), ("d", 1, 1)])
+    thread.join(5)
+    assert result == [1]
+    # once the first change matches, later changes no longer test it
+    assert calls == [0, 1]
+
+
+def test_timeout(cip):
+    assert cip.wait_for("a", 1, 5, timeout=0.05) is None
+    assert cip._waiters["in"]["a"] == {}
+    # a later match does not call the expired waiter
+    cip._processEvents("in", [("a", 1, 5)])
+    assert cip.get("a", 1) == 5
+
+
+def test_timeout_removes_only_its_own_waiter(cip):
+    thread, result = wait_in_thread(cip, "a", 1, 5, timeout=5)
+    assert cip.wait_for("a", 1, 5, timeout=0.05) is None
+    assert len(cip._waiters["in"]["a"][1]) == 1
+    cip._processEvents("in", [("a", 1, 5)])
+    thread.join(5)
+    assert result == [5]
+    assert cip._waiters["in"]["a"] == {}
+
+
+def test_async_predicate_may_read_the_client():
+    cip = cipclient.AsyncCIPClient("127.0.0.1", 0x03)
+
+    async def test():
+        cip._processEvents("in", [("a", 2, 10)])
+        waiting = asyncio.ensure_future(
+            cip.wait_for("a", 1, lambda value: value > cip.get("a", 2), timeout=5)
+        )
+        await asyncio.sleep(0)
+        cip._processEvents("in", [("a", 1, 11)])
+        assert await waiting == 11
+        assert await cip.wait_for("a", 1, 12, timeout=0.05) is None
+        assert cip._waiters["in"]["a"] == {}
+
+    asyncio.run(test())